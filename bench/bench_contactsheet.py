@@ -0,0 +1,101 @@
+import os
+import sys
+import time
+import shutil
+import asyncio
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import catalog  # noqa: E402
+import contactsheet  # noqa: E402
+
+# 使い方: python bench/bench_contactsheet.py [カード数] [同時に合成する人数]
+# 一覧画像の合成中にイベントループがどれだけ止まるかを、その場で合成する場合とプロセスプールの場合で比べる
+# Pillow が必要。サムネイルは一時ディレクトリに作り、最後に削除する
+
+
+def make_thumbs(directory: str, n: int) -> dict:
+    from PIL import Image
+    paths = {}
+    for no in range(1, n + 1):
+        im = Image.new("RGB", (240, 320), ((no * 37) % 256, (no * 91) % 256, (no * 53) % 256))
+        paths[no] = os.path.join(directory, f"{no}_thumb.jpg")
+        im.save(paths[no], "JPEG", quality=80)
+    return paths
+
+
+async def measure_lag(coro):
+    # 10ms ごとに起きるタスクの遅れの最大値 = イベントループが止まっていた時間
+    lag = 0.0
+    done = False
+
+    async def ticker():
+        nonlocal lag
+        while not done:
+            t = time.perf_counter()
+            await asyncio.sleep(0.01)
+            lag = max(lag, time.perf_counter() - t - 0.01)
+
+    task = asyncio.create_task(ticker())
+    await asyncio.sleep(0.02)
+    start = time.perf_counter()
+    await coro
+    elapsed = time.perf_counter() - start
+    done = True
+    await task
+    return elapsed, lag
+
+
+async def inline(cards, users):
+    for _ in range(users):
+        contactsheet.render(cards)
+
+
+async def pooled(cat, owned_sets, path_for):
+    await asyncio.gather(*(
+        contactsheet.get(user, "bench", cat, owned, path_for) for user, owned in enumerate(owned_sets)
+    ))
+
+
+async def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 150
+    users = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    if not contactsheet.available():
+        raise RuntimeError("Pillow がインストールされていません")
+
+    directory = tempfile.mkdtemp(prefix="bench_sheet_")
+    try:
+        paths = make_thumbs(directory, n)
+        cat = catalog.Catalog("bench", [
+            {"no": no, "url": "", "chname": f"ch{no % 7}", "rarity": "N", "rate": 1.0, "title": ""}
+            for no in range(1, n + 1)
+        ])
+        owned_sets = [catalog.Owned(range(1, n + 1, 2 + u % 3)) for u in range(users)]
+        path_for = lambda it: paths[it["no"]]  # noqa: E731
+        cards = [(no, paths[no], no % 2 == 1) for no in range(1, n + 1)]
+        print(f"cards: {n}, users: {users}, workers: {contactsheet.WORKERS}")
+
+        # 初回はワーカーの起動を含むので、先に1回合成しておく
+        await contactsheet.get(-1, "bench", cat, catalog.Owned([]), path_for)
+        size = len(contactsheet.render(cards))
+        print(f"{'sheet size':<24} {size / 1024:8.0f} KiB")
+
+        elapsed, lag = await measure_lag(inline(cards, users))
+        print(f"{'inline':<24} {elapsed:8.3f}s  max loop stall {lag * 1000:8.1f}ms")
+        elapsed, lag = await measure_lag(pooled(cat, owned_sets, path_for))
+        print(f"{'process pool':<24} {elapsed:8.3f}s  max loop stall {lag * 1000:8.1f}ms")
+        elapsed, lag = await measure_lag(pooled(cat, owned_sets, path_for))
+        print(f"{'cached':<24} {elapsed:8.3f}s  max loop stall {lag * 1000:8.1f}ms")
+
+        contactsheet.invalidate(0, "bench")
+        owned_sets[1].cards.add(2)
+        start = time.perf_counter()
+        await pooled(cat, owned_sets, path_for)
+        print(f"{'after 2 new cards':<24} {time.perf_counter() - start:8.3f}s  {contactsheet.stats}")
+    finally:
+        contactsheet.shutdown()
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
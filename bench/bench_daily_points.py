@@ -0,0 +1,84 @@
+import os
+import sys
+import time
+import asyncio
+import asyncpg
+from datetime import timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import db  # noqa: E402
+
+# 使い方: DATABASE_URL=... python bench/bench_daily_points.py [ユーザー数]
+# 専用スキーマを作ってその中で計測し、最後に削除する
+SCHEMA = "bench_daily_points"
+
+
+async def old_add_daily_points_for_all(pool, daily_pt):
+    # 以前の実装（1行ずつ UPDATE）
+    async with pool.acquire() as conn:
+        rows = await conn.fetch("SELECT user_id, points FROM user_points")
+        for r in rows:
+            new = min(15, r["points"] + daily_pt)
+            await conn.execute(
+                "UPDATE user_points SET points=$1 WHERE user_id=$2",
+                new, r["user_id"]
+            )
+
+
+async def seed(pool, n):
+    # 付与の反映日は数日前からばらつかせる
+    async with pool.acquire() as conn:
+        await conn.execute("TRUNCATE user_points")
+        today = await conn.fetchval("SELECT jst_today()")
+        await conn.copy_records_to_table(
+            "user_points",
+            records=((i, f"user{i:07d}", i % 16, today - timedelta(days=i % 4)) for i in range(n)),
+            columns=["user_id", "username", "points", "accrued_on"],
+        )
+        await conn.execute("ANALYZE user_points")
+
+
+async def read_points(pool, n, count):
+    # 遅延付与を含めてポイントを読む（get_points のキャッシュなしの経路）
+    for i in range(0, n, max(1, n // count)):
+        async with pool.acquire() as conn:
+            await db._ensure_user(conn, i, f"user{i:07d}")
+
+
+async def timed(label, coro):
+    start = time.perf_counter()
+    res = await coro
+    print(f"{label:<28} {time.perf_counter() - start:8.3f}s  {res if res is not None else ''}")
+
+
+async def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    url = os.getenv("DATABASE_URL")
+    if not url:
+        raise RuntimeError("DATABASE_URL が設定されていません")
+
+    conn = await asyncpg.connect(url)
+    await conn.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE; CREATE SCHEMA {SCHEMA}")
+    await conn.close()
+    pool = await asyncpg.create_pool(url, server_settings={"search_path": SCHEMA})
+    try:
+        await db.init_db(pool)
+        print(f"users: {n}")
+        await seed(pool, n)
+        await timed("old (row-by-row)", old_add_daily_points_for_all(pool, 3))
+        await seed(pool, n)
+        await timed("new (single UPDATE)", db.grant_points_all(pool, 3))
+        await seed(pool, n)
+        await timed("new (batched, 10000)", db.grant_points_all(pool, 3, batch_size=10_000))
+        # 現在は日次の付与を書き込まない（db.py の遅延付与）。読む側の負担を測る
+        await seed(pool, n)
+        await timed("lazy accrual (read 1000)", read_points(pool, n, 1000))
+    finally:
+        await pool.close()
+        conn = await asyncpg.connect(url)
+        await conn.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+        await conn.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,165 @@
+import io
+import os
+import sys
+import time
+import shutil
+import asyncio
+import tempfile
+
+import aiohttp
+import asyncpg
+from aiohttp import web
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import db  # noqa: E402
+import dbpool  # noqa: E402
+import images  # noqa: E402
+
+# 使い方: DATABASE_URL=... python bench/bench_images.py [枚数] [Drive の応答遅延(秒)]
+# Google Drive の代わりにローカルの HTTP サーバー（リダイレクト・遅延・429・確認ページ入り）を立て、
+# 画像の取得とキャッシュからの配信を確かめる。専用スキーマと一時ディレクトリは最後に削除する
+# Pillow が必要（テスト画像を作るのに使う）
+SCHEMA = "bench_images"
+GACHATYPE = "bench"
+
+
+def make_image(no: int) -> bytes:
+    from PIL import Image
+    im = Image.new("RGB", (2000, 1500), ((no * 37) % 256, (no * 91) % 256, (no * 53) % 256))
+    buf = io.BytesIO()
+    im.save(buf, "JPEG", quality=90)
+    return buf.getvalue()
+
+
+class FakeDrive:
+    # /uc?id=N → /content/N へリダイレクト（Drive の共有リンクと同じ形）
+    # id=throttled は1回目だけ 429、id=confirm はウイルススキャンの確認ページ（HTML）を返す
+    def __init__(self, count: int, latency: float):
+        self.latency = latency
+        self.images = {str(no): make_image(no) for no in range(1, count + 1)}
+        self.images["throttled"] = make_image(0)
+        self.requests = 0
+        self.throttled = False
+
+    async def handle_uc(self, request):
+        raise web.HTTPFound(f"/content/{request.query['id']}")
+
+    async def handle_content(self, request):
+        self.requests += 1
+        await asyncio.sleep(self.latency)
+        key = request.match_info["id"]
+        if key == "throttled" and not self.throttled:
+            self.throttled = True
+            return web.Response(status=429)
+        if key == "confirm":
+            return web.Response(text="<html>Google Drive can't scan this file for viruses.</html>",
+                                content_type="text/html")
+        return web.Response(body=self.images[key], content_type="image/jpeg")
+
+    async def start(self, port: int):
+        app = web.Application()
+        app.router.add_get("/uc", self.handle_uc)
+        app.router.add_get("/content/{id}", self.handle_content)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, "127.0.0.1", port).start()
+        return runner
+
+
+def free_port() -> int:
+    import socket
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def get_all(session, urls):
+    start = time.perf_counter()
+    bodies = await asyncio.gather(*(_get(session, u) for u in urls))
+    return time.perf_counter() - start, bodies
+
+
+async def _get(session, url):
+    async with session.get(url) as resp:
+        resp.raise_for_status()
+        return await resp.read()
+
+
+async def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 40
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.3
+    url = os.getenv("DATABASE_URL")
+    if not url:
+        raise RuntimeError("DATABASE_URL が設定されていません")
+    if images.Image is None:
+        raise RuntimeError("Pillow がインストールされていません")
+
+    drive = FakeDrive(n, latency)
+    drive_port, image_port = free_port(), free_port()
+    origin = f"http://127.0.0.1:{drive_port}"
+    items = [{"no": no, "url": f"{origin}/uc?id={no}"} for no in range(1, n + 1)]
+    items.append({"no": n + 1, "url": f"{origin}/uc?id=throttled"})
+    items.append({"no": n + 2, "url": f"{origin}/uc?id=confirm"})
+
+    conn = await asyncpg.connect(url)
+    await conn.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE; CREATE SCHEMA {SCHEMA}")
+    await conn.close()
+    pool = await dbpool.create_pool(url, server_settings={"search_path": SCHEMA})
+    cache_dir = tempfile.mkdtemp(prefix="bench_images_")
+    images.store = store = images.ImageStore(cache_dir, f"http://127.0.0.1:{image_port}")
+    drive_runner = await drive.start(drive_port)
+    image_runner = await images.start_server("127.0.0.1", image_port)
+    try:
+        await db.init_db(pool)
+        print(f"cards: {n} (+1 throttled, +1 confirm page), origin latency {latency:.2f}s")
+
+        start = time.perf_counter()
+        fetched, _ = await store.sync(pool, GACHATYPE, items)
+        print(f"{'first sync':<28} {time.perf_counter() - start:8.3f}s  fetched {fetched}/{len(items)}")
+        requests = drive.requests
+        start = time.perf_counter()
+        fetched, changed = await store.sync(pool, GACHATYPE, items)
+        print(f"{'second sync':<28} {time.perf_counter() - start:8.3f}s  fetched {fetched}, "
+              f"origin requests {drive.requests - requests} (confirm page is retried)")
+        assert not changed
+
+        # 再起動後: card_assets から読み直すだけで取り直さない
+        store2 = images.ImageStore(cache_dir, store.public_url)
+        await store2.load(pool)
+        fresh = [it for it in items if not store2._is_current(GACHATYPE, it)]
+        print(f"{'stale after restart':<28} {len(fresh):8d}")
+
+        total = sum(os.path.getsize(os.path.join(root, f))
+                    for root, _, files in os.walk(cache_dir) for f in files)
+        print(f"{'cache size':<28} {total / 1024:8.0f} KiB")
+
+        good = items[:n]
+        async with aiohttp.ClientSession() as session:
+            t_origin, origin_bodies = await get_all(session, [it["url"] for it in good])
+            t_full, full_bodies = await get_all(session, [store.url_for(GACHATYPE, it) for it in good])
+            t_thumb, thumb_bodies = await get_all(session, [store.url_for(GACHATYPE, it, thumb=True) for it in good])
+        print(f"{'origin (all)':<28} {t_origin:8.3f}s  {sum(map(len, origin_bodies)) / 1024:8.0f} KiB")
+        print(f"{'cache full (all)':<28} {t_full:8.3f}s  {sum(map(len, full_bodies)) / 1024:8.0f} KiB")
+        print(f"{'cache thumb (all)':<28} {t_thumb:8.3f}s  {sum(map(len, thumb_bodies)) / 1024:8.0f} KiB")
+
+        for it, body in zip(good, full_bodies):
+            asset = store._assets[(GACHATYPE, it["no"], "full")]
+            with open(store.path(asset["filename"]), "rb") as f:
+                assert f.read() == body, it
+        assert store.url_for(GACHATYPE, items[-1]) == items[-1]["url"]
+        changed = dict(items[0], url=items[1]["url"])
+        assert store.url_for(GACHATYPE, changed) == changed["url"]
+        print("integrity: OK")
+    finally:
+        await image_runner.cleanup()
+        await drive_runner.cleanup()
+        await store.close()
+        await pool.close()
+        shutil.rmtree(cache_dir, ignore_errors=True)
+        conn = await asyncpg.connect(url)
+        await conn.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+        await conn.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,128 @@
+import os
+import sys
+import time
+import random
+import asyncio
+import asyncpg
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import db  # noqa: E402
+import dbpool  # noqa: E402
+import migrations  # noqa: E402
+
+# 使い方: DATABASE_URL=... python bench/bench_progress.py [ユーザー数...]
+# user_cards を数えるランキング・収集状況と、集計テーブル（マイグレーション5）を読む場合を比べる
+# ユーザー数ごとに専用スキーマを作り直して計測し、最後に削除する
+SCHEMA = "bench_progress"
+GT = "autumn_2025"
+ITEMS = 200
+RARITIES = ["UR", "SSR", "SR", "R", "N"]
+REPEAT = 20
+
+OLD_LEADERBOARD = """
+SELECT uc.user_id, count(*) AS owned
+FROM user_cards uc JOIN gacha_items gi ON gi.gachatype = uc.gachatype AND gi.no = uc.card_no
+WHERE uc.gachatype=$1
+GROUP BY uc.user_id
+ORDER BY owned DESC, uc.user_id
+LIMIT 10
+"""
+OLD_PROGRESS = """
+SELECT gi.rarity, count(*)
+FROM user_cards uc JOIN gacha_items gi ON gi.gachatype = uc.gachatype AND gi.no = uc.card_no
+WHERE uc.user_id=$1 AND uc.gachatype=$2
+GROUP BY gi.rarity
+"""
+
+
+async def seed(conn, n):
+    # 所持枚数は人によって 1〜ITEMS 枚にばらつかせる
+    rng = random.Random(n)
+    await conn.copy_records_to_table(
+        "gacha_items",
+        records=((GT, i, "", f"ch{i % 12}", RARITIES[i % len(RARITIES)], 1.0, "") for i in range(1, ITEMS + 1)),
+        columns=["gachatype", "no", "url", "chname", "rarity", "rate", "title"],
+    )
+    await conn.copy_records_to_table(
+        "user_points",
+        records=((i, f"user{i:07d}", 0) for i in range(n)),
+        columns=["user_id", "username", "points"],
+    )
+    await conn.copy_records_to_table(
+        "user_cards",
+        records=((i, GT, c) for i in range(n) for c in rng.sample(range(1, ITEMS + 1), rng.randint(1, ITEMS))),
+        columns=["user_id", "gachatype", "card_no"],
+    )
+
+
+async def timed(fn, *args):
+    await fn(*args)
+    start = time.perf_counter()
+    for _ in range(REPEAT):
+        await fn(*args)
+    return (time.perf_counter() - start) / REPEAT * 1000
+
+
+async def run(url, n):
+    conn = await asyncpg.connect(url)
+    await conn.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE; CREATE SCHEMA {SCHEMA}")
+    await conn.close()
+    pool = await dbpool.create_pool(url, server_settings={"search_path": SCHEMA})
+    try:
+        async with pool.acquire() as conn:
+            await migrations.run(conn, target=4)
+            await seed(conn, n)
+            cards = await conn.fetchval("SELECT count(*) FROM user_cards")
+            start = time.perf_counter()
+            await migrations.run(conn)
+            backfill = time.perf_counter() - start
+            await conn.execute("VACUUM ANALYZE")
+        user = n // 2
+
+        async def old_leaderboard():
+            async with pool.acquire() as conn:
+                return await conn.fetch(OLD_LEADERBOARD, GT)
+
+        async def old_progress():
+            async with pool.acquire() as conn:
+                return await conn.fetch(OLD_PROGRESS, user, GT)
+
+        print(f"users: {n}, user_cards: {cards}, backfill {backfill:.3f}s")
+        print(f"  {'leaderboard (count)':<26} {await timed(old_leaderboard):9.3f}ms")
+        print(f"  {'leaderboard (progress)':<26} {await timed(db.get_leaderboard, pool, GT, 10):9.3f}ms")
+        print(f"  {'progress (count)':<26} {await timed(old_progress):9.3f}ms")
+        print(f"  {'progress (progress)':<26} {await timed(db.get_progress, pool, user, GT):9.3f}ms")
+
+        # 集計が所持カードと一致するか（抽選で増やしてから確かめる）
+        async with pool.acquire() as conn:
+            await conn.execute("UPDATE user_points SET points = 100")
+        for i in range(0, n, max(1, n // 200)):
+            await db.perform_multi_pull(pool, i, GT, [{"no": random.randint(1, ITEMS)} for _ in range(10)])
+        async with pool.acquire() as conn:
+            bad = await conn.fetchval("""
+            SELECT count(*) FROM user_progress p
+            FULL JOIN (SELECT user_id, gachatype, count(*) AS n FROM user_cards GROUP BY 1, 2) c
+              USING (user_id, gachatype)
+            WHERE p.owned IS DISTINCT FROM c.n
+            """)
+        print(f"  integrity: {'OK' if not bad else f'{bad} mismatched rows'}")
+    finally:
+        await pool.close()
+
+
+async def main():
+    sizes = [int(a) for a in sys.argv[1:]] or [1_000, 10_000]
+    url = os.getenv("DATABASE_URL")
+    if not url:
+        raise RuntimeError("DATABASE_URL が設定されていません")
+    try:
+        for n in sizes:
+            await run(url, n)
+    finally:
+        conn = await asyncpg.connect(url)
+        await conn.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+        await conn.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
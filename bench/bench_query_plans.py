@@ -0,0 +1,116 @@
+import os
+import sys
+import json
+import asyncio
+import asyncpg
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import migrations  # noqa: E402
+
+# 使い方: DATABASE_URL=... python bench/bench_query_plans.py [ユーザー数]
+# 整数キー化（マイグレーション2）の前後で、よく使うクエリの実行計画と時間を比べる
+SCHEMA = "bench_query_plans"
+CARDS_PER_USER = 40
+ITEMS = 200
+GT = "autumn_2025"
+
+OLD_QUERIES = [
+    ("points by username",
+     "SELECT points FROM user_points WHERE username=$1", ("user0004242",)),
+    ("cards by username",
+     "SELECT card_no FROM user_cards WHERE username=$1 AND gachatype=$2",
+     ("user0004242", GT)),
+    ("items ordered by no",
+     "SELECT no, chname FROM gacha_items WHERE gachatype=$1 ORDER BY CAST(no AS INTEGER)",
+     (GT,)),
+]
+
+NEW_QUERIES = [
+    ("points by user_id",
+     "SELECT points FROM user_points WHERE user_id=$1", (4242,)),
+    ("cards by user_id",
+     "SELECT card_no FROM user_cards WHERE user_id=$1 AND gachatype=$2",
+     (4242, GT)),
+    ("items ordered by no",
+     "SELECT no, chname FROM gacha_items WHERE gachatype=$1 ORDER BY no",
+     (GT,)),
+]
+
+
+async def seed_old(conn, n):
+    await conn.copy_records_to_table(
+        "gacha_items",
+        records=((GT, str(i), "", f"ch{i}", "N", 1.0, "") for i in range(1, ITEMS + 1)),
+        columns=["gachatype", "no", "url", "chname", "rarity", "rate", "title"],
+    )
+    await conn.copy_records_to_table(
+        "user_points",
+        records=((f"user{i:07d}", i % 16) for i in range(n)),
+        columns=["username", "points"],
+    )
+    await conn.copy_records_to_table(
+        "user_cards",
+        records=((f"user{i:07d}", GT, str(c))
+                 for i in range(n) for c in range(1, CARDS_PER_USER + 1)),
+        columns=["username", "gachatype", "card_no"],
+    )
+    await conn.execute("ANALYZE")
+
+
+async def seed_new(conn, n):
+    await conn.copy_records_to_table(
+        "user_points",
+        records=((i, f"user{i:07d}", i % 16) for i in range(n)),
+        columns=["user_id", "username", "points"],
+    )
+    await conn.copy_records_to_table(
+        "user_cards",
+        records=((i, GT, c) for i in range(n) for c in range(1, CARDS_PER_USER + 1)),
+        columns=["user_id", "gachatype", "card_no"],
+    )
+    await conn.execute("VACUUM ANALYZE")
+
+
+async def explain(conn, queries):
+    for label, sql, args in queries:
+        # 1回目はキャッシュを温めるだけ
+        await conn.fetch(sql, *args)
+        plan = await conn.fetchval(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {sql}", *args)
+        top = json.loads(plan)[0]
+        node = top["Plan"]
+        print(f"  {label:<22} {top['Execution Time']:8.3f}ms  "
+              f"{node['Node Type']}"
+              + (f" on {node['Relation Name']}" if "Relation Name" in node else "")
+              + (f" (heap fetches {node['Heap Fetches']})" if "Heap Fetches" in node else ""))
+        text = await conn.fetch(f"EXPLAIN {sql}", *args)
+        for r in text:
+            print(f"      {r[0]}")
+
+
+async def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+    url = os.getenv("DATABASE_URL")
+    if not url:
+        raise RuntimeError("DATABASE_URL が設定されていません")
+
+    conn = await asyncpg.connect(url, server_settings={"search_path": SCHEMA})
+    await conn.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE; CREATE SCHEMA {SCHEMA}")
+    try:
+        print(f"users: {n}, cards/user: {CARDS_PER_USER}")
+        await migrations.run(conn, target=1)
+        await seed_old(conn, n)
+        print("before (username / TEXT card_no)")
+        await explain(conn, OLD_QUERIES)
+
+        # 旧テーブルは legacy_* に退避される
+        await migrations.run(conn)
+        await seed_new(conn, n)
+        print("after (user_id / INTEGER card_no)")
+        await explain(conn, NEW_QUERIES)
+    finally:
+        await conn.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+        await conn.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,437 @@
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+from collections import defaultdict
+from datetime import datetime, timezone
+
+import asyncpg
+import discord
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import db  # noqa: E402
+import dbpool  # noqa: E402
+import reveal  # noqa: E402
+import cooldown  # noqa: E402
+import dispatcher  # noqa: E402
+from pull_log import PullLogWriter  # noqa: E402
+from cogs import gacha  # noqa: E402
+
+# 使い方: DATABASE_URL=... python bench/loadtest.py --users 2000 --duration 60
+# イベント時の負荷を、Discord を使わずローカルの PostgreSQL に対して再現する
+#  - /gacha コマンドとガチャボタン（単発・10連）を偽の Interaction で直接呼ぶ
+#  - --double-press の割合でボタンを連打し、重複分が Dispatcher で弾かれるかを見る
+#  - Discord API は遅延とレート制限（429 → retry_after 待ち）を真似たモックに置き換える
+#  - ユーザーは --accrue-days 日前まで付与済みの状態で始め、最初の操作で日次ポイントの遅延付与が反映される
+#  - 途中で全ユーザーへの一括付与（grant_points_all、addpointall と同じ）を走らせる
+#  - 終了後にポイントの収支・NEW 判定・抽選履歴の件数が合うかを確認する
+# 専用スキーマを作ってその中で実行し、最後に削除する
+SCHEMA = "bench_loadtest"
+INITIAL_POINTS = 1000
+
+
+# ─── Discord API のモック ──────────────────────────────────
+class MockDiscordHTTP:
+    # チャンネルごと（と任意で全体）の固定ウィンドウでレート制限を真似る
+    # 制限に当たったら 429 を数え、discord.py と同じく retry_after だけ待って再送する
+    # インタラクションの応答・フォローアップは Bot 全体の制限（50回/秒）の対象外なので、
+    # 全体の制限は既定では掛けない
+    def __init__(self, latency_ms: float, global_limit: int = 0,
+                 channel_limit: int = 5, channel_period: float = 5.0):
+        self.latency = latency_ms / 1000
+        self.global_limit = global_limit
+        self.channel_limit = channel_limit
+        self.channel_period = channel_period
+        self._global = [0.0, 0]
+        self._channels = defaultdict(lambda: [0.0, 0])
+        self.requests = 0
+        self.rate_limited = 0
+        self.latencies = []
+
+    def _take(self, window, limit, period, now):
+        if now - window[0] >= period:
+            window[0], window[1] = now, 0
+        if window[1] >= limit:
+            return window[0] + period - now
+        window[1] += 1
+        return 0.0
+
+    async def request(self, route: str, channel_id=None):
+        start = time.perf_counter()
+        while True:
+            now = time.monotonic()
+            retry = 0.0
+            if self.global_limit:
+                retry = self._take(self._global, self.global_limit, 1.0, now)
+            if not retry and channel_id is not None and route != "interaction":
+                retry = self._take(self._channels[channel_id], self.channel_limit, self.channel_period, now)
+            if not retry:
+                break
+            self.rate_limited += 1
+            await asyncio.sleep(retry)
+        self.requests += 1
+        await asyncio.sleep(random.lognormvariate(0, 0.5) * self.latency)
+        self.latencies.append(time.perf_counter() - start)
+
+
+class FakeMessage:
+    def __init__(self, http, channel_id):
+        self.http = http
+        self.channel_id = channel_id
+
+    async def edit(self, **kwargs):
+        await self.http.request("edit", self.channel_id)
+        return self
+
+
+class FakeFollowup:
+    def __init__(self, interaction):
+        self.interaction = interaction
+        self.content = None
+        self.view = None
+
+    async def send(self, content=None, **kwargs):
+        if kwargs.get("ephemeral"):
+            # エフェメラルは Webhook のルートで、チャンネルの制限を受けない
+            await self.interaction.http.request("interaction", self.interaction.channel_id)
+        else:
+            await self.interaction.http.request("followup", self.interaction.channel_id)
+        self.content = content
+        self.view = kwargs.get("view", self.view)
+        return FakeMessage(self.interaction.http, self.interaction.channel_id)
+
+
+class FakeResponse:
+    def __init__(self, interaction):
+        self.interaction = interaction
+        self.done = False
+        self.view = None
+        self.content = None
+
+    def is_done(self):
+        return self.done
+
+    async def _respond(self, content=None, **kwargs):
+        # 初回応答はインタラクション用のルートで、チャンネルの制限を受けない
+        await self.interaction.http.request("interaction", self.interaction.channel_id)
+        self.done = True
+        self.content = content
+        self.view = kwargs.get("view", self.view)
+
+    async def send_message(self, content=None, **kwargs):
+        await self._respond(content, **kwargs)
+
+    async def edit_message(self, content=None, **kwargs):
+        await self._respond(content, **kwargs)
+
+    async def defer(self, **kwargs):
+        await self.interaction.http.request("interaction", self.interaction.channel_id)
+        self.done = True
+
+
+class FakeUser:
+    def __init__(self, user_id: int):
+        self.id = user_id
+        self.name = f"load{user_id:07d}"
+        self.display_name = self.name
+
+
+class FakeThread(discord.Thread):
+    # コマンド側の isinstance(channel, discord.Thread) を通すための最小限のスレッド
+    def __init__(self, channel_id: int):
+        self.id = channel_id
+        self.name = f"gacha-thread-load{channel_id}"
+
+
+class FakeInteraction:
+    _next_id = 0
+
+    def __init__(self, http, client, user, channel):
+        FakeInteraction._next_id += 1
+        self.id = FakeInteraction._next_id
+        self.http = http
+        self.client = client
+        self.user = user
+        self.channel = channel
+        self.channel_id = channel.id
+        self.created_at = datetime.now(timezone.utc)
+        self.response = FakeResponse(self)
+        self.followup = FakeFollowup(self)
+
+    async def edit_original_response(self, **kwargs):
+        await self.http.request("interaction", self.channel_id)
+        self.response.content = kwargs.get("content", self.response.content)
+        self.response.view = kwargs.get("view", self.response.view)
+
+
+class FakeBot:
+    def __init__(self, pool, cooldowns, pull_log):
+        self.db_pool = pool
+        self.cooldowns = cooldowns
+        self.pull_log = pull_log
+        self.dispatcher = dispatcher.Dispatcher()
+
+
+class CountingPullLog(PullLogWriter):
+    # クライアント側で観測した成功件数を数える（DB の履歴件数と突き合わせる）
+    def __init__(self, pool):
+        super().__init__(pool)
+        self.pulls = defaultdict(int)
+        self.new = defaultdict(int)
+
+    async def record(self, user_id, username, gachatype, item, is_new):
+        self.pulls[user_id] += 1
+        if is_new:
+            self.new[user_id] += 1
+        await super().record(user_id, username, gachatype, item, is_new)
+
+
+# ─── 計測 ────────────────────────────────────────────
+def pct(data, q):
+    if not data:
+        return 0.0
+    data = sorted(data)
+    return data[min(len(data) - 1, int(q * len(data)))]
+
+
+class Recorder:
+    def __init__(self):
+        self.samples = defaultdict(list)  # 操作 → [(終了時刻, 秒)]
+        self.outcomes = defaultdict(int)
+
+    def add(self, op, seconds):
+        self.samples[op].append((time.monotonic(), seconds))
+
+    def window(self, op, start=None, end=None):
+        return [s for t, s in self.samples[op]
+                if (start is None or t >= start) and (end is None or t <= end)]
+
+
+async def user_loop(args, bot, cog, http, user, channel, gachatypes, rec, deadline):
+    await asyncio.sleep(random.uniform(0, args.ramp))
+    while time.monotonic() < deadline:
+        gt = random.choice(gachatypes)
+        inter = FakeInteraction(http, bot, user, channel)
+        start = time.perf_counter()
+        await cog.gacha.callback(cog, inter, gt)
+        rec.add("command", time.perf_counter() - start)
+        view = inter.response.view or inter.followup.view
+        if view is None:
+            rec.outcomes["command rejected"] += 1
+            await asyncio.sleep(random.uniform(1, 3))
+            continue
+        for _ in range(args.presses):
+            if time.monotonic() >= deadline:
+                break
+            await asyncio.sleep(random.uniform(*args.think))
+            multi = random.random() < args.multi_ratio
+            press = FakeInteraction(http, bot, user, channel)
+            # ボタンは custom_id から作り直して呼ぶ（再起動後のクリックと同じ経路）
+            item = view.children[1 if multi else 0]
+            match = item.__discord_ui_compiled_template__.fullmatch(item.custom_id)
+            button = await type(item).from_custom_id(press, item.item, match)
+            op = "multi" if multi else "single"
+            presses = [(press, button)]
+            if random.random() < args.double_press:
+                # 同じボタンをもう一度押す（1回目の処理中に届く）
+                extra = FakeInteraction(http, bot, user, channel)
+                presses.append((extra, await type(item).from_custom_id(extra, item.item, match)))
+            start = time.perf_counter()
+            await asyncio.gather(*(b.callback(p) for p, b in presses))
+            rec.add(op, time.perf_counter() - start)
+            for p, _ in presses:
+                if p.response.content == dispatcher.BUSY_MESSAGE:
+                    rec.outcomes[f"{op} coalesced"] += 1
+                elif p.followup.content and "不足" in p.followup.content:
+                    rec.outcomes[f"{op} no points"] += 1
+                else:
+                    rec.outcomes[f"{op} ok"] += 1
+
+
+async def sample_pool(pool, samples, deadline):
+    while time.monotonic() < deadline:
+        samples.append((pool.get_size(), pool.get_idle_size()))
+        await asyncio.sleep(0.01)
+
+
+async def bulk_grant(args, pool, rec, granted):
+    await asyncio.sleep(args.grant_at)
+    start = time.monotonic()
+    affected, capped = await db.grant_points_all(pool, args.grant_points, args.grant_batch)
+    end = time.monotonic()
+    granted.append(args.grant_points)
+    rec.grant = (start, end, affected)
+
+
+async def seed(pool, n, accrue_days):
+    async with pool.acquire() as conn:
+        since = await conn.fetchval("SELECT jst_today() - $1::integer", accrue_days)
+        await conn.copy_records_to_table(
+            "user_points",
+            records=((i, f"load{i:07d}", INITIAL_POINTS, since) for i in range(1, n + 1)),
+            columns=["user_id", "username", "points", "accrued_on"],
+        )
+        await conn.execute("ANALYZE user_points")
+
+
+async def verify(pool, pull_log, n, granted):
+    # 収支: 最終ポイント = 初期 + 日次の遅延付与 + 一括付与 - 抽選回数（抽選履歴の件数）
+    # NEW 判定: is_new の件数 = 所持カードの行数 = 収集状況の集計（user_progress）
+    grant = sum(granted)
+    async with pool.acquire() as conn:
+        rows = await conn.fetch("""
+        SELECT p.user_id, accrued_points(p.points, p.accrued_on, $1) AS points,
+               COALESCE(e.pulls, 0) AS pulls, COALESCE(e.new, 0) AS new,
+               COALESCE(c.cards, 0) AS cards, COALESCE(g.owned, 0) AS progress
+        FROM user_points p
+        LEFT JOIN (
+          SELECT user_id, count(*) AS pulls, count(*) FILTER (WHERE is_new) AS new
+          FROM pull_events GROUP BY user_id
+        ) e USING (user_id)
+        LEFT JOIN (
+          SELECT user_id, count(*) AS cards FROM user_cards GROUP BY user_id
+        ) c USING (user_id)
+        LEFT JOIN (
+          SELECT user_id, sum(owned) AS owned FROM user_progress GROUP BY user_id
+        ) g USING (user_id)
+        """, db.MAX_POINTS)
+    problems = defaultdict(int)
+    for r in rows:
+        uid = r["user_id"]
+        if r["points"] < 0:
+            problems["negative points"] += 1
+        if r["points"] != INITIAL_POINTS + grant - r["pulls"]:
+            problems["lost update / double spend"] += 1
+        if r["new"] != r["cards"]:
+            problems["NEW mismatch"] += 1
+        if r["progress"] != r["cards"]:
+            problems["progress mismatch"] += 1
+        if r["pulls"] != pull_log.pulls.get(uid, 0):
+            problems["pull log mismatch"] += 1
+        if r["new"] != pull_log.new.get(uid, 0):
+            problems["NEW reported mismatch"] += 1
+    if len(rows) != n:
+        problems["missing users"] += n - len(rows)
+    return problems
+
+
+def report(args, rec, http, pool_samples, pool, pull_log, problems, elapsed):
+    ok = sum(v for k, v in rec.outcomes.items() if k.endswith(" ok"))
+    cards = sum(pull_log.pulls.values())
+    print(f"users: {args.users}, duration: {elapsed:.1f}s, frame interval: {reveal.FRAME_INTERVAL}s")
+    print(f"pulls/sec: {cards / elapsed:.1f} cards, {ok / elapsed:.1f} button presses")
+    for k in sorted(rec.outcomes):
+        print(f"  {k:<20} {rec.outcomes[k]}")
+
+    print(f"{'latency (ms)':<22}{'n':>8}{'p50':>10}{'p95':>10}{'p99':>10}")
+    bulk = getattr(rec, "grant", None)
+    for op in ("command", "single", "multi"):
+        rows = [(op, rec.window(op))]
+        if bulk:
+            rows.append((f"  during bulk grant", rec.window(op, bulk[0], bulk[1] + 1.0)))
+        for label, data in rows:
+            print(f"{label:<22}{len(data):>8}" + "".join(f"{pct(data, q) * 1000:>10.1f}" for q in (0.5, 0.95, 0.99)))
+
+    sat = sum(1 for size, idle in pool_samples if idle == 0 and size >= pool.get_max_size())
+    acq = dbpool.acquire_stats.snapshot()
+    print(f"pool: max {pool.get_max_size()}, saturated {sat / max(1, len(pool_samples)):.1%} of samples, "
+          f"acquire wait p95 {acq['p95'] * 1000:.1f}ms / p99 {acq['p99'] * 1000:.1f}ms / max {acq['max'] * 1000:.1f}ms")
+    print(f"discord: {http.requests} requests, {http.rate_limited} rate limited (429), "
+          f"p99 {pct(http.latencies, 0.99) * 1000:.1f}ms")
+    if bulk:
+        print(f"bulk grant: {bulk[1] - bulk[0]:.3f}s, {bulk[2]} users")
+    print(f"pull log: {pull_log.stats}")
+    if problems:
+        for k, v in problems.items():
+            print(f"INTEGRITY: {k}: {v} users")
+    else:
+        print("integrity: OK")
+
+
+async def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--users", type=int, default=1000)
+    ap.add_argument("--channels", type=int, default=200, help="ガチャ用スレッドの数")
+    ap.add_argument("--duration", type=float, default=60.0)
+    ap.add_argument("--ramp", type=float, default=5.0, help="ユーザーが揃うまでの秒数")
+    ap.add_argument("--presses", type=int, default=5, help="/gacha 1回あたりのボタン操作数")
+    ap.add_argument("--think", type=float, nargs=2, default=(0.5, 2.0), help="操作間隔（最小 最大 秒）")
+    ap.add_argument("--multi-ratio", type=float, default=0.3)
+    ap.add_argument("--double-press", type=float, default=0.0, help="ボタンを2回続けて押す割合")
+    ap.add_argument("--frame-interval", type=float, default=reveal.FRAME_INTERVAL)
+    ap.add_argument("--latency-ms", type=float, default=80.0, help="Discord API の応答時間（中央値）")
+    ap.add_argument("--global-limit", type=int, default=0, help="全体のレート制限（回/秒、0 で無効）")
+    ap.add_argument("--accrue-days", type=int, default=1, help="開始時点で未反映の日次付与の日数")
+    ap.add_argument("--grant-at", type=float, default=None, help="一括付与を走らせる時刻（既定は中間）")
+    ap.add_argument("--grant-points", type=int, default=3)
+    ap.add_argument("--grant-batch", type=int, default=None)
+    ap.add_argument("--pool-max", type=int, default=None)
+    args = ap.parse_args()
+    if args.grant_at is None:
+        args.grant_at = args.duration / 2
+
+    url = os.getenv("DATABASE_URL")
+    if not url:
+        raise RuntimeError("DATABASE_URL が設定されていません")
+    os.chdir(os.path.join(os.path.dirname(__file__), ".."))  # data/ の相対パス用
+
+    # 収支を単純に検算できるよう、上限による切り捨てを無効にする
+    db.MAX_POINTS = 10 ** 9
+    # 同じユーザーが続けて /gacha を開けるよう、クールダウンは短くする
+    gacha.COOLDOWN = 1.0
+    reveal.FRAME_INTERVAL = args.frame_interval
+
+    conn = await asyncpg.connect(url)
+    await conn.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE; CREATE SCHEMA {SCHEMA}")
+    await conn.close()
+    overrides = {"server_settings": {"search_path": SCHEMA}}
+    if args.pool_max:
+        overrides["max_size"] = args.pool_max
+    pool = await dbpool.create_pool(url, **overrides)
+    problems = None
+    try:
+        await db.init_db(pool)
+        await db.sync_gacha_types(pool, "data/gacha_types.json")
+        for gt in db.get_gacha_types():
+            await db.load_gacha_data(pool, gt["csv_path"], gt["gachatype"])
+        gachatypes = [gt["gachatype"] for gt in db.get_gacha_types()]
+        await seed(pool, args.users, args.accrue_days)
+        granted = []
+        granted.append(args.accrue_days * await db.get_daily_auto_points(pool))
+
+        pull_log = CountingPullLog(pool)
+        pull_log.start()
+        bot = FakeBot(pool, cooldown.MemoryCooldownStore(), pull_log)
+        cog = gacha.GachaCog(bot)
+        http = MockDiscordHTTP(args.latency_ms, args.global_limit)
+        channels = [FakeThread(10_000 + i) for i in range(args.channels)]
+        rec = Recorder()
+        pool_samples = []
+
+        started = time.monotonic()
+        deadline = started + args.duration
+        await asyncio.gather(
+            sample_pool(pool, pool_samples, deadline),
+            bulk_grant(args, pool, rec, granted),
+            *(user_loop(args, bot, cog, http, FakeUser(i), channels[i % len(channels)],
+                        gachatypes, rec, deadline)
+              for i in range(1, args.users + 1)),
+        )
+        elapsed = time.monotonic() - started
+        await pull_log.close()
+
+        problems = await verify(pool, pull_log, args.users, granted)
+        report(args, rec, http, pool_samples, pool, pull_log, problems, elapsed)
+    finally:
+        await pool.close()
+        conn = await asyncpg.connect(url)
+        await conn.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+        await conn.close()
+    if problems:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
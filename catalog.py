@@ -0,0 +1,133 @@
+import logging
+from collections import Counter, OrderedDict, defaultdict
+
+import images
+
+logger = logging.getLogger(__name__)
+
+PAGE_SIZE = 20  # No順一覧の1ページあたりの件数
+OWNED_CACHE_SIZE = 4096  # 所持カードを保持するユーザー×種別の上限
+RARITY_ORDER = ["UR", "SSR", "SR", "R", "N"]  # 表示順（これ以外のレア度は後ろに名前順）
+
+
+def _no_key(no):
+    try:
+        return (0, int(no), "")
+    except (TypeError, ValueError):
+        return (1, 0, str(no))
+
+
+# ─── ガチャ種別ごとのカタログ ─────────────────────────────
+# 並び替え・キャラ別グループ化・表示用の行文字列を前計算しておく
+class Catalog:
+    def __init__(self, gachatype: str, items: list):
+        self.gachatype = gachatype
+        self.items = sorted((dict(it) for it in items), key=lambda it: _no_key(it["no"]))
+        self.by_no = {it["no"]: it for it in self.items}
+        self.rarity_counts = Counter(it["rarity"] for it in self.items)
+        # リンク先は画像キャッシュがあればそちら（画像の取得後に set_items し直して差し替える）
+        links = {it["no"]: images.store.url_for(gachatype.lower(), it, stable=True) for it in self.items}
+
+        # No順: (no, 所持時の行, 未所持時の行)
+        self.num_lines = [
+            (
+                it["no"],
+                f":ballot_box_with_check: **No.{it['no']}** {it['chname']} {it['title']} [🔗 Link]({links[it['no']]})",
+                f":blue_square: **No.{it['no']}** {it['chname']} {it['title']}",
+            )
+            for it in self.items
+        ]
+        self.num_page_count = max(1, (len(self.items) + PAGE_SIZE - 1) // PAGE_SIZE)
+
+        # キャラ順: [(chname, [(no, 所持時の行, 未所持時の行)])]
+        grouped = defaultdict(list)
+        for it in self.items:
+            grouped[it["chname"]].append((
+                it["no"],
+                f":ballot_box_with_check: **No.{it['no']}** {it['title']} [🔗 Link]({links[it['no']]})",
+                f":blue_square: **No.{it['no']}** {it['title']}",
+            ))
+        self.ch_pages = sorted(grouped.items(), key=lambda x: x[0])
+        self.ch_page_count = len(self.ch_pages)
+
+    def num_page(self, owned, page: int) -> str:
+        key = ("num", page)
+        text = owned.pages.get(key)
+        if text is None:
+            start = page * PAGE_SIZE
+            text = owned.pages[key] = "\n".join(
+                have if no in owned.cards else missing
+                for no, have, missing in self.num_lines[start:start + PAGE_SIZE]
+            )
+        return text
+
+    def ch_page(self, owned, index: int):
+        chname, lines = self.ch_pages[index]
+        key = ("ch", index)
+        text = owned.pages.get(key)
+        if text is None:
+            text = owned.pages[key] = "\n".join(
+                have if no in owned.cards else missing
+                for no, have, missing in lines
+            )
+        return chname, text
+
+
+_catalogs = {}
+
+
+def set_items(gachatype: str, items: list) -> Catalog:
+    cat = _catalogs[gachatype.lower()] = Catalog(gachatype, items)
+    # 表示内容が変わるので描画済みページは捨てる
+    for (_, gt), owned in _owned.items():
+        if gt == gachatype.lower():
+            owned.pages.clear()
+    return cat
+
+
+def get(gachatype: str):
+    return _catalogs.get(gachatype.lower())
+
+
+# ─── ユーザーごとの所持カード ─────────────────────────────
+class Owned:
+    def __init__(self, cards):
+        self.cards = set(cards)
+        self.pages = {}  # 描画済みページのメモ
+
+
+_owned = OrderedDict()
+
+
+def get_owned(user_id: int, gachatype: str):
+    key = (user_id, gachatype.lower())
+    owned = _owned.get(key)
+    if owned is not None:
+        _owned.move_to_end(key)
+    return owned
+
+
+def put_owned(user_id: int, gachatype: str, cards) -> Owned:
+    key = (user_id, gachatype.lower())
+    owned = _owned[key] = Owned(cards)
+    _owned.move_to_end(key)
+    while len(_owned) > OWNED_CACHE_SIZE:
+        _owned.popitem(last=False)
+    return owned
+
+
+def drop_owned(user_id: int, gachatype: str):
+    # 他のプロセスでカードが増えた時に捨てる（次に読む時に DB から読み直す）
+    _owned.pop((user_id, gachatype.lower()), None)
+
+
+def clear_owned():
+    _owned.clear()
+
+
+def add_owned(user_id: int, gachatype: str, cards):
+    # 新規入手したカードをキャッシュにその場で反映する（未キャッシュなら何もしない）
+    owned = _owned.get((user_id, gachatype.lower()))
+    if owned is not None and cards:
+        owned.cards.update(cards)
+        owned.pages.clear()
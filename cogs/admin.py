@@ -1,6 +1,7 @@
 import discord
 from discord.ext import commands
 import db
+import dbpool
 import logging
 
 logger = logging.getLogger(__name__)
@@ -15,31 +16,39 @@ class AdminCog(commands.Cog):
         if ctx.channel.name != "gacha-dev":
             return await ctx.send("このコマンドは gacha-dev チャンネル内でのみ使用できます。")
         uname = member.name
-        old = await db.get_points(self.bot.db_pool, uname)
-        new = min(15, old + pointnumber)
-        await db.set_points(self.bot.db_pool, uname, new)
+        old, new = await db.grant_points_user(self.bot.db_pool, member.id, uname, pointnumber)
         await ctx.send(f"{member.display_name} に {pointnumber}pt 付与しました。({old} → {new})")
-        logger.info(f"Admin {ctx.author.name} used addpointuser: member={uname}, pointnumber={pointnumber}")
+        logger.info("Admin %s used addpointuser: member=%s, pointnumber=%s", ctx.author.name, uname, pointnumber)
 
     @commands.command(name="addpointall")
     @commands.has_permissions(administrator=True)
     async def addpointall(self, ctx, pointnumber: int):
         if ctx.channel.name != "gacha-dev":
             return await ctx.send("このコマンドは gacha-dev チャンネル内でのみ使用できます。")
-        cnt = 0
-        async with self.bot.db_pool.acquire() as conn:
-            rows = await conn.fetch("SELECT username, points FROM user_points")
-            for r in rows:
-                old = r["points"]
-                new = min(15, old + pointnumber)
-                await conn.execute(
-                    "UPDATE user_points SET points=$1 WHERE username=$2",
-                    new, r["username"]
-                )
-                if new > old:
-                    cnt += 1
-        await ctx.send(f"全ユーザーに {pointnumber}pt 付与しました (増えたユーザー数: {cnt})")
-        logger.info(f"Admin {ctx.author.name} used addpointall: pointnumber={pointnumber}")
+        async with self.bot.dispatcher.lane("admin"):
+            cnt, _ = await db.grant_points_all(self.bot.db_pool, pointnumber)
+        await ctx.send(f"全ユーザーに {pointnumber}pt 付与しました (ポイントが変わったユーザー数: {cnt})")
+        logger.info("Admin %s used addpointall: pointnumber=%s", ctx.author.name, pointnumber)
+
+    @commands.command(name="addpointlist")
+    @commands.has_permissions(administrator=True)
+    async def addpointlist(self, ctx, pointnumber: int):
+        # 添付したテキストファイル（1行に1ユーザー。ID・メンション・ユーザー名のいずれか）にまとめて付与
+        if ctx.channel.name != "gacha-dev":
+            return await ctx.send("このコマンドは gacha-dev チャンネル内でのみ使用できます。")
+        if not ctx.message.attachments:
+            return await ctx.send("ユーザーIDまたはユーザー名を1行ずつ書いたテキストファイルを添付してください。")
+        raw = await ctx.message.attachments[0].read()
+        targets = raw.decode("utf-8-sig", errors="replace").splitlines()
+        async with self.bot.dispatcher.lane("admin"):
+            cnt, missing = await db.grant_points_bulk(self.bot.db_pool, targets, pointnumber)
+        msg = f"指定ユーザーに {pointnumber}pt 付与しました (ポイントが変わったユーザー数: {cnt})"
+        if missing:
+            msg += f"\n未登録のユーザー ({len(missing)}件): {', '.join(missing[:20])}"
+            if len(missing) > 20:
+                msg += " ..."
+        await ctx.send(msg)
+        logger.info("Admin %s used addpointlist: pointnumber=%s, users=%d", ctx.author.name, pointnumber, len(targets))
 
     @commands.command(name="addpointauto")
     @commands.has_permissions(administrator=True)
@@ -50,8 +59,52 @@ class AdminCog(commands.Cog):
             return await ctx.send("0以上の値を指定してください。")
         old = await db.get_daily_auto_points(self.bot.db_pool)
         await db.set_daily_auto_points(self.bot.db_pool, pointnumber)
-        await ctx.send(f"自動付与ポイントを {old} → {pointnumber} に変更しました。")
-        logger.info(f"Admin {ctx.author.name} used addpointauto: pointnumber={pointnumber}")
+        await ctx.send(f"自動付与ポイントを {old} → {pointnumber} に変更しました。（明日0時の付与から適用）")
+        logger.info("Admin %s used addpointauto: pointnumber=%s", ctx.author.name, pointnumber)
+
+    @commands.command(name="revealmodeall")
+    @commands.has_permissions(administrator=True)
+    async def revealmodeall(self, ctx, mode: str):
+        # on: 全ユーザーを即時表示にする / off: ユーザーごとの設定に戻す
+        if ctx.channel.name != "gacha-dev":
+            return await ctx.send("このコマンドは gacha-dev チャンネル内でのみ使用できます。")
+        if mode not in ("on", "off"):
+            return await ctx.send("on または off を指定してください。")
+        async with self.bot.dispatcher.lane("admin"):
+            await db.set_instant_reveal_all(self.bot.db_pool, mode == "on")
+        await ctx.send(f"全体の即時表示モードを {mode} にしました。")
+        logger.info("Admin %s used revealmodeall: mode=%s", ctx.author.name, mode)
+
+    @commands.command(name="cachestats")
+    @commands.has_permissions(administrator=True)
+    async def cachestats(self, ctx):
+        if ctx.channel.name != "gacha-dev":
+            return await ctx.send("このコマンドは gacha-dev チャンネル内でのみ使用できます。")
+        st = db.points_cache.stats()
+        await ctx.send(
+            f"ポイントキャッシュ: {st['size']}件 / ヒット率 {st['hit_rate']:.1%} "
+            f"(hit {st['hits']}, miss {st['misses']}, 無効化 {st['invalidations']})"
+        )
+
+    @commands.command(name="dbstats")
+    @commands.has_permissions(administrator=True)
+    async def dbstats(self, ctx):
+        # プールの待ち時間とステートメントごとの所要時間（ms）
+        if ctx.channel.name != "gacha-dev":
+            return await ctx.send("このコマンドは gacha-dev チャンネル内でのみ使用できます。")
+        st = dbpool.stats(self.bot.db_pool)
+        p, a = st["pool"], st["acquire"]
+        lines = [
+            f"プール: {p['size']}本 (空き {p['idle']}, min {p['min']}, max {p['max']})",
+            f"acquire待ち: {a['count']}回 p50 {a['p50'] * 1000:.1f} / p95 {a['p95'] * 1000:.1f} / "
+            f"p99 {a['p99'] * 1000:.1f} / max {a['max'] * 1000:.1f}ms (タイムアウト {a['errors']})",
+        ]
+        for name, q in st["queries"].items():
+            lines.append(
+                f"{name}: {q['count']}回 p50 {q['p50'] * 1000:.1f} / p95 {q['p95'] * 1000:.1f} / "
+                f"max {q['max'] * 1000:.1f}ms (エラー {q['errors']})"
+            )
+        await ctx.send("```\n" + "\n".join(lines)[:1900] + "\n```")
 
 # ここがポイント。必ず await して Cog を登録します
 async def setup(bot):
@@ -1,165 +1,275 @@
 import discord
 from discord.ext import commands
 from discord import app_commands
-import asyncio
-import time
+import io
 from collections import defaultdict
 import db
+import dbpool
+import reveal
+import images
+import contactsheet
+import metrics
 import logging
+from catalog import RARITY_ORDER
 
 logger = logging.getLogger(__name__)
 COOLDOWN = 10.0  # 秒
+MULTI_PULL = 10  # 連続ガチャの回数
+LEADERBOARD_SIZE = 10
+
+
+async def gachatype_autocomplete(interaction: discord.Interaction, current: str):
+    # レジストリに登録されたガチャ種別から候補を作る
+    current = current.lower()
+    return [
+        app_commands.Choice(name=gt["display_name"], value=gt["gachatype"])
+        for gt in db.get_gacha_types()
+        if current in gt["display_name"].lower() or current in gt["gachatype"]
+    ][:25]
+
+def stateless_view(*items) -> discord.ui.View:
+    # ボタンの状態は custom_id に持たせるので、View はどこにも保持しない
+    # （終了済みにしておくと送信時に ViewStore へ登録されない）
+    view = discord.ui.View(timeout=None)
+    for item in items:
+        view.add_item(item)
+    view.stop()
+    return view
+
+
+# ─── 取得カード一覧のページ送り ─────────────────────────────
+# custom_id = list:{num|ch}:{ガチャ種別}:{ユーザーID}:{移動先ページ}:{ボタン位置}
+class ListPageButton(
+    discord.ui.DynamicItem[discord.ui.Button],
+    template=r"list:(?P<mode>num|ch):(?P<gt>[^:]+):(?P<user>\d+):(?P<page>\d+):(?P<slot>[a-z]+)",
+):
+    LABELS = {"first": "<<", "prev": "<", "next": ">", "last": ">>"}
+
+    def __init__(self, mode: str, gachatype: str, user_id: int, page: int, slot: str, disabled: bool = False):
+        super().__init__(discord.ui.Button(
+            label=self.LABELS[slot],
+            custom_id=f"list:{mode}:{gachatype}:{user_id}:{page}:{slot}",
+            disabled=disabled,
+        ))
+        self.mode = mode
+        self.gachatype = gachatype
+        self.user_id = user_id
+        self.page = page
 
-class PaginatorView(discord.ui.View):
-    def __init__(self, data, collected):
-        super().__init__(timeout=None)
-        self.data = data
-        self.collected = collected
-        self.page = 0
-        self.max_page = (len(data) - 1) // 20
-
-    def get_lines(self):
-        start = self.page * 20
-        end = start + 20
-        lines = []
-        for item in self.data[start:end]:
-            no = item["no"]
-            chname = item["chname"]
-            title = item["title"]
-            url = item["url"]
-            if no in self.collected:
-                lines.append(
-                    f":ballot_box_with_check: **No.{no}** {chname} {title} [🔗 Link]({url})"
-                )
-            else:
-                lines.append(
-                    f":blue_square: **No.{no}** {chname} {title}"
-                )
-        return lines
-
-    async def update(self, interaction: discord.Interaction):
-        embed = discord.Embed(
-            title=f"{interaction.user.name} の一覧 (Page {self.page+1}/{self.max_page+1})",
-            description="\n".join(self.get_lines())
-        )
-        await interaction.response.edit_message(embed=embed, view=self)
-
-    @discord.ui.button(label="<<")
-    async def first(self, interaction: discord.Interaction, button: discord.ui.Button):
-        self.page = 0
-        await self.update(interaction)
-
-    @discord.ui.button(label="<")
-    async def prev(self, interaction: discord.Interaction, button: discord.ui.Button):
-        if self.page > 0:
-            self.page -= 1
-        await self.update(interaction)
+    @classmethod
+    async def from_custom_id(cls, interaction: discord.Interaction, item: discord.ui.Button, match):
+        return cls(match["mode"], match["gt"], int(match["user"]), int(match["page"]), match["slot"])
 
-    @discord.ui.button(label=">")
-    async def next(self, interaction: discord.Interaction, button: discord.ui.Button):
-        if self.page < self.max_page:
-            self.page += 1
-        await self.update(interaction)
+    async def callback(self, interaction: discord.Interaction):
+        if interaction.user.id != self.user_id:
+            return await interaction.response.send_message(
+                "自分の一覧のみ操作できます", ephemeral=True
+            )
+        gt = db.get_gacha_type(self.gachatype)
+        if gt is None:
+            return await interaction.response.send_message(
+                "指定されたガチャが見つかりません", ephemeral=True
+            )
 
-    @discord.ui.button(label=">>")
-    async def last(self, interaction: discord.Interaction, button: discord.ui.Button):
-        self.page = self.max_page
-        await self.update(interaction)
+        async def work(interaction):
+            embed, view = await build_list_page(
+                interaction.client.db_pool, self.mode, gt, self.user_id, interaction.user.name, self.page
+            )
+            await interaction.edit_original_response(embed=embed, view=view)
 
+        await interaction.client.dispatcher.submit(interaction, "list", work)
 
-class ChnamePaginatorView(discord.ui.View):
-    def __init__(self, grouped_data, collected):
-        super().__init__(timeout=None)
-        self.grouped = grouped_data
-        self.collected = collected
-        self.index = 0
-        self.total_pages = len(grouped_data)
-        self.max_page = self.total_pages - 1
-
-    def build_page_content(self):
-        chname, items = self.grouped[self.index]
-        lines = []
-        for it in items:
-            no = it["no"]
-            title = it["title"]
-            url = it["url"]
-            if no in self.collected:
-                lines.append(
-                    f":ballot_box_with_check: **No.{no}** {title} [🔗 Link]({url})"
-                )
-            else:
-                lines.append(
-                    f":blue_square: **No.{no}** {title}"
-                )
-        return chname, lines
 
-    async def update(self, interaction: discord.Interaction):
-        chname, lines = self.build_page_content()
+async def build_list_page(pool, mode: str, gt: dict, user_id: int, username: str, page: int):
+    # 共有のカタログと所持カードのキャッシュからページを組み立てる
+    gtype = gt["gachatype"]
+    cat = await db.get_catalog(pool, gtype)
+    owned = await db.get_owned(pool, user_id, gtype)
+    if mode == "num":
+        count = cat.num_page_count
+        page = min(max(page, 0), count - 1)
         embed = discord.Embed(
-            title=f"{chname} の一覧 (Page {self.index+1}/{self.total_pages})",
-            description="\n".join(lines)
+            title=f"{username} の一覧 (No順／{gt['display_name']})\nPage {page+1}/{count}",
+            description=cat.num_page(owned, page)
         )
-        await interaction.response.edit_message(embed=embed, view=self)
-
-    @discord.ui.button(label="<<")
-    async def first(self, interaction: discord.Interaction, button: discord.ui.Button):
-        self.index = 0
-        await self.update(interaction)
-
-    @discord.ui.button(label="<")
-    async def prev(self, interaction: discord.Interaction, button: discord.ui.Button):
-        if self.index > 0:
-            self.index -= 1
-        await self.update(interaction)
+    else:
+        count = cat.ch_page_count
+        if not count:
+            return discord.Embed(description="ガチャデータの読み込みに失敗しました。"), None
+        page = min(max(page, 0), count - 1)
+        chname, text = cat.ch_page(owned, page)
+        embed = discord.Embed(
+            title=f"{username} の一覧 ({gt['display_name']}・{chname})\nPage {page+1}/{count}",
+            description=text
+        )
+    targets = {"first": 0, "prev": max(page - 1, 0), "next": min(page + 1, count - 1), "last": count - 1}
+    view = stateless_view(*(
+        ListPageButton(mode, gtype, user_id, target, slot, disabled=(target == page))
+        for slot, target in targets.items()
+    ))
+    return embed, view
+
+
+# ─── ガチャボタン ──────────────────────────────────────
+# custom_id = pull:{single|multi}:{ガチャ種別}:{ユーザーID}:{即時表示 0|1}
+class PullButton(
+    discord.ui.DynamicItem[discord.ui.Button],
+    template=r"pull:(?P<kind>single|multi):(?P<gt>[^:]+):(?P<user>\d+):(?P<instant>[01])",
+):
+    def __init__(self, kind: str, gachatype: str, user_id: int, instant: bool):
+        if kind == "multi":
+            button = discord.ui.Button(label=f"{MULTI_PULL}連ガチャ！", style=discord.ButtonStyle.success)
+        else:
+            button = discord.ui.Button(label="ガチャを回す！", style=discord.ButtonStyle.primary)
+        button.custom_id = f"pull:{kind}:{gachatype}:{user_id}:{int(instant)}"
+        super().__init__(button)
+        self.kind = kind
+        self.gachatype = gachatype
+        self.user_id = user_id
+        self.instant = instant
 
-    @discord.ui.button(label=">")
-    async def next(self, interaction: discord.Interaction, button: discord.ui.Button):
-        if self.index < self.max_page:
-            self.index += 1
-        await self.update(interaction)
+    @classmethod
+    async def from_custom_id(cls, interaction: discord.Interaction, item: discord.ui.Button, match):
+        return cls(match["kind"], match["gt"], int(match["user"]), match["instant"] == "1")
 
-    @discord.ui.button(label=">>")
-    async def last(self, interaction: discord.Interaction, button: discord.ui.Button):
-        self.index = self.max_page
-        await self.update(interaction)
+    async def callback(self, interaction: discord.Interaction):
+        if interaction.user.id != self.user_id:
+            return await interaction.response.send_message(
+                "自分のガチャのみ回せます", ephemeral=True
+            )
+        gt = db.get_gacha_type(self.gachatype)
+        if gt is None:
+            return await interaction.response.send_message(
+                "指定されたガチャが見つかりません", ephemeral=True
+            )
+        session = GachaButtonView(
+            interaction.client, self.user_id, interaction.user.name,
+            gt["gachatype"], gt["display_name"], self.instant
+        )
+        # 抽選中に単発・10連のどちらを重ねて押しても、同じユーザーの分は1回ずつしか処理しない
+        # レーンの枠は DB を使う間だけ pull / multi_pull の中で取る
+        work = session.multi_pull if self.kind == "multi" else session.pull
+        await interaction.client.dispatcher.submit(interaction, None, work, key="pull")
 
 
 class GachaButtonView(discord.ui.View):
-    def __init__(self, bot, username, gachatype, display_name):
+    # ボタンを押すたびに custom_id から作り直す。メッセージごとの状態は持たない
+    def __init__(self, bot, user_id, username, gachatype, display_name, instant=False):
         super().__init__(timeout=None)
         self.bot = bot
+        self.user_id = user_id
         self.username = username
         self.gachatype = gachatype
         self.display_name = display_name
+        self.instant = instant  # 即時表示モード
+        self.add_item(PullButton("single", gachatype, user_id, instant))
+        self.add_item(PullButton("multi", gachatype, user_id, instant))
+        self.stop()  # 送信時に ViewStore へ登録させない
+
+    # pull / multi_pull は Dispatcher 経由で defer 済みの状態で呼ばれる
+    @metrics.timed(metrics.PULL_SECONDS, "single")
+    async def pull(self, interaction: discord.Interaction):
+        async with self.bot.dispatcher.lane("pull"):
+            # 抽選（メモリ上のみ）
+            url_info = await db.get_random_item(self.bot.db_pool, self.gachatype)
+            if url_info is None:
+                return await interaction.followup.send("ガチャデータの読み込みに失敗しました。", ephemeral=True)
+
+            # ポイント消費＆カード保存を一括で実行
+            result = await db.perform_pull(self.bot.db_pool, self.user_id, self.gachatype, url_info)
+        if result is None:
+            metrics.PULL_REJECTIONS.labels("points").inc()
+            return await interaction.followup.send("ポイントが不足しています。", ephemeral=True)
+        remaining, is_new = result
+        metrics.PULLS.labels(self.gachatype, url_info["rarity"]).inc()
+
+        # 残り表示更新
+        with metrics.DISCORD_API_SECONDS.labels("edit_message").time():
+            await interaction.edit_original_response(
+                content=f"{self.display_name} — 残りポイント: {remaining} pt"
+            )
 
-    @discord.ui.button(label="ガチャを回す！", style=discord.ButtonStyle.primary)
-    async def callback(self, interaction: discord.Interaction, button: discord.ui.Button):
-        pts = await db.get_points(self.bot.db_pool, self.username)
-        if pts <= 0:
-            return await interaction.response.send_message("ポイントが不足しています。", ephemeral=True)
-
-        # ポイント消費＆残り表示更新
-        await db.set_points(self.bot.db_pool, self.username, pts - 1)
-        remaining = pts - 1
-        await interaction.response.edit_message(
-            content=f"{self.display_name} — 残りポイント: {remaining} pt"
+        logger.info(
+            "User %s drew [%s] No.%s / %s", self.username, self.gachatype, url_info['no'], url_info['title'],
+            extra={"user_id": self.user_id, "gachatype": self.gachatype, "card_no": url_info['no']}
         )
+        await self.bot.pull_log.record(self.user_id, self.username, self.gachatype, url_info, is_new)
 
-        # 抽選
-        url_info = await db.get_random_item(self.bot.db_pool, self.gachatype)
-        if url_info is None:
-            return await interaction.followup.send("ガチャデータの読み込みに失敗しました。", ephemeral=True)
+        # アニメーション表示
+        await self.animate_embed(interaction, url_info, remaining, is_new)
 
-        logger.info(f"User {self.username} drew [{self.gachatype}] No.{url_info['no']} / {url_info['title']}")
+    @metrics.timed(metrics.PULL_SECONDS, "multi")
+    async def multi_pull(self, interaction: discord.Interaction):
+        async with self.bot.dispatcher.lane("pull"):
+            # N回分をまとめて抽選（メモリ上のみ）
+            items = await db.get_random_items(self.bot.db_pool, self.gachatype, MULTI_PULL)
+            if not items:
+                return await interaction.followup.send("ガチャデータの読み込みに失敗しました。", ephemeral=True)
+
+            # ポイント消費＆カード保存を一括で実行
+            result = await db.perform_multi_pull(self.bot.db_pool, self.user_id, self.gachatype, items)
+        if result is None:
+            metrics.PULL_REJECTIONS.labels("points").inc()
+            return await interaction.followup.send(
+                f"ポイントが不足しています。({MULTI_PULL}pt 必要です)", ephemeral=True
+            )
+        remaining, new_cards = result
+        for it in items:
+            metrics.PULLS.labels(self.gachatype, it["rarity"]).inc()
 
-        # 新規判定・保存
-        user_cards = await db.get_user_cards(self.bot.db_pool, self.username, self.gachatype)
-        is_new = url_info["no"] not in user_cards
-        if is_new:
-            await db.add_card(self.bot.db_pool, self.username, self.gachatype, url_info["no"])
+        with metrics.DISCORD_API_SECONDS.labels("edit_message").time():
+            await interaction.edit_original_response(
+                content=f"{self.display_name} — 残りポイント: {remaining} pt"
+            )
 
-        # アニメーション表示
-        await self.animate_embed(interaction, url_info, remaining, is_new)
+        card_nos = [it['no'] for it in items]
+        logger.info(
+            "User %s drew %dx [%s] No.%s", self.username, MULTI_PULL, self.gachatype, card_nos,
+            extra={"user_id": self.user_id, "gachatype": self.gachatype, "card_nos": card_nos}
+        )
+        seen = set()
+        for it in items:
+            await self.bot.pull_log.record(
+                self.user_id, self.username, self.gachatype, it, it["no"] in new_cards and it["no"] not in seen
+            )
+            seen.add(it["no"])
+
+        embed = self.build_multi_embed(items, new_cards, remaining)
+        with metrics.DISCORD_API_SECONDS.labels("send").time():
+            await interaction.followup.send(embed=embed, ephemeral=False)
+
+    def build_multi_embed(self, items, new_cards, remaining):
+        # レア度ごとにまとめた結果表示
+        embed = discord.Embed(title=f"{self.display_name} — {MULTI_PULL}連")
+        grouped = defaultdict(list)
+        shown_new = set()
+        for it in items:
+            # リンクはメッセージに残って後から開かれるので、期限のないURLにする
+            link = images.store.url_for(self.gachatype, it, stable=True)
+            line = f"**No.{it['no']}** {it['chname']} {it['title']} [🔗 Link]({link})"
+            if it["no"] in new_cards and it["no"] not in shown_new:
+                shown_new.add(it["no"])
+                line += " ✨NEW✨"
+            grouped[it["rarity"]].append(line)
+        order = RARITY_ORDER + sorted(r for r in grouped if r not in RARITY_ORDER)
+        for rarity in order:
+            if rarity not in grouped:
+                continue
+            name = f"{self.add_emoji_to_rarity(rarity)} ×{len(grouped[rarity])}"
+            # フィールドの文字数上限(1024)を超えないように分割する
+            chunk = []
+            for line in grouped[rarity]:
+                if chunk and len("\n".join(chunk + [line])) > 1024:
+                    embed.add_field(name=name, value="\n".join(chunk), inline=False)
+                    name, chunk = "\u200b", []
+                chunk.append(line)
+            embed.add_field(name=name, value="\n".join(chunk), inline=False)
+        embed.add_field(name="残りポイント", value=f"**{remaining} pt**", inline=False)
+        # 一番レアなカードをサムネイルで出す
+        rank = {r: i for i, r in enumerate(RARITY_ORDER)}
+        best = min(items, key=lambda it: rank.get(it["rarity"], len(rank)))
+        embed.set_thumbnail(url=images.store.url_for(self.gachatype, best, thumb=True))
+        return embed
 
     def add_emoji_to_rarity(self, rarity: str) -> str:
         if rarity == "N":
@@ -174,75 +284,74 @@ class GachaButtonView(discord.ui.View):
             return "🎇✨✨🌟💎 UR 💎🌟✨✨🎇"
         return rarity
 
-    async def animate_embed(self, interaction, url_info, remaining, is_new):
-        msg = await interaction.followup.send("ガチャ中…", ephemeral=False)
-        await asyncio.sleep(1)
-
+    def plan_frames(self, url_info, remaining, is_new) -> list:
+        # 演出の各段階を前もって組み立てる（各フレームは累積した内容を持つ）
+        frames = []
         embed = discord.Embed(title=self.display_name)
-        await msg.edit(content=None, embed=embed)
-        await asyncio.sleep(1)
+        frames.append(reveal.Frame(embed.copy()))
 
         embed.add_field(name="キャラ", value=url_info['chname'], inline=True)
-        await msg.edit(embed=embed)
-        await asyncio.sleep(1)
+        frames.append(reveal.Frame(embed.copy()))
 
         embed.add_field(name="レア度", value="...", inline=True)
-        await msg.edit(embed=embed)
-        await asyncio.sleep(1)
+        frames.append(reveal.Frame(embed.copy()))
         decorated = self.add_emoji_to_rarity(url_info['rarity'])
         embed.set_field_at(1, name="レア度", value=decorated, inline=True)
-        await msg.edit(embed=embed)
-        await asyncio.sleep(1)
+        frames.append(reveal.Frame(embed.copy(), required=True))
 
         embed.add_field(name="イラストNo.", value=f"No.{url_info['no']}", inline=True)
         if is_new:
             embed.add_field(name="\u200b", value="✨NEW✨", inline=True)
-        await msg.edit(embed=embed)
-        await asyncio.sleep(1)
+        frames.append(reveal.Frame(embed.copy()))
 
         embed.add_field(name="タイトル", value=url_info['title'], inline=True)
-        await msg.edit(embed=embed)
-        await asyncio.sleep(1)
+        frames.append(reveal.Frame(embed.copy()))
 
-        embed.add_field(name="URL", value=f"[🔗 Link]({url_info['url']})", inline=False)
-        embed.set_image(url=url_info['url'])
-        await msg.edit(embed=embed)
-        await asyncio.sleep(1)
+        # Drive から直接読むと遅いので、キャッシュした画像を使う（images.py）
+        # リンクは後から開かれるので期限のないURL、表示する画像は期限付きの添付URLでもよい
+        link = images.store.url_for(self.gachatype, url_info, stable=True)
+        embed.add_field(name="URL", value=f"[🔗 Link]({link})", inline=False)
+        embed.set_image(url=images.store.url_for(self.gachatype, url_info))
+        frames.append(reveal.Frame(embed.copy()))
 
         embed.add_field(name="残りポイント", value=f"**{remaining} pt**", inline=False)
-        await msg.edit(embed=embed)
+        frames.append(reveal.Frame(embed.copy(), required=True))
+        return frames
+
+    async def animate_embed(self, interaction, url_info, remaining, is_new):
+        frames = self.plan_frames(url_info, remaining, is_new)
+        await reveal.play(interaction, frames, instant=self.instant)
 
 
 class GachaCog(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
 
+    async def cog_load(self):
+        # 再起動後も既存メッセージのボタンが動くよう、custom_id のパターンで受け付ける
+        self.bot.add_dynamic_items(ListPageButton, PullButton)
+
+    async def cog_unload(self):
+        self.bot.remove_dynamic_items(ListPageButton, PullButton)
+
     @app_commands.command(name="gacha", description="ガチャを回します")
-    @app_commands.choices(
-        gachatype=[
-            app_commands.Choice(name="秋の風情ガチャ2025-Autumn Gacha 2025", value="Autumn_2025"),
-            app_commands.Choice(name="クリスマスガチャ2024-Christmas Gacha 2024", value="Christmas_2024"),
-        ]
-    )
+    @app_commands.autocomplete(gachatype=gachatype_autocomplete)
     @app_commands.describe(gachatype="回すガチャを選択してください")
     async def gacha(
         self,
         interaction: discord.Interaction,
-        gachatype: app_commands.Choice[str],
+        gachatype: str,
     ):
         user = interaction.user.name
         user_id = interaction.user.id
-        now = time.time()
-        last = self.bot.last_gacha_usage.get(user_id, 0)
-        if now - last < COOLDOWN:
+        gt = db.get_gacha_type(gachatype)
+        if gt is None:
             return await interaction.response.send_message(
-                f"クールダウン中です：あと{int(COOLDOWN - (now-last))}秒", ephemeral=True
+                "指定されたガチャが見つかりません", ephemeral=True
             )
-        self.bot.last_gacha_usage[user_id] = now
 
-        display = gachatype.name
-        gtype = gachatype.value
-        pts = await db.get_points(self.bot.db_pool, user)
+        display = gt["display_name"]
+        gtype = gt["gachatype"]
 
         if not (
             isinstance(interaction.channel, discord.Thread)
@@ -252,11 +361,25 @@ class GachaCog(commands.Cog):
                 "専用スレッド内で実行してください", ephemeral=True
             )
 
-        view = GachaButtonView(self.bot, user, gtype, display)
-        await interaction.response.send_message(
-            f"{display} — 残りポイント: {pts} pt",
-            view=view, ephemeral=True
-        )
+        async def work(interaction):
+            # クールダウンの確認も DB を読むので、応答を保留してから行う
+            remaining = await self.bot.cooldowns.try_acquire(f"gacha:{user_id}", COOLDOWN)
+            if remaining > 0:
+                metrics.COOLDOWN_REJECTIONS.labels("gacha").inc()
+                return await interaction.followup.send(
+                    f"クールダウン中です：あと{int(remaining)}秒", ephemeral=True
+                )
+            # 1本のコネクションで続けて読む
+            async with dbpool.acquire(self.bot.db_pool) as conn:
+                pts = await db.get_points(conn, user_id, user)
+                instant = await db.get_instant_reveal(conn, user_id)
+            view = GachaButtonView(self.bot, user_id, user, gtype, display, instant)
+            await interaction.followup.send(
+                f"{display} — 残りポイント: {pts} pt",
+                view=view, ephemeral=True
+            )
+
+        await self.bot.dispatcher.submit(interaction, "pull", work, key="gacha", ephemeral=True, thinking=True)
 
     @app_commands.command(
         name="creategachathread",
@@ -288,14 +411,13 @@ class GachaCog(commands.Cog):
         await th.send(
             f"{interaction.user.mention} の専用ガチャスレッドです。\n"
             "/gachaでガチャを回せます。"
-            "ボタンを連打するとエラーが発生しやすくなるので再度回す際は５秒ほど置いてご利用ください。\n"
+            "\n"
             "ガチャポイントは全てのガチャで共通です。\n"
             "ポイントは最大１５ポイントまで保持できます。それ以上は増えません。\n"
             "\n"
             "コマンドの詳しい使用方法は「使い方」チャンネルをご確認ください。\n"
 
             "You can roll the gacha using the /gacha command.\n"
-            "Please wait about 5 seconds before rolling again, as rapidly pressing the button may cause errors.\n"
             "Gacha points are shared across all gacha types.\n"
             "You can hold up to 15 points — any points beyond this limit will not accumulate.\n"
             "\n"
@@ -303,18 +425,36 @@ class GachaCog(commands.Cog):
         )
         await interaction.followup.send("専用ガチャスレッドを作成しました。", ephemeral=True)
 
-    @app_commands.command(name="artlistnum", description="取得カード一覧 (No順)")
+    @app_commands.command(name="revealmode", description="ガチャ演出の表示方法を切り替えます")
     @app_commands.choices(
-        gachatype=[
-            app_commands.Choice(name="秋の風情ガチャ2025-Autumn Gacha 2025", value="Autumn_2025"),
-            app_commands.Choice(name="クリスマスガチャ2024-Christmas Gacha 2024", value="Christmas_2024"),
+        mode=[
+            app_commands.Choice(name="通常演出-Animated", value="animated"),
+            app_commands.Choice(name="即時表示-Instant", value="instant"),
         ]
     )
+    @app_commands.describe(mode="演出の表示方法を選択してください")
+    async def revealmode(
+        self,
+        interaction: discord.Interaction,
+        mode: app_commands.Choice[str],
+    ):
+        async def work(interaction):
+            async with dbpool.acquire(self.bot.db_pool) as conn:
+                await db.ensure_user(conn, interaction.user.id, interaction.user.name)
+                await db.set_user_instant_reveal(conn, interaction.user.id, mode.value == "instant")
+            await interaction.followup.send(
+                f"ガチャ演出を「{mode.name}」に変更しました。", ephemeral=True
+            )
+
+        await self.bot.dispatcher.submit(interaction, "pull", work, key="revealmode", ephemeral=True)
+
+    @app_commands.command(name="artlistnum", description="取得カード一覧 (No順)")
+    @app_commands.autocomplete(gachatype=gachatype_autocomplete)
     @app_commands.describe(gachatype="表示するガチャを選択してください")
     async def artlistnum(
         self,
         interaction: discord.Interaction,
-        gachatype: app_commands.Choice[str],
+        gachatype: str,
     ):
         user = interaction.user.name
         if not (
@@ -325,34 +465,26 @@ class GachaCog(commands.Cog):
                 "専用スレッド内で実行してください", ephemeral=True
             )
 
-        gtype = gachatype.value
-        cards = await db.get_user_cards(self.bot.db_pool, user, gtype)
-        async with self.bot.db_pool.acquire() as conn:
-            rows = await conn.fetch(
-                f"SELECT no,url,chname,title FROM gacha_items_{gtype} ORDER BY CAST(no AS INT)"
+        gt = db.get_gacha_type(gachatype)
+        if gt is None:
+            return await interaction.response.send_message(
+                "指定されたガチャが見つかりません", ephemeral=True
             )
-        data = [dict(r) for r in rows]
-        view = PaginatorView(data, cards)
-        await interaction.response.send_message(
-            embed=discord.Embed(
-                title=f"{user} の一覧 (No順／{gachatype.name})",
-                description="\n".join(view.get_lines())
-            ),
-            view=view
-        )
+        async def work(interaction):
+            async with dbpool.acquire(self.bot.db_pool) as conn:
+                await db.ensure_user(conn, interaction.user.id, user)
+                embed, view = await build_list_page(conn, "num", gt, interaction.user.id, user, 0)
+            await interaction.followup.send(embed=embed, view=view or discord.utils.MISSING)
+
+        await self.bot.dispatcher.submit(interaction, "list", work, thinking=True)
 
     @app_commands.command(name="artlistch", description="取得カード一覧 (キャラ順)")
-    @app_commands.choices(
-        gachatype=[
-            app_commands.Choice(name="秋の風情ガチャ2025-Autumn Gacha 2025", value="Autumn_2025"),
-            app_commands.Choice(name="クリスマスガチャ2024-Christmas Gacha 2024", value="Christmas_2024"),
-        ]
-    )
+    @app_commands.autocomplete(gachatype=gachatype_autocomplete)
     @app_commands.describe(gachatype="表示するガチャを選択してください")
     async def artlistch(
         self,
         interaction: discord.Interaction,
-        gachatype: app_commands.Choice[str],
+        gachatype: str,
     ):
         user = interaction.user.name
         if not (
@@ -363,25 +495,173 @@ class GachaCog(commands.Cog):
                 "専用スレッド内で実行してください", ephemeral=True
             )
 
-        gtype = gachatype.value
-        cards = await db.get_user_cards(self.bot.db_pool, user, gtype)
-        async with self.bot.db_pool.acquire() as conn:
-            rows = await conn.fetch(
-                f"SELECT no,url,chname,title FROM gacha_items_{gtype}"
+        gt = db.get_gacha_type(gachatype)
+        if gt is None:
+            return await interaction.response.send_message(
+                "指定されたガチャが見つかりません", ephemeral=True
             )
-        grouped = defaultdict(list)
-        for r in rows:
-            grouped[r["chname"]].append(dict(r))
-        grouped_data = sorted(grouped.items(), key=lambda x: x[0])
-        view = ChnamePaginatorView(grouped_data, cards)
-        chname, lines = view.build_page_content()
-        await interaction.response.send_message(
-            embed=discord.Embed(
-                title=f"{user} の一覧 ({gachatype.name}・{chname})\nPage 1/{view.total_pages}",
-                description="\n".join(lines)
-            ),
-            view=view
-        )
+
+        async def work(interaction):
+            # カタログの読み込みも保留後に行う（読めなかった時は build_list_page がその旨を返す）
+            async with dbpool.acquire(self.bot.db_pool) as conn:
+                await db.ensure_user(conn, interaction.user.id, user)
+                embed, view = await build_list_page(conn, "ch", gt, interaction.user.id, user, 0)
+            await interaction.followup.send(embed=embed, view=view or discord.utils.MISSING)
+
+        await self.bot.dispatcher.submit(interaction, "list", work, thinking=True)
+
+    @app_commands.command(name="artsheet", description="取得カード一覧 (画像)")
+    @app_commands.autocomplete(gachatype=gachatype_autocomplete)
+    @app_commands.describe(gachatype="表示するガチャを選択してください")
+    async def artsheet(
+        self,
+        interaction: discord.Interaction,
+        gachatype: str,
+    ):
+        user = interaction.user.name
+        if not (
+            isinstance(interaction.channel, discord.Thread)
+            and interaction.channel.name.startswith("gacha-thread-")
+        ):
+            return await interaction.response.send_message(
+                "専用スレッド内で実行してください", ephemeral=True
+            )
+        if not contactsheet.available():
+            return await interaction.response.send_message(
+                "この環境では一覧画像を作成できません。/artlistnum をご利用ください。", ephemeral=True
+            )
+
+        gt = db.get_gacha_type(gachatype)
+        if gt is None:
+            return await interaction.response.send_message(
+                "指定されたガチャが見つかりません", ephemeral=True
+            )
+        async def work(interaction):
+            gtype = gt["gachatype"]
+            async with dbpool.acquire(self.bot.db_pool) as conn:
+                await db.ensure_user(conn, interaction.user.id, user)
+                cat = await db.get_catalog(conn, gtype)
+                owned = await db.get_owned(conn, interaction.user.id, gtype)
+            if not cat.items:
+                return await interaction.followup.send("ガチャデータの読み込みに失敗しました。")
+            # 合成は別プロセス。同じ内容ならキャッシュ（添付済みならそのURL）を使う
+            sheet = await contactsheet.get(
+                interaction.user.id, gtype, cat, owned,
+                lambda it: images.store.local_path(gtype, it)
+            )
+            embed = discord.Embed(
+                title=f"{user} の一覧 (画像／{gt['display_name']})",
+                description=f"所持 {len(owned.cards & cat.by_no.keys())} / {len(cat.items)} 枚"
+            )
+            url = sheet.reusable_url()
+            if url:
+                embed.set_image(url=url)
+                return await interaction.followup.send(embed=embed)
+            embed.set_image(url=f"attachment://{contactsheet.FILENAME}")
+            msg = await interaction.followup.send(
+                embed=embed, file=discord.File(io.BytesIO(sheet.data), filename=contactsheet.FILENAME)
+            )
+            if msg is not None and msg.embeds and msg.embeds[0].image.url:
+                sheet.url = msg.embeds[0].image.url
+                sheet.expires_at = images.expires_at(sheet.url)
+
+        await self.bot.dispatcher.submit(interaction, "list", work, thinking=True)
+
+    @app_commands.command(name="progress", description="収集状況を表示します")
+    @app_commands.autocomplete(gachatype=gachatype_autocomplete)
+    @app_commands.describe(gachatype="表示するガチャを選択してください")
+    async def progress(
+        self,
+        interaction: discord.Interaction,
+        gachatype: str,
+    ):
+        user = interaction.user.name
+        if not (
+            isinstance(interaction.channel, discord.Thread)
+            and interaction.channel.name.startswith("gacha-thread-")
+        ):
+            return await interaction.response.send_message(
+                "専用スレッド内で実行してください", ephemeral=True
+            )
+
+        gt = db.get_gacha_type(gachatype)
+        if gt is None:
+            return await interaction.response.send_message(
+                "指定されたガチャが見つかりません", ephemeral=True
+            )
+        async def work(interaction):
+            # 集計済みの1行を読むだけ（所持カードは数えない）
+            # 旧データ（username キー）のカードは ensure_user で引き継いでから読む
+            async with dbpool.acquire(self.bot.db_pool) as conn:
+                await db.ensure_user(conn, interaction.user.id, user)
+                cat = await db.get_catalog(conn, gt["gachatype"])
+                prog = await db.get_progress(conn, interaction.user.id, gt["gachatype"])
+            owned = prog["owned"] if prog else 0
+            by_rarity = prog["by_rarity"] if prog else {}
+            total = len(cat.items)
+            embed = discord.Embed(
+                title=f"{user} の収集状況 ({gt['display_name']})",
+                description=(
+                    f"**{owned} / {total}** 枚（{owned / total * 100 if total else 0:.1f}%）"
+                    + (f"\nランキング {prog['rank']} 位" if prog else "")
+                )
+            )
+            rank = {r: i for i, r in enumerate(RARITY_ORDER)}
+            for rarity in sorted(cat.rarity_counts, key=lambda r: rank.get(r, len(rank))):
+                embed.add_field(
+                    name=rarity,
+                    value=f"{by_rarity.get(rarity, 0)} / {cat.rarity_counts[rarity]}",
+                    inline=True
+                )
+            await interaction.followup.send(embed=embed)
+
+        await self.bot.dispatcher.submit(interaction, "list", work, thinking=True)
+
+    @app_commands.command(name="leaderboard", description="収集枚数のランキングを表示します")
+    @app_commands.autocomplete(gachatype=gachatype_autocomplete)
+    @app_commands.describe(gachatype="表示するガチャを選択してください")
+    async def leaderboard(
+        self,
+        interaction: discord.Interaction,
+        gachatype: str,
+    ):
+        if not (
+            isinstance(interaction.channel, discord.Thread)
+            and interaction.channel.name.startswith("gacha-thread-")
+        ):
+            return await interaction.response.send_message(
+                "専用スレッド内で実行してください", ephemeral=True
+            )
+
+        gt = db.get_gacha_type(gachatype)
+        if gt is None:
+            return await interaction.response.send_message(
+                "指定されたガチャが見つかりません", ephemeral=True
+            )
+        async def work(interaction):
+            # 上位はインデックス順に LIMIT 件読むだけなので、所持カードの総数によらない
+            async with dbpool.acquire(self.bot.db_pool) as conn:
+                await db.ensure_user(conn, interaction.user.id, interaction.user.name)
+                cat = await db.get_catalog(conn, gt["gachatype"])
+                top = await db.get_leaderboard(conn, gt["gachatype"], LEADERBOARD_SIZE)
+                prog = None
+                if all(r["user_id"] != interaction.user.id for r in top):
+                    prog = await db.get_progress(conn, interaction.user.id, gt["gachatype"])
+            total = len(cat.items)
+            lines = []
+            for i, r in enumerate(top, 1):
+                name = discord.utils.escape_markdown(r["username"]) if r["username"] else f"<@{r['user_id']}>"
+                mark = " ◀" if r["user_id"] == interaction.user.id else ""
+                lines.append(f"**{i}.** {name} — {r['owned']} / {total} 枚{mark}")
+            embed = discord.Embed(
+                title=f"ランキング ({gt['display_name']})",
+                description="\n".join(lines) or "まだ誰もカードを持っていません"
+            )
+            if prog:
+                embed.set_footer(text=f"あなた: {prog['rank']} 位（{prog['owned']} / {total} 枚）")
+            await interaction.followup.send(embed=embed)
+
+        await self.bot.dispatcher.submit(interaction, "list", work, thinking=True)
 
 async def setup(bot):
     await bot.add_cog(GachaCog(bot))
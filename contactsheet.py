@@ -0,0 +1,171 @@
+import io
+import os
+import time
+import asyncio
+import logging
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+import metrics
+
+try:
+    from PIL import Image, ImageDraw, ImageFont, ImageOps
+except ImportError:  # Pillow がなければ /artsheet は使えない
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+# ─── 所持カードの一覧画像（コンタクトシート） ─────────────────
+# 1つのガチャ種別の全カードを格子状に並べ、所持カードはサムネイル、未所持はグレーで出す
+# 合成は CPU を使うので別プロセス（ProcessPoolExecutor）で行い、イベントループを止めない
+#   SHEET_WORKERS      合成に使うプロセス数（既定 2）
+#   SHEET_COLUMNS      1行のカード数（既定 10）
+#   SHEET_CELL         1枚の大きさ（既定 128px）
+#   SHEET_CACHE_BYTES  合成済み画像をメモリに置く上限（既定 64MB）
+# 合成済みの画像は、そのユーザーが新しくカードを入手するまで使い回す
+# （db.perform_multi_pull で入手した時と、他のプロセスから入手の通知が来た時に捨てる）
+# 送信後は添付URLも覚えておき、期限内なら画像を送り直さずにそのURLを使う
+
+WORKERS = int(os.getenv("SHEET_WORKERS", "2"))
+COLUMNS = int(os.getenv("SHEET_COLUMNS", "10"))
+CELL = int(os.getenv("SHEET_CELL", "128"))
+CACHE_BYTES = int(os.getenv("SHEET_CACHE_BYTES", str(64 * 1024 * 1024)))
+LABEL_HEIGHT = 18
+URL_GRACE = timedelta(minutes=10)
+FILENAME = "sheet.jpg"
+
+
+def available() -> bool:
+    return Image is not None
+
+
+# ─── 合成（ワーカープロセスで実行） ──────────────────────────
+def render(cards: list, columns: int = COLUMNS, cell: int = CELL) -> bytes:
+    # cards: [(カード番号, 画像ファイルのパス or None, 所持しているか)]
+    columns = max(1, min(columns, len(cards)))
+    rows = (len(cards) + columns - 1) // columns
+    tile_h = cell + LABEL_HEIGHT
+    sheet = Image.new("RGB", (columns * cell, rows * tile_h), (32, 34, 37))
+    draw = ImageDraw.Draw(sheet)
+    font = ImageFont.load_default()
+    for i, (no, path, owned) in enumerate(cards):
+        x, y = (i % columns) * cell, (i // columns) * tile_h
+        tile = _load_tile(path, cell)
+        if tile is None:
+            draw.rectangle((x + 2, y + 2, x + cell - 3, y + cell - 3), fill=(64, 68, 75) if owned else (47, 49, 54))
+        else:
+            if not owned:
+                # 未所持はグレーにして暗くする
+                tile = ImageOps.grayscale(tile).point(lambda v: v // 3 + 20).convert("RGB")
+            sheet.paste(tile, (x + (cell - tile.width) // 2, y + (cell - tile.height) // 2))
+        color = (255, 255, 255) if owned else (114, 118, 125)
+        draw.text((x + 4, y + cell + 3), f"No.{no}", fill=color, font=font)
+    buf = io.BytesIO()
+    sheet.save(buf, "JPEG", quality=85, optimize=True)
+    return buf.getvalue()
+
+
+def _load_tile(path, cell: int):
+    if path is None:
+        return None
+    try:
+        with Image.open(path) as im:
+            im.draft("RGB", (cell, cell))  # JPEG は縮小しながら読む
+            tile = im.convert("RGB")
+    except OSError:
+        return None
+    tile.thumbnail((cell - 4, cell - 4))
+    return tile
+
+
+# ─── プロセスプール ──────────────────────────────────────
+_executor = None
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        # fork は親のイベントループやスレッドの状態まで複製するので spawn で起動する
+        # spawn のワーカーは main.py を __mp_main__ として読み込み直す（import だけで、Bot もログも作らない）
+        _executor = ProcessPoolExecutor(max_workers=WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _executor
+
+
+def shutdown():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+# ─── キャッシュ ────────────────────────────────────────
+class Sheet:
+    __slots__ = ("catalog", "owned_count", "data", "url", "expires_at")
+
+    def __init__(self, catalog, owned_count: int, data: bytes):
+        self.catalog = catalog  # 合成に使ったカタログ（作り直されたら使わない）
+        self.owned_count = owned_count
+        self.data = data
+        self.url = None  # 送信済みの添付URL
+        self.expires_at = None
+
+    def reusable_url(self):
+        if self.url is None:
+            return None
+        if self.expires_at is not None and self.expires_at - datetime.now(timezone.utc) < URL_GRACE:
+            return None
+        return self.url
+
+
+_sheets = OrderedDict()  # (ユーザーID, ガチャ種別) → Sheet
+_cached_bytes = 0
+stats = {"hits": 0, "misses": 0, "invalidations": 0}
+
+
+def _pop(key):
+    global _cached_bytes
+    sheet = _sheets.pop(key, None)
+    if sheet is not None:
+        _cached_bytes -= len(sheet.data)
+    return sheet
+
+
+def invalidate(user_id: int, gachatype: str):
+    # 新しくカードを入手したら呼ぶ
+    if _pop((user_id, gachatype.lower())) is not None:
+        stats["invalidations"] += 1
+
+
+def clear():
+    global _cached_bytes
+    _sheets.clear()
+    _cached_bytes = 0
+
+
+async def get(user_id: int, gachatype: str, catalog, owned, path_for) -> Sheet:
+    # path_for(カード) → 画像ファイルのパス or None
+    global _cached_bytes
+    key = (user_id, gachatype.lower())
+    sheet = _sheets.get(key)
+    if sheet is not None and sheet.catalog is catalog and sheet.owned_count == len(owned.cards):
+        _sheets.move_to_end(key)
+        stats["hits"] += 1
+        metrics.SHEET_CACHE.labels("hit").inc()
+        return sheet
+    stats["misses"] += 1
+    metrics.SHEET_CACHE.labels("miss").inc()
+
+    owned_count = len(owned.cards)  # 合成中に入手した分は次回に反映する
+    cards = [(it["no"], path_for(it), it["no"] in owned.cards) for it in catalog.items]
+    start = time.perf_counter()
+    data = await asyncio.get_running_loop().run_in_executor(_get_executor(), render, cards)
+    metrics.SHEET_RENDER_SECONDS.observe(time.perf_counter() - start)
+
+    _pop(key)
+    sheet = _sheets[key] = Sheet(catalog, owned_count, data)
+    _cached_bytes += len(data)
+    while _cached_bytes > CACHE_BYTES and len(_sheets) > 1:
+        _pop(next(iter(_sheets)))
+    return sheet
@@ -0,0 +1,93 @@
+import os
+import time
+import logging
+
+import asyncpg
+
+import dbpool
+
+logger = logging.getLogger(__name__)
+
+
+# ─── クールダウン管理 ───────────────────────────────────
+# try_acquire は取得できたら 0、クールダウン中なら残り秒数を返す
+
+class MemoryCooldownStore:
+    # 1プロセス用。期限切れのエントリは定期的に捨てる
+    def __init__(self, purge_every: int = 1000):
+        self._expires = {}
+        self._calls = 0
+        self.purge_every = purge_every
+
+    async def try_acquire(self, key: str, seconds: float) -> float:
+        now = time.monotonic()
+        self._calls += 1
+        if self._calls % self.purge_every == 0:
+            await self.purge()
+        expires = self._expires.get(key)
+        if expires is not None and expires > now:
+            return expires - now
+        self._expires[key] = now + seconds
+        return 0.0
+
+    async def purge(self):
+        now = time.monotonic()
+        for key in [k for k, v in self._expires.items() if v <= now]:
+            del self._expires[key]
+
+    def __len__(self):
+        return len(self._expires)
+
+
+SQL_TRY_ACQUIRE = dbpool.statement("cooldown_try_acquire", """
+WITH acq AS (
+  INSERT INTO cooldowns(key, expires_at)
+  VALUES($1, clock_timestamp() + make_interval(secs => $2))
+  ON CONFLICT(key) DO UPDATE SET expires_at = excluded.expires_at
+  WHERE cooldowns.expires_at <= clock_timestamp()
+  RETURNING 1
+)
+SELECT EXISTS(SELECT 1 FROM acq) AS acquired,
+       (SELECT EXTRACT(EPOCH FROM expires_at - clock_timestamp())
+        FROM cooldowns WHERE key=$1) AS remaining
+""")
+
+
+class PostgresCooldownStore:
+    # 複数プロセスで共有する。UNLOGGED テーブルの条件付き UPSERT 1文で判定する
+    def __init__(self, pool: asyncpg.Pool):
+        self.pool = pool
+
+    async def init(self):
+        async with dbpool.acquire(self.pool) as conn:
+            await conn.execute("""
+            CREATE UNLOGGED TABLE IF NOT EXISTS cooldowns (
+              key        TEXT PRIMARY KEY,
+              expires_at TIMESTAMPTZ NOT NULL
+            );
+            """)
+
+    async def try_acquire(self, key: str, seconds: float) -> float:
+        async with dbpool.acquire(self.pool) as conn:
+            row = await dbpool.fetchrow(conn, SQL_TRY_ACQUIRE, key, seconds)
+        if row["acquired"]:
+            return 0.0
+        return max(0.0, float(row["remaining"] or 0.0))
+
+    async def purge(self):
+        async with dbpool.acquire(self.pool) as conn:
+            await conn.execute("DELETE FROM cooldowns WHERE expires_at <= clock_timestamp()")
+
+
+async def create_store(pool: asyncpg.Pool, kind: str = None):
+    # COOLDOWN_STORE=memory|postgres（未指定ならシャード分割時のみ postgres）
+    kind = kind or os.getenv("COOLDOWN_STORE") or ("postgres" if os.getenv("SHARD_IDS") else "memory")
+    if kind == "postgres":
+        store = PostgresCooldownStore(pool)
+        await store.init()
+    elif kind == "memory":
+        store = MemoryCooldownStore()
+    else:
+        raise RuntimeError(f"COOLDOWN_STORE の値が不正です: {kind}")
+    logger.info("Cooldown store: %s", kind)
+    return store
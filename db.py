@@ -3,159 +3,647 @@ import asyncpg
 import logging
 import csv
 import chardet
-import random
+import hashlib
+import json
+import uuid
+import re
+import draw
+import migrations
+import catalog
+import contactsheet
+import dbpool
+import metrics
+from points_cache import PointsCache
 
 logger = logging.getLogger(__name__)
 
-async def init_db(pool: asyncpg.Pool):
-    async with pool.acquire() as conn:
-        # ユーザーPT
-        await conn.execute("""
-        CREATE TABLE IF NOT EXISTS user_points (
-          username TEXT PRIMARY KEY,
-          points INTEGER NOT NULL
-        );
+MAX_POINTS = 15  # 保持できるポイントの上限
+
+# ─── ポイントキャッシュ & プロセス間の無効化通知 ─────────────────
+# 所持カードのキャッシュ（catalog / contactsheet）も、カードが増えたら CARDS_CHANNEL で他プロセスに知らせる
+POINTS_CHANNEL = "user_points_changed"
+CARDS_CHANNEL = "user_cards_changed"
+INSTANCE_ID = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"  # 自分が出した通知を区別する
+points_cache = PointsCache()
+
+SQL_NOTIFY_POINTS = dbpool.statement("notify_points", "SELECT pg_notify($1, $2)")
+
+async def _notify_points(conn, user_id="*"):
+    # 他プロセスのキャッシュを無効化する（"*" は全ユーザー）
+    await dbpool.fetchval(conn, SQL_NOTIFY_POINTS, POINTS_CHANNEL, f"{INSTANCE_ID}:{user_id}")
+
+def _on_points_notify(conn, pid, channel, payload):
+    sender, _, user_id = payload.partition(":")
+    if sender == INSTANCE_ID:
+        return
+    if user_id == "*":
+        points_cache.clear()
+    else:
+        points_cache.invalidate(int(user_id))
+
+def _cards_payload(user_id: int, gachatype: str) -> str:
+    return f"{INSTANCE_ID}:{user_id}:{gachatype}"
+
+def _on_cards_notify(conn, pid, channel, payload):
+    sender, user_id, gachatype = payload.split(":", 2)
+    if sender == INSTANCE_ID:
+        return
+    catalog.drop_owned(int(user_id), gachatype)
+    contactsheet.invalidate(int(user_id), gachatype)
+
+def _on_listener_lost(conn):
+    # 通知を受け取れない間は古い値を返さないよう全て捨てる
+    logger.warning("Change listener connection lost, clearing caches")
+    points_cache.clear()
+    catalog.clear_owned()
+    contactsheet.clear()
+
+async def listen_points_changes(conn):
+    await conn.add_listener(POINTS_CHANNEL, _on_points_notify)
+    await conn.add_listener(CARDS_CHANNEL, _on_cards_notify)
+    conn.add_termination_listener(_on_listener_lost)
+
+async def unlisten_points_changes(conn):
+    conn.remove_termination_listener(_on_listener_lost)
+    await conn.remove_listener(POINTS_CHANNEL, _on_points_notify)
+    await conn.remove_listener(CARDS_CHANNEL, _on_cards_notify)
+
+@metrics.timed(metrics.DB_CALL_SECONDS)
+async def init_db(pool: dbpool.Source):
+    # 未適用のマイグレーションを順に実行する
+    async with dbpool.acquire(pool) as conn:
+        await migrations.run(conn)
+    # スキーマ確定前に作られたコネクションは作り直し、prepare をやり直させる
+    if isinstance(pool, asyncpg.Pool):
+        await pool.expire_connections()
+    logger.info("DB initialized")
+
+# ─── ガチャ種別レジストリ ───────────────────────────────
+_gacha_types = {}
+
+@metrics.timed(metrics.DB_CALL_SECONDS)
+async def sync_gacha_types(pool: dbpool.Source, manifest_path: str):
+    # マニフェストの内容をレジストリに反映し、有効な種別をメモリに読み込む
+    if os.path.exists(manifest_path):
+        with open(manifest_path, encoding='utf-8') as f:
+            entries = json.load(f)
+        async with dbpool.acquire(pool) as conn:
+            await conn.executemany("""
+            INSERT INTO gacha_types(gachatype, display_name, csv_path, sort_order, active)
+            VALUES($1,$2,$3,$4,$5)
+            ON CONFLICT(gachatype) DO UPDATE
+              SET display_name=excluded.display_name, csv_path=excluded.csv_path,
+                  sort_order=excluded.sort_order, active=excluded.active
+            """, [
+                (e["gachatype"].lower(), e["display_name"], e.get("csv_path"),
+                 e.get("sort_order", 0), e.get("active", True))
+                for e in entries
+            ])
+    else:
+        logger.error("Manifest not found: %s", manifest_path)
+    async with dbpool.acquire(pool) as conn:
+        rows = await conn.fetch("""
+        SELECT gachatype, display_name, csv_path, sort_order FROM gacha_types
+        WHERE active ORDER BY sort_order, gachatype
         """)
-        # 取得カード
+    _gacha_types.clear()
+    for r in rows:
+        _gacha_types[r["gachatype"]] = dict(r)
+    logger.info("Gacha types: %s", ", ".join(_gacha_types) or "None")
+
+def get_gacha_types() -> list:
+    return list(_gacha_types.values())
+
+def get_gacha_type(gachatype: str):
+    return _gacha_types.get(gachatype.lower())
+
+@metrics.timed(metrics.DB_CALL_SECONDS)
+async def get_state(pool: dbpool.Source, key: str):
+    async with dbpool.acquire(pool) as conn:
+        return await conn.fetchval("SELECT value FROM app_state WHERE key=$1", key)
+
+@metrics.timed(metrics.DB_CALL_SECONDS)
+async def set_state(pool: dbpool.Source, key: str, value: str):
+    async with dbpool.acquire(pool) as conn:
         await conn.execute("""
-        CREATE TABLE IF NOT EXISTS user_cards (
-          username TEXT,
-          gachatype TEXT,
-          card_no TEXT,
-          PRIMARY KEY(username, gachatype, card_no)
-        );
+        INSERT INTO app_state(key, value) VALUES($1,$2)
+        ON CONFLICT(key) DO UPDATE SET value=excluded.value
+        """, key, value)
+
+# ─── 日次ポイント（遅延付与） ──────────────────────────────
+# 日次の付与はジョブで書き込まず、accrued_points(points, accrued_on, 上限) で読む時に求める
+# （マイグレーション3）。ポイントを書き換える文はすべて、先に経過日数分を反映してから
+# accrued_on を今日（JST）にする
+
+@metrics.timed(metrics.DB_CALL_SECONDS)
+async def get_daily_auto_points(pool: dbpool.Source) -> int:
+    # 次の0時に付与される量
+    async with dbpool.acquire(pool) as conn:
+        return await conn.fetchval("""
+        SELECT points FROM daily_points_history
+        WHERE effective_on <= jst_today() + 1
+        ORDER BY effective_on DESC LIMIT 1
         """)
-        # ガチャアイテム(spring & summer)
-        for gt in ("christmas_2024","autumn_2025"):
-            await conn.execute(f"""
-            CREATE TABLE IF NOT EXISTS gacha_items_{gt} (
-              no     TEXT PRIMARY KEY,
-              url    TEXT,
-              chname TEXT,
-              rarity TEXT,
-              rate   REAL,
-              title  TEXT
-            );
-            """)
-        # 設定テーブル
+
+@metrics.timed(metrics.DB_CALL_SECONDS)
+async def set_daily_auto_points(pool: dbpool.Source, pt: int):
+    # 次の0時の付与から適用する。今日までの分は変更前の量のまま数える
+    async with dbpool.acquire(pool) as conn:
         await conn.execute("""
-        CREATE TABLE IF NOT EXISTS settings (
-          key   TEXT PRIMARY KEY,
-          value INTEGER
-        );
-        """)
-        # 初回だけdaily_auto_pointsを3にセット
-        v = await conn.fetchval(
-            "SELECT value FROM settings WHERE key='daily_auto_points'"
+        INSERT INTO daily_points_history(effective_on, points) VALUES(jst_today() + 1, $1)
+        ON CONFLICT(effective_on) DO UPDATE SET points=excluded.points
+        """, pt)
+
+@metrics.timed(metrics.DB_CALL_SECONDS)
+async def grant_points_all(pool: dbpool.Source, pt: int, batch_size: int = None):
+    # 全ユーザーへの付与をサーバー側の UPDATE 1文で行う
+    # batch_size 指定時は user_id 順に分割して短いトランザクションを繰り返す
+    # まだ引き継がれていない旧ユーザー（legacy_user_points）にも付与する
+    # 戻り値: (ポイントが変わったユーザー数, 上限に達したユーザー数)
+    # 付与前から上限のままのユーザーは数えない。負の値なら減ったユーザー数になる
+    affected = capped = 0
+    async with dbpool.acquire(pool) as conn:
+        if not batch_size:
+            row = await conn.fetchrow("""
+            WITH upd AS (
+              UPDATE user_points
+              SET points = LEAST($2, accrued_points(points, accrued_on, $2) + $1), accrued_on = jst_today()
+              WHERE LEAST($2, accrued_points(points, accrued_on, $2) + $1) <> accrued_points(points, accrued_on, $2)
+              RETURNING points
+            )
+            SELECT count(*) AS affected,
+                   count(*) FILTER (WHERE points = $2) AS capped
+            FROM upd
+            """, pt, MAX_POINTS)
+            affected, capped = row["affected"], row["capped"]
+        else:
+            last = -1
+            while True:
+                row = await conn.fetchrow("""
+                WITH chunk AS (
+                  SELECT user_id FROM user_points
+                  WHERE user_id > $3
+                  ORDER BY user_id
+                  LIMIT $4
+                ), upd AS (
+                  UPDATE user_points p
+                  SET points = LEAST($2, accrued_points(p.points, p.accrued_on, $2) + $1), accrued_on = jst_today()
+                  FROM chunk c
+                  WHERE p.user_id = c.user_id
+                    AND LEAST($2, accrued_points(p.points, p.accrued_on, $2) + $1)
+                        <> accrued_points(p.points, p.accrued_on, $2)
+                  RETURNING p.points
+                )
+                SELECT (SELECT max(user_id) FROM chunk) AS last,
+                       (SELECT count(*) FROM upd) AS affected,
+                       (SELECT count(*) FROM upd WHERE points = $2) AS capped
+                """, pt, MAX_POINTS, last, batch_size)
+                if row["last"] is None:
+                    break
+                last = row["last"]
+                affected += row["affected"]
+                capped += row["capped"]
+        row = await conn.fetchrow("""
+        WITH upd AS (
+          UPDATE legacy_user_points
+          SET points = LEAST($2, accrued_points(points, accrued_on, $2) + $1), accrued_on = jst_today()
+          WHERE LEAST($2, accrued_points(points, accrued_on, $2) + $1) <> accrued_points(points, accrued_on, $2)
+          RETURNING points
         )
-        if v is None:
-            await conn.execute(
-                "INSERT INTO settings(key,value) VALUES('daily_auto_points', $1)",
-                3
+        SELECT count(*) AS affected,
+               count(*) FILTER (WHERE points = $2) AS capped
+        FROM upd
+        """, pt, MAX_POINTS)
+        affected += row["affected"]
+        capped += row["capped"]
+        await _notify_points(conn)
+    points_cache.clear()
+    return affected, capped
+
+SQL_GRANT_USER = dbpool.statement("grant_points_user", """
+UPDATE user_points p SET points = LEAST($3, accrued_points(p.points, p.accrued_on, $3) + $2), accrued_on = jst_today()
+FROM (
+  SELECT accrued_points(points, accrued_on, $3) AS points FROM user_points WHERE user_id=$1 FOR UPDATE
+) prev
+WHERE p.user_id=$1
+RETURNING prev.points AS old, p.points AS new
+""")
+
+@metrics.timed(metrics.DB_CALL_SECONDS)
+async def grant_points_user(pool: dbpool.Source, user_id: int, username: str, pt: int):
+    # 1ユーザーへの付与。未登録なら初期ポイントから加算する
+    # 戻り値: (付与前, 付与後)
+    async with dbpool.acquire(pool) as conn:
+        await _ensure_user(conn, user_id, username)
+        row = await dbpool.fetchrow(conn, SQL_GRANT_USER, user_id, pt, MAX_POINTS)
+        await _notify_points(conn, user_id)
+    points_cache.set(user_id, row["new"])
+    return row["old"], row["new"]
+
+MENTION_RE = re.compile(r"^<@!?(\d+)>$|^(\d{15,20})$")
+
+@metrics.timed(metrics.DB_CALL_SECONDS)
+async def grant_points_bulk(pool: dbpool.Source, targets: list, pt: int):
+    # 指定ユーザー一覧への付与。COPY で一時テーブルに流し込み、結合 UPDATE で反映する
+    # 各行はユーザーID・メンション・ユーザー名のいずれか
+    # 戻り値: (ポイントが変わったユーザー数, 見つからなかった指定の一覧)
+    idents = list(dict.fromkeys(t.strip() for t in targets if t and t.strip()))
+    if not idents:
+        return 0, []
+    records = []
+    for ident in idents:
+        m = MENTION_RE.match(ident)
+        if m:
+            records.append((ident, int(m.group(1) or m.group(2)), None))
+        else:
+            records.append((ident, None, ident))
+    async with dbpool.acquire(pool) as conn:
+        async with conn.transaction():
+            await conn.execute("""
+            CREATE TEMP TABLE grant_targets (
+              ident TEXT PRIMARY KEY, user_id BIGINT, username TEXT
+            ) ON COMMIT DROP
+            """)
+            await conn.copy_records_to_table(
+                "grant_targets", records=records, columns=["ident", "user_id", "username"]
             )
-    logger.info("DB initialized")
+            row = await conn.fetchrow("""
+            WITH upd AS (
+              UPDATE user_points p
+              SET points = LEAST($2, accrued_points(p.points, p.accrued_on, $2) + $1), accrued_on = jst_today()
+              WHERE (p.user_id IN (SELECT user_id FROM grant_targets WHERE user_id IS NOT NULL)
+                     OR p.username IN (SELECT username FROM grant_targets WHERE username IS NOT NULL))
+                AND LEAST($2, accrued_points(p.points, p.accrued_on, $2) + $1)
+                    <> accrued_points(p.points, p.accrued_on, $2)
+              RETURNING p.user_id
+            ), legacy AS (
+              UPDATE legacy_user_points l
+              SET points = LEAST($2, accrued_points(l.points, l.accrued_on, $2) + $1), accrued_on = jst_today()
+              FROM grant_targets t
+              WHERE l.username = t.username
+                AND LEAST($2, accrued_points(l.points, l.accrued_on, $2) + $1)
+                    <> accrued_points(l.points, l.accrued_on, $2)
+              RETURNING l.username
+            )
+            SELECT (SELECT count(*) FROM upd) + (SELECT count(*) FROM legacy) AS increased,
+                   ARRAY(
+                     SELECT t.ident FROM grant_targets t
+                     WHERE NOT EXISTS (
+                       SELECT 1 FROM user_points p
+                       WHERE p.user_id = t.user_id OR p.username = t.username
+                     )
+                     AND NOT EXISTS (
+                       SELECT 1 FROM legacy_user_points l WHERE l.username = t.username
+                     )
+                     ORDER BY t.ident
+                   ) AS missing
+            """, pt, MAX_POINTS)
+            await _notify_points(conn)
+    points_cache.clear()
+    return row["increased"], list(row["missing"])
 
-async def get_daily_auto_points(pool: asyncpg.Pool) -> int:
-    async with pool.acquire() as conn:
-        return await conn.fetchval(
-            "SELECT value FROM settings WHERE key='daily_auto_points'"
-        )
+SQL_GET_REVEAL = dbpool.statement("get_instant_reveal", """
+SELECT COALESCE((SELECT value FROM settings WHERE key='instant_reveal'), 0) <> 0
+    OR COALESCE((SELECT instant_reveal FROM user_settings WHERE user_id=$1), FALSE)
+""")
+
+@metrics.timed(metrics.DB_CALL_SECONDS)
+async def get_instant_reveal(pool: dbpool.Source, user_id: int) -> bool:
+    # 全体設定かユーザー設定のどちらかが有効なら即時表示
+    async with dbpool.acquire(pool) as conn:
+        return await dbpool.fetchval(conn, SQL_GET_REVEAL, user_id)
+
+SQL_SET_REVEAL = dbpool.statement("set_user_instant_reveal", """
+INSERT INTO user_settings(user_id, instant_reveal) VALUES($1,$2)
+ON CONFLICT(user_id) DO UPDATE SET instant_reveal=excluded.instant_reveal
+""")
 
-async def set_daily_auto_points(pool: asyncpg.Pool, pt: int):
-    async with pool.acquire() as conn:
+@metrics.timed(metrics.DB_CALL_SECONDS)
+async def set_user_instant_reveal(pool: dbpool.Source, user_id: int, instant: bool):
+    async with dbpool.acquire(pool) as conn:
+        await dbpool.fetchval(conn, SQL_SET_REVEAL, user_id, instant)
+
+@metrics.timed(metrics.DB_CALL_SECONDS)
+async def set_instant_reveal_all(pool: dbpool.Source, instant: bool):
+    async with dbpool.acquire(pool) as conn:
         await conn.execute(
-            "UPDATE settings SET value=$1 WHERE key='daily_auto_points'",
-            pt
+            "UPDATE settings SET value=$1 WHERE key='instant_reveal'",
+            1 if instant else 0
         )
 
-async def add_daily_points_for_all(pool: asyncpg.Pool, daily_pt: int):
-    async with pool.acquire() as conn:
-        rows = await conn.fetch("SELECT username, points FROM user_points")
-        for r in rows:
-            new = min(15, r["points"] + daily_pt)
-            await conn.execute(
-                "UPDATE user_points SET points=$1 WHERE username=$2",
-                new, r["username"]
-            )
-    logger.info(f"Added {daily_pt} daily pts to all users")
+SQL_GET_USER = dbpool.statement("get_user", """
+SELECT accrued_points(points, accrued_on, $2) AS points, username FROM user_points WHERE user_id=$1
+""")
+SQL_RENAME_USER = dbpool.statement("rename_user", """
+UPDATE user_points SET username=$2 WHERE user_id=$1
+""")
+# 新しく保存したカード（CTE ins の gachatype, card_no）を収集状況の集計に加える。$1 はユーザーID
+# カードを保存する文の WITH 句に続けて使い、同じ文・同じトランザクションで反映する
+PROGRESS_CTES = """
+), ins_r AS (
+  SELECT ins.gachatype, gi.rarity, count(*)::integer AS n
+  FROM ins JOIN gacha_items gi ON gi.gachatype = ins.gachatype AND gi.no = ins.card_no
+  GROUP BY 1, 2
+), prog AS (
+  INSERT INTO user_progress AS p (user_id, gachatype, owned, reached_at)
+  SELECT $1, gachatype, sum(n), now() FROM ins_r GROUP BY gachatype
+  ON CONFLICT(user_id, gachatype) DO UPDATE
+    SET owned = p.owned + excluded.owned, reached_at = excluded.reached_at
+), prog_r AS (
+  INSERT INTO user_progress_rarity AS p (user_id, gachatype, rarity, owned)
+  SELECT $1, gachatype, rarity, n FROM ins_r
+  ON CONFLICT(user_id, gachatype, rarity) DO UPDATE SET owned = p.owned + excluded.owned
+"""
 
-async def get_points(pool: asyncpg.Pool, username: str) -> int:
-    async with pool.acquire() as conn:
-        v = await conn.fetchval(
-            "SELECT points FROM user_points WHERE username=$1",
-            username
-        )
-        if v is None:
-            await conn.execute(
-                "INSERT INTO user_points(username, points) VALUES($1, $2)",
-                username, 15
-            )
-            return 15
-        return v
+SQL_CLAIM_USER = dbpool.statement("claim_user", """
+WITH lp AS (
+  DELETE FROM legacy_user_points WHERE username=$2 RETURNING accrued_points(points, accrued_on, $4) AS points
+), lc AS (
+  DELETE FROM legacy_user_cards WHERE username=$2 RETURNING gachatype, card_no
+), ins AS (
+  INSERT INTO user_cards(user_id, gachatype, card_no)
+  SELECT $1, gachatype, card_no::integer FROM lc
+  ON CONFLICT DO NOTHING
+  RETURNING gachatype, card_no
+""" + PROGRESS_CTES + """
+), ls AS (
+  DELETE FROM legacy_user_settings WHERE username=$2 RETURNING instant_reveal
+), iset AS (
+  INSERT INTO user_settings(user_id, instant_reveal)
+  SELECT $1, instant_reveal FROM ls
+  ON CONFLICT DO NOTHING
+)
+INSERT INTO user_points AS p (user_id, username, points)
+VALUES($1, $2, COALESCE((SELECT points FROM lp), $3))
+ON CONFLICT(user_id) DO UPDATE SET username=excluded.username
+RETURNING accrued_points(p.points, p.accrued_on, $4) AS points
+""")
 
-async def set_points(pool: asyncpg.Pool, username: str, pts: int):
-    async with pool.acquire() as conn:
-        await conn.execute("""
-        INSERT INTO user_points(username, points) VALUES($1,$2)
-        ON CONFLICT(username) DO UPDATE SET points=excluded.points
-        """, username, pts)
+async def _ensure_user(conn, user_id: int, username: str) -> int:
+    # ユーザー行を用意してポイントを返す
+    # 初回は旧 username キーのデータ（ポイント・カード・設定）を1文で引き継ぐ
+    # 日次の付与は読むだけで反映し、書き込みは次にポイントを動かす時に行う
+    row = await dbpool.fetchrow(conn, SQL_GET_USER, user_id, MAX_POINTS)
+    if row is not None:
+        if username and row["username"] != username:
+            await dbpool.fetchval(conn, SQL_RENAME_USER, user_id, username)
+        return row["points"]
+    return await dbpool.fetchval(conn, SQL_CLAIM_USER, user_id, username, 15, MAX_POINTS)
 
-async def add_card(pool: asyncpg.Pool, username: str, gachatype: str, card_no: str):
-    async with pool.acquire() as conn:
-        await conn.execute("""
-        INSERT INTO user_cards(username, gachatype, card_no)
-        VALUES($1,$2,$3)
-        ON CONFLICT DO NOTHING
-        """, username, gachatype, card_no)
-
-async def get_user_cards(pool: asyncpg.Pool, username: str, gachatype: str) -> list:
-    async with pool.acquire() as conn:
-        rows = await conn.fetch(
-            "SELECT card_no FROM user_cards WHERE username=$1 AND gachatype=$2",
-            username, gachatype
+@metrics.timed(metrics.DB_CALL_SECONDS)
+async def get_points(pool: dbpool.Source, user_id: int, username: str) -> int:
+    cached = points_cache.get(user_id)
+    if cached is not None:
+        return cached
+    async with dbpool.acquire(pool) as conn:
+        v = await _ensure_user(conn, user_id, username)
+    points_cache.set(user_id, v)
+    return v
+
+@metrics.timed(metrics.DB_CALL_SECONDS)
+async def ensure_user(pool: dbpool.Source, user_id: int, username: str):
+    # 旧データの引き継ぎを済ませておく（ポイントがキャッシュにあれば済んでいる）
+    await get_points(pool, user_id, username)
+
+@metrics.timed(metrics.DB_CALL_SECONDS)
+async def perform_pull(pool: dbpool.Source, user_id: int, gachatype: str, item: dict):
+    # ポイント消費とカード保存を1文・1トランザクションで行う
+    # 戻り値: (残りポイント, 新規カードか) / ポイント不足なら None
+    result = await perform_multi_pull(pool, user_id, gachatype, [item])
+    if result is None:
+        return None
+    remaining, new_cards = result
+    return remaining, bool(new_cards)
+
+SQL_MULTI_PULL = dbpool.statement("multi_pull", """
+WITH spent AS (
+  UPDATE user_points SET points = accrued_points(points, accrued_on, $7) - $4, accrued_on = jst_today()
+  WHERE user_id=$1 AND accrued_points(points, accrued_on, $7) >= $4
+  RETURNING points
+), ins AS (
+  INSERT INTO user_cards(user_id, gachatype, card_no)
+  SELECT $1, $2, c FROM spent, unnest($3::integer[]) AS c
+  ON CONFLICT DO NOTHING
+  RETURNING gachatype, card_no
+""" + PROGRESS_CTES + """
+)
+SELECT (SELECT points FROM spent) AS points,
+       ARRAY(SELECT card_no FROM ins) AS new_cards,
+       (SELECT pg_notify($5, $6) FROM spent) AS notified,
+       (SELECT pg_notify($8, $9) WHERE EXISTS(SELECT 1 FROM ins)) AS cards_notified
+""")
+
+@metrics.timed(metrics.DB_CALL_SECONDS)
+async def perform_multi_pull(pool: dbpool.Source, user_id: int, gachatype: str, items: list):
+    # N回分のポイントをまとめて消費し、カードを複数行 INSERT 1文で保存する
+    # 戻り値: (残りポイント, 新規に入手したカード番号の set) / ポイント不足なら None
+    async with dbpool.acquire(pool) as conn:
+        row = await dbpool.fetchrow(
+            conn, SQL_MULTI_PULL, user_id, gachatype, [it["no"] for it in items], len(items),
+            POINTS_CHANNEL, f"{INSTANCE_ID}:{user_id}", MAX_POINTS,
+            CARDS_CHANNEL, _cards_payload(user_id, gachatype)
         )
+    if row["points"] is None:
+        points_cache.invalidate(user_id)
+        return None
+    points_cache.set(user_id, row["points"])
+    new_cards = set(row["new_cards"])
+    catalog.add_owned(user_id, gachatype, new_cards)
+    if new_cards:
+        contactsheet.invalidate(user_id, gachatype)
+    return row["points"], new_cards
+
+@metrics.timed(metrics.DB_CALL_SECONDS)
+async def get_owned(pool: dbpool.Source, user_id: int, gachatype: str):
+    # 所持カードはキャッシュを優先し、無ければDBから読み込む
+    owned = catalog.get_owned(user_id, gachatype)
+    if owned is None:
+        cards = await get_user_cards(pool, user_id, gachatype)
+        owned = catalog.put_owned(user_id, gachatype, cards)
+    return owned
+
+SQL_USER_CARDS = dbpool.statement("user_cards", """
+SELECT card_no FROM user_cards WHERE user_id=$1 AND gachatype=$2
+""")
+
+@metrics.timed(metrics.DB_CALL_SECONDS)
+async def get_user_cards(pool: dbpool.Source, user_id: int, gachatype: str) -> list:
+    async with dbpool.acquire(pool) as conn:
+        rows = await dbpool.fetch(conn, SQL_USER_CARDS, user_id, gachatype)
         return [r["card_no"] for r in rows]
 
-async def load_gacha_data(pool: asyncpg.Pool, csv_path: str, gachatype: str):
-    table = f"gacha_items_{gachatype}"
+# ─── 収集状況・ランキング ─────────────────────────────────
+# user_progress / user_progress_rarity はカードを保存する文で加算している（PROGRESS_CTES）
+# 順位は自分より上の行だけをインデックスで数える
+SQL_GET_PROGRESS = dbpool.statement("get_progress", """
+SELECT p.owned,
+       (SELECT count(*) FROM user_progress q
+        WHERE q.gachatype = p.gachatype
+          AND (q.owned > p.owned OR (q.owned = p.owned AND (q.reached_at, q.user_id) < (p.reached_at, p.user_id)))
+       ) + 1 AS rank,
+       ARRAY(SELECT ARRAY[r.rarity, r.owned::text] FROM user_progress_rarity r
+             WHERE r.user_id = p.user_id AND r.gachatype = p.gachatype) AS by_rarity
+FROM user_progress p
+WHERE p.user_id=$1 AND p.gachatype=$2
+""")
+SQL_LEADERBOARD = dbpool.statement("leaderboard", """
+SELECT p.user_id, u.username, p.owned
+FROM user_progress p
+LEFT JOIN user_points u USING (user_id)
+WHERE p.gachatype=$1
+ORDER BY p.owned DESC, p.reached_at, p.user_id
+LIMIT $2
+""")
+
+@metrics.timed(metrics.DB_CALL_SECONDS)
+async def get_progress(pool: dbpool.Source, user_id: int, gachatype: str):
+    # 戻り値: {"owned", "rank", "by_rarity": {レア度: 枚数}} / 1枚も持っていなければ None
+    async with dbpool.acquire(pool) as conn:
+        row = await dbpool.fetchrow(conn, SQL_GET_PROGRESS, user_id, gachatype)
+    if row is None:
+        return None
+    return {
+        "owned": row["owned"],
+        "rank": row["rank"],
+        "by_rarity": {rarity: int(n) for rarity, n in row["by_rarity"]},
+    }
+
+@metrics.timed(metrics.DB_CALL_SECONDS)
+async def get_leaderboard(pool: dbpool.Source, gachatype: str, limit: int = 10) -> list:
+    async with dbpool.acquire(pool) as conn:
+        return await dbpool.fetch(conn, SQL_LEADERBOARD, gachatype, limit)
+
+ENCODING_SAMPLE_BYTES = 64 * 1024  # 文字コード判定に使う先頭バイト数
+
+def _inspect_csv(csv_path: str):
+    # 先頭だけで文字コードを判定し、ファイル全体はチャンクごとにハッシュする
+    h = hashlib.sha256()
+    with open(csv_path, 'rb') as f:
+        head = f.read(ENCODING_SAMPLE_BYTES)
+        h.update(head)
+        for chunk in iter(lambda: f.read(ENCODING_SAMPLE_BYTES), b''):
+            h.update(chunk)
+    enc = chardet.detect(head)['encoding'] or 'utf-8'
+    return enc, h.hexdigest()
+
+def _iter_catalog_rows(csv_path: str, enc: str):
+    with open(csv_path, newline='', encoding=enc) as cf:
+        for r in csv.DictReader(cf):
+            try:
+                no = int(r["No."])
+            except (TypeError, ValueError):
+                logger.warning("Skipped row with invalid No. in %s: %r", csv_path, r.get('No.'))
+                continue
+            rate = 0.0
+            try:
+                rate = float(r["rate"] or 0.0)
+            except (TypeError, ValueError):
+                # 0 として取り込む（抽選されない）。事前確認は tools/simulate_rates.py で
+                logger.warning("Invalid rate for No.%s in %s: %r", no, csv_path, r.get('rate'))
+            yield no, r["url"], r["chname"], r["rarity"], rate, r["title"]
+
+@metrics.timed(metrics.DB_CALL_SECONDS)
+async def load_gacha_data(pool: dbpool.Source, csv_path: str, gachatype: str):
     if not os.path.exists(csv_path):
-        logger.error(f"CSV not found: {csv_path}")
+        logger.error("CSV not found: %s", csv_path)
         return
-    with open(csv_path, 'rb') as f:
-        enc = chardet.detect(f.read())['encoding']
-    async with pool.acquire() as conn:
-        with open(csv_path, newline='', encoding=enc) as cf:
-            reader = csv.DictReader(cf)
-            for r in reader:
-                no, url, chname, rarity = r["No."], r["url"], r["chname"], r["rarity"]
-                rate = 0.0
-                try:
-                    rate = float(r["rate"] or 0.0)
-                except:
-                    pass
-                title = r["title"]
-                exists = await conn.fetchval(
-                    f"SELECT no FROM {table} WHERE no=$1", no
-                )
-                if exists:
-                    continue
-                await conn.execute(f"""
-                    INSERT INTO {table}(no,url,chname,rarity,rate,title)
-                    VALUES($1,$2,$3,$4,$5,$6)
-                """, no, url, chname, rarity, rate, title)
-    logger.info(f"Loaded {gachatype} data")
-
-async def get_random_item(pool: asyncpg.Pool, gachatype: str):
-    table = f"gacha_items_{gachatype}"
-    async with pool.acquire() as conn:
-        rows = await conn.fetch(f"SELECT no,url,chname,rarity,rate,title FROM {table}")
-        if not rows:
-            return None
-        total = sum(r["rate"] for r in rows)
-        rnd = random.uniform(0, total)
-        cum = 0.0
-        for r in rows:
-            cum += r["rate"]
-            if rnd <= cum:
-                return dict(r)
-        return dict(rows[-1])
+    enc, content_hash = _inspect_csv(csv_path)
+    async with dbpool.acquire(pool) as conn:
+        stored = await conn.fetchval(
+            "SELECT content_hash FROM gacha_catalog_state WHERE gachatype=$1",
+            gachatype
+        )
+        if stored == content_hash:
+            if draw.get_sampler(gachatype) is None:
+                await refresh_catalog(conn, gachatype)
+            logger.info("%s data unchanged, skipped", gachatype)
+            return
+        # 一時テーブルへ COPY し、新しい行と内容が変わった行だけを1文で反映する
+        # No. が重複していたら先の行だけを使う
+        async with conn.transaction():
+            await conn.execute("""
+            CREATE TEMP TABLE gacha_staging (
+              no INTEGER, url TEXT, chname TEXT, rarity TEXT, rate REAL, title TEXT
+            ) ON COMMIT DROP
+            """)
+            await conn.copy_records_to_table(
+                "gacha_staging",
+                records=_iter_catalog_rows(csv_path, enc),
+                columns=["no", "url", "chname", "rarity", "rate", "title"],
+            )
+            # レア度が変わるとレア度別の所持枚数（user_progress_rarity）の数え直しが要る
+            regrade = await conn.fetchval("""
+            SELECT EXISTS(
+              SELECT 1 FROM gacha_staging s JOIN gacha_items gi ON gi.gachatype=$1 AND gi.no=s.no
+              WHERE gi.rarity IS DISTINCT FROM s.rarity
+            )
+            """, gachatype)
+            status = await conn.execute("""
+            INSERT INTO gacha_items(gachatype,no,url,chname,rarity,rate,title)
+            SELECT DISTINCT ON (no) $1,no,url,chname,rarity,rate,title FROM gacha_staging ORDER BY no, ctid
+            ON CONFLICT(gachatype, no) DO UPDATE
+              SET url=excluded.url, chname=excluded.chname, rarity=excluded.rarity,
+                  rate=excluded.rate, title=excluded.title
+              WHERE (gacha_items.url, gacha_items.chname, gacha_items.rarity, gacha_items.rate, gacha_items.title)
+                    IS DISTINCT FROM (excluded.url, excluded.chname, excluded.rarity, excluded.rate, excluded.title)
+            """, gachatype)
+            if regrade:
+                # 数え直す間は抽選による加算を待たせる
+                await conn.execute("LOCK TABLE user_progress_rarity IN EXCLUSIVE MODE")
+                await conn.execute("DELETE FROM user_progress_rarity WHERE gachatype=$1", gachatype)
+                await conn.execute("""
+                INSERT INTO user_progress_rarity(user_id, gachatype, rarity, owned)
+                SELECT uc.user_id, uc.gachatype, gi.rarity, count(*)
+                FROM user_cards uc
+                JOIN gacha_items gi ON gi.gachatype = uc.gachatype AND gi.no = uc.card_no
+                WHERE uc.gachatype=$1
+                GROUP BY 1, 2, 3
+                """, gachatype)
+            await conn.execute("""
+            INSERT INTO gacha_catalog_state(gachatype, content_hash, loaded_at)
+            VALUES($1, $2, now())
+            ON CONFLICT(gachatype) DO UPDATE
+              SET content_hash=excluded.content_hash, loaded_at=excluded.loaded_at
+            """, gachatype, content_hash)
+        changed = int(status.split()[-1])
+        # テーブルに変化（追加・更新）があった時だけ抽選器と一覧を作り直す
+        if changed or draw.get_sampler(gachatype) is None:
+            await refresh_catalog(conn, gachatype)
+    logger.info("Loaded %s data (%d new or updated rows)", gachatype, changed)
+
+@metrics.timed(metrics.DB_CALL_SECONDS)
+async def refresh_catalog(conn, gachatype: str):
+    # 抽選器と一覧表示用カタログをまとめて作り直す
+    rows = await conn.fetch(
+        "SELECT no,url,chname,rarity,rate,title FROM gacha_items WHERE gachatype=$1 ORDER BY no",
+        gachatype
+    )
+    catalog.set_items(gachatype, rows)
+    return draw.set_items(gachatype, rows)
+
+@metrics.timed(metrics.DB_CALL_SECONDS)
+async def get_catalog(pool: dbpool.Source, gachatype: str):
+    cat = catalog.get(gachatype)
+    if cat is None:
+        async with dbpool.acquire(pool) as conn:
+            await refresh_catalog(conn, gachatype)
+        cat = catalog.get(gachatype)
+    return cat
+
+async def _get_sampler(pool: dbpool.Source, gachatype: str):
+    sampler = draw.get_sampler(gachatype)
+    if sampler is None:
+        async with dbpool.acquire(pool) as conn:
+            sampler = await refresh_catalog(conn, gachatype)
+    return sampler
+
+@metrics.timed(metrics.DB_CALL_SECONDS)
+async def get_random_item(pool: dbpool.Source, gachatype: str):
+    # 抽選はメモリ上のエイリアステーブルで行い、DBは読まない
+    sampler = await _get_sampler(pool, gachatype)
+    return sampler.draw()
+
+@metrics.timed(metrics.DB_CALL_SECONDS)
+async def get_random_items(pool: dbpool.Source, gachatype: str, n: int) -> list:
+    sampler = await _get_sampler(pool, gachatype)
+    return sampler.draw_many(n)
@@ -0,0 +1,219 @@
+import os
+import time
+import asyncio
+import logging
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Union
+
+import asyncpg
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# ─── コネクションプールとプリペアドステートメント ───────────────────
+# よく使うSQLは名前付きで登録しておき、コネクションを作った時に1回だけ prepare する
+# db.py の関数は Pool とコネクションのどちらでも受け取れるので、
+# 1つのコマンド処理の中で同じコネクションを使い回せる:
+#   async with dbpool.acquire(bot.db_pool) as conn:
+#       pts = await db.get_points(conn, ...)
+#       instant = await db.get_instant_reveal(conn, ...)
+
+Source = Union[asyncpg.Pool, asyncpg.Connection]
+
+STATEMENTS = {}
+
+
+def statement(name: str, sql: str) -> str:
+    # ホットパスのSQLを登録する。戻り値は名前（run() に渡す）
+    if name in STATEMENTS and STATEMENTS[name] != sql:
+        raise ValueError(f"Statement {name} is already registered")
+    STATEMENTS[name] = sql
+    return name
+
+
+# ─── 設定（環境変数） ─────────────────────────────────────
+def _env_int(key: str, default: int) -> int:
+    v = os.getenv(key)
+    return int(v) if v else default
+
+
+def _env_float(key: str, default: float):
+    v = os.getenv(key)
+    if not v:
+        return default
+    return float(v) if float(v) > 0 else None  # 0 以下はタイムアウトなし
+
+
+def pool_options() -> dict:
+    return {
+        "min_size": _env_int("DB_POOL_MIN_SIZE", 2),
+        "max_size": _env_int("DB_POOL_MAX_SIZE", 10),
+        "statement_cache_size": _env_int("DB_STATEMENT_CACHE_SIZE", 100),
+        # 0 = キャッシュしたステートメントを時間で捨てない
+        "max_cached_statement_lifetime": _env_int("DB_STATEMENT_LIFETIME", 0),
+        "command_timeout": _env_float("DB_COMMAND_TIMEOUT", 10.0),
+        # 0 = 使われていない接続も閉じない（タイムアウトではないので None にしない）
+        "max_inactive_connection_lifetime": float(os.getenv("DB_MAX_INACTIVE_LIFETIME") or 300.0),
+    }
+
+
+ACQUIRE_TIMEOUT = _env_float("DB_ACQUIRE_TIMEOUT", 10.0)
+
+
+# ─── 計測 ────────────────────────────────────────────
+class LatencyStats:
+    # 件数・合計・最大と、直近の値から出すパーセンタイル
+    def __init__(self, window: int = 1024):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.errors = 0
+        self._recent = deque(maxlen=window)
+
+    def observe(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self._recent.append(seconds)
+
+    def percentile(self, q: float) -> float:
+        if not self._recent:
+            return 0.0
+        data = sorted(self._recent)
+        return data[min(len(data) - 1, int(q * len(data)))]
+
+    def snapshot(self) -> dict:
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "avg": self.total / self.count if self.count else 0.0,
+            "p50": self.percentile(0.50),
+            "p95": self.percentile(0.95),
+            "p99": self.percentile(0.99),
+            "max": self.max,
+        }
+
+
+acquire_stats = LatencyStats()
+query_stats = {}
+
+
+def _query_stats(name: str) -> LatencyStats:
+    st = query_stats.get(name)
+    if st is None:
+        st = query_stats[name] = LatencyStats()
+    return st
+
+
+def stats(pool: asyncpg.Pool = None) -> dict:
+    out = {
+        "acquire": acquire_stats.snapshot(),
+        "queries": {name: st.snapshot() for name, st in sorted(query_stats.items())},
+    }
+    if pool is not None:
+        out["pool"] = {
+            "size": pool.get_size(),
+            "idle": pool.get_idle_size(),
+            "min": pool.get_min_size(),
+            "max": pool.get_max_size(),
+        }
+    return out
+
+
+# ─── コネクション ───────────────────────────────────────
+# PreparedStatement オブジェクトはプールへ返却すると使えなくなるので、
+# 登録済みSQLは asyncpg のコネクション単位のステートメントキャッシュに載せておく
+# （以後 conn.fetch(sql) は Parse なしで実行される）
+class GachaConnection(asyncpg.Connection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+
+    async def prepare_registered(self):
+        for name, sql in STATEMENTS.items():
+            if name in self.prepared:
+                continue
+            try:
+                # 公開の prepare() で作った文はキャッシュに載らず、conn.fetch(sql) では使われない。
+                # fetch と同じ内部の _get_statement を呼んでキャッシュに載せる
+                # 内部 API なので asyncpg は requirements.txt で版を固定している（0.27〜0.32 で同じ呼び方）
+                await self._get_statement(sql, None)
+            except (AttributeError, TypeError) as e:
+                # 内部 API が変わっていたら事前の prepare はやめる（初回実行時に prepare される）
+                logger.warning("Cannot pre-prepare statements with this asyncpg: %s", e)
+                return
+            except asyncpg.PostgresError as e:
+                # プール作成時はまだマイグレーション前のことがある。初回実行時に prepare される
+                logger.debug("Deferred preparing %s: %s", name, e)
+                continue
+            self.prepared.add(name)
+
+
+async def _init_connection(conn):
+    await conn.prepare_registered()
+
+
+async def create_pool(dsn: str, **overrides) -> asyncpg.Pool:
+    opts = pool_options()
+    opts.update(overrides)
+    if 0 < opts["statement_cache_size"] < len(STATEMENTS):
+        logger.warning(
+            "DB_STATEMENT_CACHE_SIZE=%d is smaller than the %d registered statements",
+            opts["statement_cache_size"], len(STATEMENTS)
+        )
+    pool = await asyncpg.create_pool(
+        dsn, connection_class=GachaConnection, init=_init_connection, **opts
+    )
+    logger.info("DB pool created (%s)", opts)
+    return pool
+
+
+@asynccontextmanager
+async def acquire(source: Source):
+    # Pool なら1本借りて待ち時間を記録する。コネクションならそのまま使う
+    if not isinstance(source, asyncpg.Pool):
+        yield source
+        return
+    start = time.perf_counter()
+    try:
+        conn = await source.acquire(timeout=ACQUIRE_TIMEOUT)
+    except asyncio.TimeoutError:
+        acquire_stats.errors += 1
+        raise
+    waited = time.perf_counter() - start
+    acquire_stats.observe(waited)
+    metrics.DB_ACQUIRE_SECONDS.observe(waited)
+    try:
+        yield conn
+    finally:
+        await source.release(conn)
+
+
+async def run(conn, name: str, *args, method: str = "fetchrow"):
+    # 登録済みステートメントを実行し、所要時間を記録する
+    # method は fetch / fetchrow / fetchval
+    st = _query_stats(name)
+    start = time.perf_counter()
+    try:
+        result = await getattr(conn, method)(STATEMENTS[name], *args)
+    except Exception:
+        st.errors += 1
+        raise
+    elapsed = time.perf_counter() - start
+    st.observe(elapsed)
+    metrics.DB_QUERY_SECONDS.labels(name).observe(elapsed)
+    return result
+
+
+async def fetch(conn, name: str, *args):
+    return await run(conn, name, *args, method="fetch")
+
+
+async def fetchrow(conn, name: str, *args):
+    return await run(conn, name, *args, method="fetchrow")
+
+
+async def fetchval(conn, name: str, *args):
+    return await run(conn, name, *args, method="fetchval")
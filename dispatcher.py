@@ -0,0 +1,96 @@
+import os
+import time
+import asyncio
+import logging
+from collections import defaultdict
+from contextlib import asynccontextmanager
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# ─── インタラクションの振り分け ──────────────────────────────
+# ・受け付けたらすぐ defer して、3秒の応答期限を処理時間と切り離す
+# ・同じユーザーの処理は1つずつ順に実行する
+# ・同じ種類の操作がまだ処理中・待ち中なら、重ねて押された分は実行せずに知らせる
+# ・レーン（pull / list / admin）ごとに同時実行数を絞り、ガチャの連打で一覧表示や管理コマンドが詰まらないようにする
+#   レーンで絞るのは DB などの共有資源を使う部分だけ。演出のようにチャンネルのレート制限を待つだけの
+#   処理まで枠を占有すると全体が詰まるので、その場合は lane=None で渡し、work の中で lane() を使う
+
+DEFAULT_LIMITS = {
+    "pull": int(os.getenv("LANE_PULL_LIMIT", "32")),
+    "list": int(os.getenv("LANE_LIST_LIMIT", "16")),
+    "admin": int(os.getenv("LANE_ADMIN_LIMIT", "4")),
+}
+
+BUSY_MESSAGE = "前の操作を処理中です。完了までお待ちください。"
+
+
+class _UserState:
+    __slots__ = ("lock", "pending", "refs")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.pending = set()  # 処理中・待ち中の操作の種類
+        self.refs = 0
+
+
+class Dispatcher:
+    def __init__(self, limits: dict = None):
+        limits = limits or DEFAULT_LIMITS
+        self.lanes = {name: asyncio.Semaphore(n) for name, n in limits.items()}
+        self.limits = dict(limits)
+        self._users = {}  # 処理中のユーザーだけ持つ
+        self.active = defaultdict(int)  # レーンごとの実行中の数
+        self.stats = defaultdict(int)
+        for name in self.lanes:
+            metrics.LANE_ACTIVE.set_function(lambda name=name: self.active[name], name)
+
+    @asynccontextmanager
+    async def lane(self, name: str):
+        # レーンの枠が空くまで待つ（管理コマンドなど Interaction を伴わない処理にも使う）
+        start = time.perf_counter()
+        async with self.lanes[name]:
+            metrics.LANE_WAIT_SECONDS.labels(name).observe(time.perf_counter() - start)
+            self.active[name] += 1
+            try:
+                yield
+            finally:
+                self.active[name] -= 1
+
+    async def submit(self, interaction, lane, work, *, key: str = None,
+                     ephemeral: bool = False, thinking: bool = False) -> bool:
+        # work(interaction) を実行する。重複として弾いた場合は False
+        # work の中では応答済みなので followup / edit_original_response を使う
+        # lane=None ならレーンの枠は取らない（key は必須）
+        key = key or lane
+        user_id = interaction.user.id
+        state = self._users.get(user_id)
+        if state is not None and key in state.pending:
+            self.stats["coalesced"] += 1
+            metrics.DISPATCH_COALESCED.labels(key).inc()
+            if not interaction.response.is_done():
+                await interaction.response.send_message(BUSY_MESSAGE, ephemeral=True)
+            return False
+
+        # defer を待つ間に届いた重複も弾けるよう、先に処理中として登録する
+        if state is None:
+            state = self._users[user_id] = _UserState()
+        state.pending.add(key)
+        state.refs += 1
+        try:
+            if not interaction.response.is_done():
+                await interaction.response.defer(ephemeral=ephemeral, thinking=thinking)
+            async with state.lock:
+                if lane is None:
+                    await work(interaction)
+                else:
+                    async with self.lane(lane):
+                        self.stats[lane] += 1
+                        await work(interaction)
+        finally:
+            state.pending.discard(key)
+            state.refs -= 1
+            if state.refs == 0:
+                del self._users[user_id]
+        return True
@@ -0,0 +1,108 @@
+import random
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+# ─── エイリアス法による抽選器 ─────────────────────────────
+# Vose のエイリアス法でテーブルを前計算し、1回の抽選を O(1) で行う
+class AliasSampler:
+    def __init__(self, items: list, rng: random.Random = None):
+        self.items = items
+        self.rng = rng or random.Random()
+        n = len(items)
+        rates = [max(0.0, float(it["rate"] or 0.0)) for it in items]
+        total = sum(rates)
+        self.total = total
+        self.prob = [0.0] * n
+        self.alias = [0] * n
+        if n == 0:
+            return
+        if total <= 0:
+            # 全て0なら等確率
+            rates = [1.0] * n
+            total = float(n)
+        scaled = [r * n / total for r in rates]
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+        while small and large:
+            s = small.pop()
+            l = large.pop()
+            self.prob[s] = scaled[s]
+            self.alias[s] = l
+            scaled[l] = (scaled[l] + scaled[s]) - 1.0
+            if scaled[l] < 1.0:
+                small.append(l)
+            else:
+                large.append(l)
+        # 丸め誤差で残ったものは確率1
+        for i in large + small:
+            self.prob[i] = 1.0
+            self.alias[i] = i
+        self._prob_np = np.asarray(self.prob, dtype=np.float64)
+        self._alias_np = np.asarray(self.alias, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.items)
+
+    def draw_index(self) -> int:
+        i = self.rng.randrange(len(self.items))
+        if self.rng.random() < self.prob[i]:
+            return i
+        return self.alias[i]
+
+    def draw(self):
+        if not self.items:
+            return None
+        return dict(self.items[self.draw_index()])
+
+    def draw_indices(self, n: int) -> np.ndarray:
+        # n 回分をまとめて抽選する（NumPy でベクトル化）
+        gen = np.random.default_rng(self.rng.getrandbits(64))
+        cols = gen.integers(0, len(self.items), size=n)
+        coins = gen.random(n)
+        return np.where(coins < self._prob_np[cols], cols, self._alias_np[cols])
+
+    def draw_many(self, n: int) -> list:
+        if not self.items:
+            return []
+        return [dict(self.items[i]) for i in self.draw_indices(n)]
+
+
+# ─── ガチャ種別ごとの抽選器キャッシュ ───────────────────────
+_samplers = {}
+
+
+def _key(gachatype: str) -> str:
+    # テーブル名は小文字扱いなので、キーも小文字で統一
+    return gachatype.lower()
+
+
+def set_items(gachatype: str, items: list, rng: random.Random = None):
+    sampler = AliasSampler([dict(it) for it in items], rng)
+    _samplers[_key(gachatype)] = sampler
+    logger.info("Built sampler for %s (%d items)", gachatype, len(sampler))
+    return sampler
+
+
+def get_sampler(gachatype: str):
+    return _samplers.get(_key(gachatype))
+
+
+def clear():
+    _samplers.clear()
+
+
+def draw(gachatype: str):
+    sampler = get_sampler(gachatype)
+    if sampler is None:
+        return None
+    return sampler.draw()
+
+
+def draw_many(gachatype: str, n: int) -> list:
+    sampler = get_sampler(gachatype)
+    if sampler is None:
+        return []
+    return sampler.draw_many(n)
@@ -0,0 +1,370 @@
+import io
+import os
+import re
+import time
+import asyncio
+import hashlib
+import logging
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from urllib.parse import urlparse, parse_qs
+
+import aiohttp
+import discord
+from aiohttp import web
+
+import dbpool
+import metrics
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow がなければサムネイルは作らず、取得した画像をそのまま使う
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+# ─── カード画像のキャッシュ ───────────────────────────────
+# CSV の url（Google Drive）から各画像を1回だけ取得してディスクに保存し、サムネイルを作る
+# 演出では Drive の代わりに次のどちらかの URL を使う（どちらも未設定なら Drive のまま）
+#   IMAGE_PUBLIC_URL     画像エンドポイント（IMAGE_PORT）を外から見た URL（例: https://example.com）
+#   IMAGE_ASSET_CHANNEL  画像を1回だけアップロードしておく Discord チャンネルのID
+# その他
+#   IMAGE_CACHE_DIR          保存先（既定 cache/images）
+#   IMAGE_HOST / IMAGE_PORT  画像エンドポイント（既定 0.0.0.0 / 0 = 無効）
+#                            launcher.py から起動した場合は最初のプロセスだけが待ち受ける
+#   IMAGE_THUMB_SIZE         サムネイルの長辺（既定 320px）
+#   IMAGE_FULL_MAX           これより大きい画像は縮小して再圧縮する（既定 1600px）
+#   IMAGE_FETCH_CONCURRENCY  Drive への同時取得数（既定 4）
+# 取得結果とアップロード先は card_assets テーブルに記録し、再起動しても取り直さない
+
+CACHE_DIR = os.getenv("IMAGE_CACHE_DIR", "cache/images")
+PUBLIC_URL = os.getenv("IMAGE_PUBLIC_URL", "").rstrip("/")
+ASSET_CHANNEL = int(os.getenv("IMAGE_ASSET_CHANNEL") or 0)
+THUMB_SIZE = int(os.getenv("IMAGE_THUMB_SIZE", "320"))
+FULL_MAX = int(os.getenv("IMAGE_FULL_MAX", "1600"))
+FETCH_CONCURRENCY = int(os.getenv("IMAGE_FETCH_CONCURRENCY", "4"))
+FETCH_RETRIES = 3
+FETCH_TIMEOUT = 30.0
+MAX_UPLOAD_BYTES = 8 * 1024 * 1024  # ブーストなしのサーバーの添付上限
+# Discord の添付URLは署名付きで期限がある。期限が近いものは貼り直し、直前のものは使わない
+REFRESH_MARGIN = timedelta(hours=6)
+EXPIRY_GRACE = timedelta(minutes=10)
+
+_SAFE_NAME = re.compile(r"^[a-z0-9_\-]+$")
+_FILE_NAME = re.compile(r"^\d+(_thumb)?\.(jpg|png|gif|webp)$")
+_PIL_EXT = {"JPEG": "jpg", "PNG": "png", "GIF": "gif", "WEBP": "webp"}
+_CONTENT_EXT = {"image/jpeg": "jpg", "image/png": "png", "image/gif": "gif", "image/webp": "webp"}
+
+
+class FetchError(Exception):
+    pass
+
+
+class _Retry(FetchError):
+    # 429 や 5xx など、待てば取れる見込みのあるもの
+    pass
+
+
+def enabled() -> bool:
+    return bool(PUBLIC_URL or ASSET_CHANNEL)
+
+
+# ─── 画像の加工（スレッドで実行） ──────────────────────────
+def _encode_jpeg(im, quality: int) -> bytes:
+    if im.mode not in ("RGB", "L"):
+        # 透過部分は白で塗る
+        im = im.convert("RGBA")
+        bg = Image.new("RGB", im.size, (255, 255, 255))
+        bg.paste(im, mask=im.getchannel("A"))
+        im = bg
+    buf = io.BytesIO()
+    im.save(buf, "JPEG", quality=quality, optimize=True, progressive=True)
+    return buf.getvalue()
+
+
+def _process(data: bytes, content_type: str) -> dict:
+    # 保存するファイルを作る。戻り値: {"full" / "thumb": (拡張子, バイト列)}
+    if Image is None:
+        ext = _CONTENT_EXT.get(content_type)
+        if ext is None:
+            raise FetchError(f"unexpected content type {content_type!r}")
+        return {"full": (ext, data)}
+    try:
+        im = Image.open(io.BytesIO(data))
+        im.load()
+    except Exception as e:
+        # Drive はファイルが大きいと確認ページ（HTML）を返すことがある
+        raise FetchError(f"not an image ({content_type!r}): {e}") from e
+    out = {}
+    ext = _PIL_EXT.get(im.format)
+    if ext and max(im.size) <= FULL_MAX and len(data) <= MAX_UPLOAD_BYTES:
+        out["full"] = (ext, data)
+    else:
+        full = im.copy()
+        full.thumbnail((FULL_MAX, FULL_MAX))
+        out["full"] = ("jpg", _encode_jpeg(full, 85))
+    thumb = im.copy()
+    thumb.thumbnail((THUMB_SIZE, THUMB_SIZE))
+    out["thumb"] = ("jpg", _encode_jpeg(thumb, 80))
+    return out
+
+
+def _write(path: str, data: bytes):
+    # 書きかけのファイルを配信しないよう、別名で書いてから置き換える
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def expires_at(url: str):
+    # 署名付きURLの ex（16進の UNIX 時刻）
+    ex = parse_qs(urlparse(url).query).get("ex")
+    if not ex:
+        return None
+    try:
+        return datetime.fromtimestamp(int(ex[0], 16), timezone.utc)
+    except ValueError:
+        return None
+
+
+# ─── 記録 ────────────────────────────────────────────
+SQL_PUT_ASSET = dbpool.statement("put_card_asset", """
+INSERT INTO card_assets(gachatype, card_no, kind, source_url, filename, content_hash, bytes, fetched_at)
+VALUES($1,$2,$3,$4,$5,$6,$7,now())
+ON CONFLICT(gachatype, card_no, kind) DO UPDATE
+  SET source_url=excluded.source_url, filename=excluded.filename,
+      content_hash=excluded.content_hash, bytes=excluded.bytes, fetched_at=excluded.fetched_at,
+      channel_id=NULL, message_id=NULL, url=NULL, expires_at=NULL
+RETURNING *
+""")
+SQL_SET_UPLOAD = dbpool.statement("set_card_asset_upload", """
+UPDATE card_assets SET channel_id=$4, message_id=$5, url=$6, expires_at=$7
+WHERE gachatype=$1 AND card_no=$2 AND kind=$3
+RETURNING *
+""")
+
+
+class ImageStore:
+    def __init__(self, cache_dir: str = CACHE_DIR, public_url: str = PUBLIC_URL):
+        self.cache_dir = cache_dir
+        self.public_url = public_url
+        self.channel = None  # アップロード先（IMAGE_ASSET_CHANNEL）
+        self._assets = {}  # (ガチャ種別, カード番号, "full" / "thumb") → card_assets の行
+        self._session = None
+        self._fetch_limit = asyncio.Semaphore(FETCH_CONCURRENCY)
+        self.stats = defaultdict(int)
+
+    def path(self, filename: str) -> str:
+        return os.path.join(self.cache_dir, filename)
+
+    async def load(self, pool: dbpool.Source):
+        async with dbpool.acquire(pool) as conn:
+            rows = await conn.fetch("SELECT * FROM card_assets")
+        self._assets = {(r["gachatype"], r["card_no"], r["kind"]): dict(r) for r in rows}
+        logger.info("Loaded %d card assets", len(self._assets))
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    # ─── URL ─────────────────────────────────────────
+    def url_for(self, gachatype: str, item: dict, thumb: bool = False, stable: bool = False) -> str:
+        # 表示に使う画像URL。使えるものがなければ CSV の url のまま
+        # stable=True は一覧のリンクなど後から開かれるもの用（期限付きの添付URLは返さない）
+        for kind in (("thumb", "full") if thumb else ("full",)):
+            asset = self._assets.get((gachatype, item["no"], kind))
+            if asset is None or asset["source_url"] != item["url"]:
+                continue
+            url = self._public_url(asset, stable)
+            if url:
+                metrics.IMAGE_URLS.labels("cache").inc()
+                return url
+        metrics.IMAGE_URLS.labels("origin").inc()
+        return item["url"]
+
+    def _public_url(self, asset: dict, stable: bool):
+        if self.public_url:
+            return f"{self.public_url}/images/{asset['filename']}?v={asset['content_hash'][:12]}"
+        if stable or not asset["url"]:
+            return None
+        if asset["expires_at"] and asset["expires_at"] - datetime.now(timezone.utc) < EXPIRY_GRACE:
+            return None
+        return asset["url"]
+
+    def local_path(self, gachatype: str, item: dict, thumb: bool = True):
+        # 手元にある画像ファイル（一覧画像の合成用）。なければ None
+        for kind in (("thumb", "full") if thumb else ("full",)):
+            asset = self._assets.get((gachatype, item["no"], kind))
+            if asset is None or asset["source_url"] != item["url"]:
+                continue
+            path = self.path(asset["filename"])
+            if os.path.exists(path):
+                return path
+        return None
+
+    # ─── 取得 ─────────────────────────────────────────
+    def _is_current(self, gachatype: str, item: dict) -> bool:
+        kinds = ("full",) if Image is None else ("full", "thumb")
+        for kind in kinds:
+            asset = self._assets.get((gachatype, item["no"], kind))
+            if asset is None or asset["source_url"] != item["url"]:
+                return False
+            # 配信・アップロードに使うファイルが手元にない（別のホストで取得した等）
+            needs_file = self.public_url or asset["message_id"] is None
+            if needs_file and not os.path.exists(self.path(asset["filename"])):
+                return False
+        return True
+
+    async def _download(self, url: str):
+        if self._session is None:
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=FETCH_TIMEOUT))
+        delay = 1.0
+        for attempt in range(1, FETCH_RETRIES + 1):
+            try:
+                async with self._session.get(url) as resp:
+                    if resp.status == 429 or resp.status >= 500:
+                        raise _Retry(f"HTTP {resp.status}")
+                    if resp.status != 200:
+                        raise FetchError(f"HTTP {resp.status}")
+                    return await resp.read(), resp.content_type
+            except (_Retry, aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if attempt == FETCH_RETRIES:
+                    raise FetchError(str(e) or type(e).__name__) from e
+                await asyncio.sleep(delay)
+                delay *= 2
+
+    async def _fetch(self, pool: dbpool.Source, gachatype: str, item: dict) -> bool:
+        start = time.perf_counter()
+        try:
+            async with self._fetch_limit:
+                data, content_type = await self._download(item["url"])
+            files = await asyncio.to_thread(_process, data, content_type)
+            rows = []
+            for kind, (ext, body) in files.items():
+                filename = f"{gachatype}/{item['no']}{'_thumb' if kind == 'thumb' else ''}.{ext}"
+                await asyncio.to_thread(_write, self.path(filename), body)
+                rows.append((kind, filename, hashlib.sha256(body).hexdigest(), len(body)))
+        except (FetchError, OSError) as e:
+            self.stats["failed"] += 1
+            metrics.IMAGE_FETCHES.labels("error").inc()
+            logger.warning("Failed to fetch image for [%s] No.%s: %s", gachatype, item["no"], e)
+            return False
+        async with dbpool.acquire(pool) as conn:
+            for kind, filename, content_hash, size in rows:
+                row = await dbpool.fetchrow(
+                    conn, SQL_PUT_ASSET, gachatype, item["no"], kind, item["url"], filename, content_hash, size
+                )
+                self._assets[(gachatype, item["no"], kind)] = dict(row)
+        self.stats["fetched"] += 1
+        metrics.IMAGE_FETCHES.labels("ok").inc()
+        metrics.IMAGE_FETCH_SECONDS.observe(time.perf_counter() - start)
+        return True
+
+    # ─── アップロード ───────────────────────────────────
+    async def _upload(self, pool: dbpool.Source, gachatype: str, no: int):
+        assets = [a for a in (self._assets.get((gachatype, no, k)) for k in ("full", "thumb")) if a]
+        files = [discord.File(self.path(a["filename"]), filename=os.path.basename(a["filename"])) for a in assets]
+        try:
+            msg = await self.channel.send(content=f"{gachatype} No.{no}", files=files)
+        except (discord.HTTPException, OSError) as e:
+            logger.warning("Failed to upload image for [%s] No.%s: %s", gachatype, no, e)
+            return
+        await self._record_message(pool, gachatype, no, msg)
+        self.stats["uploaded"] += 1
+
+    async def _record_message(self, pool: dbpool.Source, gachatype: str, no: int, msg: discord.Message):
+        by_name = {att.filename: att for att in msg.attachments}
+        async with dbpool.acquire(pool) as conn:
+            for kind in ("full", "thumb"):
+                asset = self._assets.get((gachatype, no, kind))
+                att = asset and by_name.get(os.path.basename(asset["filename"]))
+                if att is None:
+                    continue
+                row = await dbpool.fetchrow(
+                    conn, SQL_SET_UPLOAD, gachatype, no, kind,
+                    msg.channel.id, msg.id, att.url, expires_at(att.url)
+                )
+                self._assets[(gachatype, no, kind)] = dict(row)
+
+    async def refresh_expiring(self, pool: dbpool.Source):
+        # 期限が近い添付URLを、メッセージを取り直して新しい署名のものに替える
+        if self.channel is None:
+            return
+        soon = datetime.now(timezone.utc) + REFRESH_MARGIN
+        targets = {
+            (a["gachatype"], a["card_no"], a["message_id"]) for a in self._assets.values()
+            if a["message_id"] and a["expires_at"] and a["expires_at"] < soon
+        }
+        for gachatype, no, message_id in targets:
+            try:
+                msg = await self.channel.fetch_message(message_id)
+            except discord.NotFound:
+                await self._upload(pool, gachatype, no)
+                continue
+            except discord.HTTPException as e:
+                logger.warning("Failed to refresh image message %s: %s", message_id, e)
+                continue
+            await self._record_message(pool, gachatype, no, msg)
+        if targets:
+            logger.info("Refreshed %d image messages", len(targets))
+
+    # ─── 同期 ─────────────────────────────────────────
+    async def sync(self, pool: dbpool.Source, gachatype: str, items: list) -> int:
+        # 未取得・CSV の url が変わった・ファイルが消えた画像を取得し、必要ならアップロードする
+        # 複数プロセスで同時に起動しても Drive へは1回だけ取りに行くよう、種別ごとにロックする
+        # 戻り値: (取得した枚数, 読み込んだ画像が変わったか)
+        # 他のプロセスが取得した分も読み直すので、自分で取得していなくても変わることがある
+        before = self._assets_of(gachatype)
+        todo, fetched = [], 0
+        async with dbpool.acquire(pool) as lock_conn:
+            await lock_conn.execute("SELECT pg_advisory_lock(hashtext('card_assets:' || $1))", gachatype)
+            try:
+                await self.load(lock_conn)
+                todo = [it for it in items if not self._is_current(gachatype, it)]
+                fetched = sum(await asyncio.gather(*(self._fetch(pool, gachatype, it) for it in todo)))
+                if self.channel is not None:
+                    for it in items:
+                        asset = self._assets.get((gachatype, it["no"], "full"))
+                        if asset is not None and asset["message_id"] is None:
+                            await self._upload(pool, gachatype, it["no"])
+            finally:
+                await lock_conn.execute("SELECT pg_advisory_unlock(hashtext('card_assets:' || $1))", gachatype)
+        if todo:
+            logger.info("Synced images for %s: %d/%d fetched", gachatype, fetched, len(todo))
+        return fetched, self._assets_of(gachatype) != before
+
+    def _assets_of(self, gachatype: str) -> dict:
+        return {k: v for k, v in self._assets.items() if k[0] == gachatype}
+
+
+store = ImageStore()
+
+
+# ─── HTTP エンドポイント ──────────────────────────────────
+# URL に内容のハッシュ（?v=）を付けているので、長期間キャッシュさせてよい
+async def _handle_image(request):
+    gachatype = request.match_info["gachatype"]
+    name = request.match_info["name"]
+    if not _SAFE_NAME.match(gachatype) or not _FILE_NAME.match(name):
+        raise web.HTTPNotFound()
+    path = store.path(f"{gachatype}/{name}")
+    if not os.path.isfile(path):
+        raise web.HTTPNotFound()
+    return web.FileResponse(path, headers={"Cache-Control": "public, max-age=31536000, immutable"})
+
+
+async def start_server(host: str = None, port: int = None):
+    host = host or os.getenv("IMAGE_HOST", "0.0.0.0")
+    port = int(port if port is not None else os.getenv("IMAGE_PORT", "0"))
+    if not port:
+        return None
+    app = web.Application()
+    app.router.add_get("/images/{gachatype}/{name}", _handle_image)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info("Image endpoint on http://%s:%s/images/", host, port)
+    return runner
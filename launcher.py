@@ -0,0 +1,60 @@
+import os
+import sys
+import signal
+import logging
+import subprocess
+
+# ─── シャード分割起動 ───────────────────────────────────
+# SHARD_COUNT 個のシャードを PROCESSES 個のプロセスに振り分けて main.py を起動する
+# 例: SHARD_COUNT=4 PROCESSES=2 python launcher.py
+#   → SHARD_IDS=0,2 と SHARD_IDS=1,3 の2プロセス
+# 全プロセスが同じ DATABASE_URL を使い、クールダウンはDBで共有する
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+logger = logging.getLogger("launcher")
+
+
+def plan(shard_count: int, processes: int) -> list:
+    return [
+        list(range(i, shard_count, processes))
+        for i in range(min(processes, shard_count))
+    ]
+
+
+def main():
+    shard_count = int(os.getenv("SHARD_COUNT", "2"))
+    processes = int(os.getenv("PROCESSES", str(os.cpu_count() or 1)))
+    # メトリクスのポートはプロセスごとにずらす（METRICS_PORT=0 なら無効のまま）
+    metrics_port = int(os.getenv("METRICS_PORT", "9108"))
+    # ログファイルも分ける。ローテーションはプロセスをまたいで扱えず、同じファイルだと記録が失われる
+    log_root, log_ext = os.path.splitext(os.getenv("LOG_FILE", "bot.log"))
+    children = []
+    for i, ids in enumerate(plan(shard_count, processes)):
+        env = dict(os.environ)
+        env["SHARD_COUNT"] = str(shard_count)
+        env["SHARD_IDS"] = ",".join(map(str, ids))
+        env.setdefault("COOLDOWN_STORE", "postgres")
+        env["METRICS_PORT"] = str(metrics_port + i if metrics_port else 0)
+        env["LOG_FILE"] = f"{log_root}-{i}{log_ext}" if log_root else ""
+        # 画像エンドポイントは最初のプロセスだけが持つ（キャッシュのディレクトリは共通なので全員分を配信できる）
+        if i > 0:
+            env["IMAGE_PORT"] = "0"
+        children.append(subprocess.Popen([sys.executable, "main.py"], env=env))
+        logger.info("Started shards %s (pid %d)", ids, children[-1].pid)
+
+    def stop(signum, frame):
+        for p in children:
+            if p.poll() is None:
+                p.send_signal(signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    code = 0
+    for p in children:
+        code = p.wait() or code
+    sys.exit(code)
+
+
+if __name__ == "__main__":
+    main()
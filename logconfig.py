@@ -0,0 +1,114 @@
+import os
+import sys
+import json
+import queue
+import atexit
+import logging
+import logging.handlers
+from datetime import datetime, timezone
+
+# ─── ログ設定 ─────────────────────────────────────────
+# イベントループのスレッドではキューに積むだけにして、
+# 整形・ファイル書き込み・ローテーションは QueueListener のスレッドで行う
+#   LOG_LEVEL         既定 INFO
+#   LOG_FILE          既定 bot.log（空ならファイル出力なし）。JSON Lines で書く
+#                     launcher.py から起動した場合はプロセスごとに bot-0.log, bot-1.log …
+#   LOG_MAX_BYTES     サイズでローテーション（既定 10MB）
+#   LOG_ROTATE_WHEN   指定時は時間でローテーション（例: midnight）
+#   LOG_BACKUP_COUNT  残す世代数（既定 5）
+#   LOG_FORMAT        標準出力の形式 text|json（既定 text）
+#   LOG_QUEUE_SIZE    キューの上限。溢れた分は捨てて件数だけ数える（既定 10000）
+
+TEXT_FORMAT = '%(asctime)s %(levelname)s %(name)s: %(message)s'
+
+# LogRecord の標準属性。これ以外（extra= で渡したもの）は JSON にそのまま載せる
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        out = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and not key.startswith("_"):
+                out[key] = value
+        if record.exc_info:
+            out["exc"] = self.formatException(record.exc_info)
+        if record.stack_info:
+            out["stack"] = self.formatStack(record.stack_info)
+        return json.dumps(out, ensure_ascii=False, default=str)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    # キューが満杯でも待たずに捨てる（イベントループを止めない）
+    def __init__(self, q):
+        super().__init__(q)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # 同一プロセス内のキューなので pickle 用の整形は不要。
+        # メッセージの組み立ては出力側のスレッドに任せる
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+_listener = None
+queue_handler = None
+
+
+def setup_logging():
+    global _listener, queue_handler
+    if _listener is not None:
+        return queue_handler
+
+    handlers = []
+    stream = logging.StreamHandler(sys.stdout)
+    if os.getenv("LOG_FORMAT", "text") == "json":
+        stream.setFormatter(JsonFormatter())
+    else:
+        stream.setFormatter(logging.Formatter(TEXT_FORMAT))
+    handlers.append(stream)
+
+    path = os.getenv("LOG_FILE", "bot.log")
+    if path:
+        backups = int(os.getenv("LOG_BACKUP_COUNT", "5"))
+        when = os.getenv("LOG_ROTATE_WHEN")
+        if when:
+            fh = logging.handlers.TimedRotatingFileHandler(
+                path, when=when, backupCount=backups, encoding="utf-8"
+            )
+        else:
+            fh = logging.handlers.RotatingFileHandler(
+                path, maxBytes=int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024))),
+                backupCount=backups, encoding="utf-8"
+            )
+        fh.setFormatter(JsonFormatter())
+        handlers.append(fh)
+
+    q = queue.Queue(maxsize=int(os.getenv("LOG_QUEUE_SIZE", "10000")))
+    queue_handler = DroppingQueueHandler(q)
+    root = logging.getLogger()
+    root.handlers[:] = [queue_handler]
+    root.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+
+    _listener = logging.handlers.QueueListener(q, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+    return queue_handler
+
+
+def stop_logging():
+    # 残っているログを書き出してから止める
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -1,80 +1,250 @@
 import os
-import sys
+import signal
+import asyncio
+import json
+import time
+import hashlib
 import logging
+from contextlib import asynccontextmanager
 import discord
 from discord.ext import commands
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 import pytz
 import asyncpg
 import db
+import dbpool
+import metrics
+import logconfig
+import cooldown
+import dispatcher
+import images
+import catalog
+import contactsheet
+from pull_log import PullLogWriter
 
-# ─── ログ設定 ─────────────────────────────────────────
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.INFO)
-fmt = logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s')
-fh = logging.FileHandler('bot.log', encoding='utf-8')
-fh.setFormatter(fmt)
-logger.addHandler(fh)
-sh = logging.StreamHandler(sys.stdout)
-sh.setFormatter(fmt)
-logger.addHandler(sh)
 
 # ─── Bot初期化 ─────────────────────────────────────────
 intents = discord.Intents.default()
 intents.message_content = True
-bot = commands.Bot(command_prefix='/', intents=intents)
-bot.last_gacha_usage = {}  # クールダウン管理用
-scheduler = AsyncIOScheduler(timezone=pytz.timezone("Asia/Tokyo"))
-
-# ─── 起動時処理 ─────────────────────────────────────────
-@bot.event
-async def on_ready():
-    logger.info(f'Logged in as {bot.user}!')
-
-    DATABASE_URL = os.getenv("DATABASE_URL")
-    if not DATABASE_URL:
-        raise RuntimeError("DATABASE_URL が設定されていません")
-
-    # PostgreSQL プール作成
-    bot.db_pool = await asyncpg.create_pool(DATABASE_URL)
-
-    # テーブル初期化 & 初期設定投入
-    await db.init_db(bot.db_pool)
-
-    # CSV→DBロード（spring / summer）
-    await db.load_gacha_data(bot.db_pool, 'data/gacha_data_1.csv', 'autumn_2025')
-    await db.load_gacha_data(bot.db_pool, 'data/gacha_data_2.csv', 'christmas_2024')
-
-    # Cog の読み込み
-    await bot.load_extension("cogs.gacha")
-    await bot.load_extension("cogs.admin")
-    await bot.tree.sync()
-
-    # 毎日00:00にポイント自動付与ジョブを登録
-    async def daily_job():
-        pt = await db.get_daily_auto_points(bot.db_pool)
-        await db.add_daily_points_for_all(bot.db_pool, pt)
-    scheduler.add_job(daily_job, 'cron', hour=0, minute=0)
-    scheduler.start()
-
-    logger.info("Scheduler started.")
-
-# ─── 使用コマンドログ ────────────────────────────────────
-@bot.event
-async def on_interaction(interaction: discord.Interaction):
-    if interaction.type == discord.InteractionType.application_command:
-        cmd = interaction.data.get("name")
-        user = interaction.user
-        opts = interaction.data.get("options", [])
-        parts = [f"{o['name']}={o.get('value')}" for o in opts]
-        logger.info(
-            f"User {user.name} used /{cmd} with parameters: "
-            f"{', '.join(parts) if parts else 'None'}"
+JST = pytz.timezone("Asia/Tokyo")
+scheduler = AsyncIOScheduler(timezone=JST)
+
+
+def shard_options() -> dict:
+    # SHARD_COUNT / SHARD_IDS が指定されていれば、その分のシャードだけをこのプロセスで受け持つ
+    opts = {}
+    if os.getenv("SHARD_COUNT"):
+        opts["shard_count"] = int(os.getenv("SHARD_COUNT"))
+    if os.getenv("SHARD_IDS"):
+        opts["shard_ids"] = [int(x) for x in os.getenv("SHARD_IDS").split(",")]
+    return opts
+
+
+class GachaBot(commands.AutoShardedBot):
+    def __init__(self):
+        super().__init__(command_prefix='/', intents=intents, **shard_options())
+        self.cooldowns = None  # クールダウン管理用
+        self.db_pool = None
+        self.pull_log = None
+        self.listen_conn = None
+        self.metrics_runner = None
+        self.images_runner = None
+        self.image_task = None
+        # インタラクションをユーザーごとに直列化し、レーンごとに同時実行数を絞る
+        self.dispatcher = dispatcher.Dispatcher()
+
+    # 起動時に1回だけ実行される（再接続時の on_ready では実行されない）
+    async def setup_hook(self):
+        DATABASE_URL = os.getenv("DATABASE_URL")
+        if not DATABASE_URL:
+            raise RuntimeError("DATABASE_URL が設定されていません")
+
+        started = time.perf_counter()
+        # SIGTERM（コンテナ停止・launcher からの停止）でも後片付けしてから終了する
+        try:
+            asyncio.get_running_loop().add_signal_handler(
+                signal.SIGTERM, lambda: asyncio.create_task(self.close())
+            )
+        except NotImplementedError:
+            pass
+        async with stage("create pool"):
+            # サイズ・タイムアウト等は DB_POOL_* / DB_* 環境変数で調整する
+            self.db_pool = await dbpool.create_pool(DATABASE_URL)
+            self.pull_log = PullLogWriter(self.db_pool)
+            # ポイント・所持カード変更通知の受信専用コネクション
+            self.listen_conn = await asyncpg.connect(DATABASE_URL)
+            await db.listen_points_changes(self.listen_conn)
+
+        # メトリクス公開（/metrics）
+        async with stage("metrics endpoint"):
+            self.metrics_runner = await metrics.start_server()
+            pool = self.db_pool
+            metrics.POOL_CONNECTIONS.set_function(pool.get_size, "open")
+            metrics.POOL_CONNECTIONS.set_function(pool.get_idle_size, "idle")
+            metrics.POOL_CONNECTIONS.set_function(pool.get_max_size, "max")
+            for field in ("size", "hits", "misses", "invalidations"):
+                metrics.POINTS_CACHE.set_function(
+                    lambda field=field: db.points_cache.stats()[field], field
+                )
+            qh = logconfig.queue_handler
+            metrics.LOG_QUEUE.set_function(qh.queue.qsize, "queued")
+            metrics.LOG_QUEUE.set_function(lambda: qh.dropped, "dropped")
+
+        # テーブル初期化 & 初期設定投入
+        async with stage("init db"):
+            await db.init_db(self.db_pool)
+
+        # クールダウン管理（複数プロセス時はDBで共有）
+        async with stage("cooldown store"):
+            self.cooldowns = await cooldown.create_store(self.db_pool)
+
+        # カード画像のキャッシュ（取得・アップロードは起動後にバックグラウンドで行う）
+        async with stage("image store"):
+            self.images_runner = await images.start_server()
+            await images.store.load(self.db_pool)
+
+        # ガチャ種別レジストリ更新 & CSV→DBロード
+        async with stage("load gacha data"):
+            await db.sync_gacha_types(self.db_pool, 'data/gacha_types.json')
+            for gt in db.get_gacha_types():
+                if gt["csv_path"]:
+                    await db.load_gacha_data(self.db_pool, gt["csv_path"], gt["gachatype"])
+
+        # Cog の読み込み
+        async with stage("load extensions"):
+            await self.load_extension("cogs.gacha")
+            await self.load_extension("cogs.admin")
+
+        # コマンド定義が変わった時だけ同期する
+        async with stage("sync command tree"):
+            await self.sync_tree_if_changed()
+
+        # 抽選履歴の書き込みタスク開始
+        self.pull_log.start()
+        self.image_task = asyncio.create_task(self.sync_images())
+
+        # 日次ポイントは読む時に反映するので（db.py の遅延付与）、0時のジョブはない
+        async with stage("start scheduler"):
+            scheduler.add_job(
+                metrics.run_job, 'interval', args=["purge_cooldowns", self.cooldowns.purge],
+                minutes=10, id="purge_cooldowns", replace_existing=True
+            )
+            scheduler.add_job(
+                metrics.run_job, 'interval', args=["refresh_images", images.store.refresh_expiring, self.db_pool],
+                hours=1, id="refresh_images", replace_existing=True
+            )
+            scheduler.start()
+
+        logger.info("Startup finished in %.3fs", time.perf_counter() - started)
+
+    async def sync_images(self):
+        # Drive の画像を取得してキャッシュし、一覧のリンクを差し替える
+        # 公開しない場合も、一覧画像（/artsheet）の合成に使うので取得しておく
+        if not (images.enabled() or contactsheet.available()):
+            return
+        try:
+            if images.ASSET_CHANNEL:
+                images.store.channel = await self.fetch_channel(images.ASSET_CHANNEL)
+            for gt in db.get_gacha_types():
+                cat = await db.get_catalog(self.db_pool, gt["gachatype"])
+                _, changed = await images.store.sync(self.db_pool, gt["gachatype"], cat.items)
+                if changed:
+                    catalog.set_items(gt["gachatype"], cat.items)
+        except Exception:
+            logger.exception("Image sync failed")
+
+    async def sync_tree_if_changed(self):
+        commands_json = json.dumps(
+            [cmd.to_dict(self.tree) for cmd in self.tree.get_commands()],
+            sort_keys=True, ensure_ascii=False
         )
+        tree_hash = hashlib.sha256(commands_json.encode('utf-8')).hexdigest()
+        if await db.get_state(self.db_pool, "command_tree_hash") == tree_hash:
+            logger.info("Command tree unchanged, skipped sync")
+            return
+        await self.tree.sync()
+        await db.set_state(self.db_pool, "command_tree_hash", tree_hash)
+        logger.info("Command tree synced")
+
+    async def close(self):
+        if scheduler.running:
+            scheduler.shutdown(wait=False)
+        await super().close()
+        if self.image_task is not None:
+            self.image_task.cancel()
+        await images.store.close()
+        contactsheet.shutdown()
+        if self.pull_log is not None:
+            await self.pull_log.close()
+        if self.listen_conn is not None:
+            await db.unlisten_points_changes(self.listen_conn)
+            await self.listen_conn.close()
+        if self.db_pool is not None:
+            await self.db_pool.close()
+        if self.metrics_runner is not None:
+            await self.metrics_runner.cleanup()
+        if self.images_runner is not None:
+            await self.images_runner.cleanup()
+
+
+@asynccontextmanager
+async def stage(name: str):
+    # 起動処理の各段階の所要時間を記録する
+    start = time.perf_counter()
+    yield
+    logger.info("Startup stage '%s' took %.3fs", name, time.perf_counter() - start)
+
+
+def main():
+    # ワーカープロセス（contactsheet の spawn）はこのファイルを __mp_main__ として読み込み直すので、
+    # ログ設定や Bot の生成はトップレベルではなくここで行う
+    # ─── ログ設定 ─────────────────────────────────────────
+    # 全モジュールのログをキュー経由で別スレッドから書き出す（設定は logconfig.py）
+    logconfig.setup_logging()
 
-# ─── 実行 ─────────────────────────────────────────────
-if __name__ == "__main__":
     TOKEN = os.getenv("DISCORD_TOKEN")
     if not TOKEN:
         raise RuntimeError("DISCORD_TOKEN が設定されていません")
-    bot.run(TOKEN)
+
+    bot = GachaBot()
+
+    # ─── 接続時処理 ─────────────────────────────────────────
+    @bot.event
+    async def on_ready():
+        # 再接続のたびに呼ばれるので、ここでは初期化しない
+        logger.info("Logged in as %s! (shards: %s / %s)", bot.user, sorted(bot.shards), bot.shard_count)
+
+    # ─── 使用コマンドログ ────────────────────────────────────
+    @bot.event
+    async def on_interaction(interaction: discord.Interaction):
+        if interaction.type == discord.InteractionType.application_command:
+            cmd = interaction.data.get("name")
+            user = interaction.user
+            opts = interaction.data.get("options", [])
+            params = {o['name']: o.get('value') for o in opts}
+            logger.info(
+                "User %s used /%s with parameters: %s", user.name, cmd, params or None,
+                extra={"user_id": user.id, "command": cmd, "params": params}
+            )
+
+    # ─── コマンド処理時間 ───────────────────────────────────
+    @bot.event
+    async def on_app_command_completion(interaction: discord.Interaction, command):
+        # インタラクション作成（ユーザーの操作）から処理完了までの時間
+        elapsed = (discord.utils.utcnow() - interaction.created_at).total_seconds()
+        metrics.COMMAND_SECONDS.labels(command.qualified_name).observe(elapsed)
+
+    @bot.tree.error
+    async def on_app_command_error(interaction: discord.Interaction, error):
+        name = interaction.command.qualified_name if interaction.command else "unknown"
+        metrics.COMMAND_ERRORS.labels(name).inc()
+        logger.error("Error in /%s", name, exc_info=error)
+
+    # discord.py 独自のログハンドラは付けない（ルートロガーの設定をそのまま使う）
+    bot.run(TOKEN, log_handler=None)
+
+
+# ─── 実行 ─────────────────────────────────────────────
+if __name__ == "__main__":
+    main()
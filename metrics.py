@@ -0,0 +1,303 @@
+import os
+import time
+import bisect
+import logging
+from contextlib import contextmanager
+from functools import wraps
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+# ─── メトリクス（Prometheus テキスト形式） ─────────────────────
+# 記録は dict 参照と加算だけなので、本番で常時有効にしておける
+# METRICS_PORT（既定 9108、0 で無効）の /metrics で公開する
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_registry = []
+
+
+def _escape(v) -> str:
+    return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _fmt_labels(names, values, extra=None) -> str:
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def _fmt_value(v: float) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        _registry.append(self)
+
+    def labels(self, *values):
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}")
+            child = self._children[key] = self._new_child()
+        return child
+
+    def _default(self):
+        # ラベルなしのメトリクスはそのまま inc / observe できる
+        return self.labels()
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for key, child in sorted(self._children.items()):
+            lines.extend(self._render_child(key, child))
+        return lines
+
+
+class _CounterChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1.0):
+        self._default().inc(amount)
+
+    def _render_child(self, key, child):
+        return [f"{self.name}{_fmt_labels(self.labelnames, key)} {_fmt_value(child.value)}"]
+
+
+class _HistogramChild:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        i = bisect.bisect_left(self.buckets, value)
+        if i < len(self.counts):
+            self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+    @contextmanager
+    def time(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, help, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        self._default().observe(value)
+
+    def time(self):
+        return self._default().time()
+
+    def _render_child(self, key, child):
+        lines = []
+        acc = 0
+        for le, n in zip(self.buckets, child.counts):
+            acc += n
+            lines.append(
+                f"{self.name}_bucket{_fmt_labels(self.labelnames, key, ('le', _fmt_value(le)))} {acc}"
+            )
+        lines.append(f"{self.name}_bucket{_fmt_labels(self.labelnames, key, ('le', '+Inf'))} {child.count}")
+        lines.append(f"{self.name}_sum{_fmt_labels(self.labelnames, key)} {_fmt_value(child.sum)}")
+        lines.append(f"{self.name}_count{_fmt_labels(self.labelnames, key)} {child.count}")
+        return lines
+
+
+class Gauge(_Metric):
+    # 値は出力時に関数を呼んで取る（プールの空き数など）
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labelnames=()):
+        super().__init__(name, help, labelnames)
+        self._functions = {}
+
+    def _new_child(self):
+        return None
+
+    def set_function(self, fn, *values):
+        self._functions[tuple(str(v) for v in values)] = fn
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for key, fn in sorted(self._functions.items()):
+            try:
+                v = fn()
+            except Exception:
+                continue
+            if v is not None:
+                lines.append(f"{self.name}{_fmt_labels(self.labelnames, key)} {_fmt_value(v)}")
+        return lines
+
+
+def render() -> str:
+    lines = []
+    for m in _registry:
+        lines.extend(m.render())
+    return "\n".join(lines) + "\n"
+
+
+# ─── このBotのメトリクス ───────────────────────────────────
+COMMAND_SECONDS = Histogram(
+    "gacha_command_seconds", "Slash command handling time from interaction creation", ["command"]
+)
+COMMAND_ERRORS = Counter(
+    "gacha_command_errors_total", "Slash commands that raised an error", ["command"]
+)
+PULL_SECONDS = Histogram(
+    "gacha_pull_handler_seconds", "Pull button handling time including the reveal", ["kind"]
+)
+DB_CALL_SECONDS = Histogram(
+    "gacha_db_call_seconds", "Time spent in db.* functions", ["function"]
+)
+DB_QUERY_SECONDS = Histogram(
+    "gacha_db_query_seconds", "Execution time of registered statements", ["statement"]
+)
+DB_ACQUIRE_SECONDS = Histogram(
+    "gacha_db_pool_acquire_seconds", "Time waiting for a pool connection"
+)
+DISCORD_API_SECONDS = Histogram(
+    "gacha_discord_api_seconds", "Latency of Discord message sends and edits", ["call"]
+)
+EDIT_BUCKET_WAIT_SECONDS = Histogram(
+    "gacha_edit_bucket_wait_seconds", "Time spent waiting for the per-channel edit bucket"
+)
+JOB_SECONDS = Histogram(
+    "gacha_job_seconds", "Scheduler job duration", ["job"], buckets=DEFAULT_BUCKETS + (60.0, 300.0)
+)
+JOB_ERRORS = Counter(
+    "gacha_job_errors_total", "Scheduler job failures", ["job"]
+)
+PULLS = Counter(
+    "gacha_pulls_total", "Cards drawn", ["gachatype", "rarity"]
+)
+PULL_REJECTIONS = Counter(
+    "gacha_pull_rejections_total", "Pulls refused before drawing", ["reason"]
+)
+COOLDOWN_REJECTIONS = Counter(
+    "gacha_cooldown_rejections_total", "Commands refused because of the cooldown", ["command"]
+)
+DISPATCH_COALESCED = Counter(
+    "gacha_dispatch_coalesced_total", "Presses dropped because the same action was already in flight", ["action"]
+)
+LANE_WAIT_SECONDS = Histogram(
+    "gacha_lane_wait_seconds", "Time waiting for a concurrency slot", ["lane"]
+)
+LANE_ACTIVE = Gauge(
+    "gacha_lane_active", "Work currently running per lane", ["lane"]
+)
+IMAGE_FETCHES = Counter(
+    "gacha_image_fetches_total", "Card images fetched from the catalog URL", ["result"]
+)
+IMAGE_FETCH_SECONDS = Histogram(
+    "gacha_image_fetch_seconds", "Time to download and process one card image"
+)
+IMAGE_URLS = Counter(
+    "gacha_image_urls_total", "Image URLs handed out, by whether the cached copy was used", ["source"]
+)
+SHEET_RENDER_SECONDS = Histogram(
+    "gacha_sheet_render_seconds", "Time to compose a collection sheet in the process pool"
+)
+SHEET_CACHE = Counter(
+    "gacha_sheet_cache_total", "Collection sheet lookups", ["result"]
+)
+POOL_CONNECTIONS = Gauge(
+    "gacha_db_pool_connections", "Connections in the DB pool", ["state"]
+)
+POINTS_CACHE = Gauge(
+    "gacha_points_cache", "Points cache counters", ["field"]
+)
+LOG_QUEUE = Gauge(
+    "gacha_log_queue", "Log records waiting to be written, and records dropped because the queue was full", ["field"]
+)
+
+
+def timed(histogram: Histogram, label: str = None):
+    # async 関数の所要時間を記録するデコレータ（label 省略時は関数名）
+    def deco(fn):
+        child = histogram.labels(label or fn.__name__)
+
+        @wraps(fn)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await fn(*args, **kwargs)
+            finally:
+                child.observe(time.perf_counter() - start)
+        return wrapper
+    return deco
+
+
+async def run_job(name: str, fn, *args):
+    # スケジューラのジョブを計測付きで実行する
+    start = time.perf_counter()
+    try:
+        return await fn(*args)
+    except Exception:
+        JOB_ERRORS.labels(name).inc()
+        raise
+    finally:
+        JOB_SECONDS.labels(name).observe(time.perf_counter() - start)
+
+
+# ─── HTTP エンドポイント ──────────────────────────────────
+async def _handle_metrics(request):
+    return web.Response(
+        text=render(), headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+    )
+
+
+async def start_server(host: str = None, port: int = None):
+    host = host or os.getenv("METRICS_HOST", "127.0.0.1")
+    port = int(port if port is not None else os.getenv("METRICS_PORT", "9108"))
+    if not port:
+        logger.info("Metrics endpoint disabled")
+        return None
+    app = web.Application()
+    app.router.add_get("/metrics", _handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info("Metrics endpoint on http://%s:%s/metrics", host, port)
+    return runner
@@ -0,0 +1,326 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+# ─── スキーママイグレーション ──────────────────────────────
+# schema_migrations に適用済みのバージョンを記録し、未適用のものだけを順に実行する
+# 複数プロセスが同時に起動しても二重に実行されないよう advisory lock を取る
+
+MIGRATIONS = []
+LOCK_KEY = 0x6761636861  # "gacha"
+
+
+def migration(version: int, name: str):
+    def deco(fn):
+        MIGRATIONS.append((version, name, fn))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return fn
+    return deco
+
+
+async def run(conn, target: int = None):
+    await conn.execute("""
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+      version    INTEGER PRIMARY KEY,
+      name       TEXT NOT NULL,
+      applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+    );
+    """)
+    await conn.execute("SELECT pg_advisory_lock($1)", LOCK_KEY)
+    try:
+        applied = {r["version"] for r in await conn.fetch("SELECT version FROM schema_migrations")}
+        for version, name, fn in MIGRATIONS:
+            if version in applied or (target is not None and version > target):
+                continue
+            async with conn.transaction():
+                await fn(conn)
+                await conn.execute(
+                    "INSERT INTO schema_migrations(version, name) VALUES($1,$2)",
+                    version, name
+                )
+            logger.info("Applied migration %d: %s", version, name)
+    finally:
+        await conn.execute("SELECT pg_advisory_unlock($1)", LOCK_KEY)
+
+
+# ─── 1: 初期スキーマ ───────────────────────────────────
+# 既存DBに対しても安全なように IF NOT EXISTS で作る
+@migration(1, "baseline")
+async def _baseline(conn):
+    # ユーザーPT
+    await conn.execute("""
+    CREATE TABLE IF NOT EXISTS user_points (
+      username TEXT PRIMARY KEY,
+      points INTEGER NOT NULL
+    );
+    """)
+    # 取得カード
+    await conn.execute("""
+    CREATE TABLE IF NOT EXISTS user_cards (
+      username TEXT,
+      gachatype TEXT,
+      card_no TEXT,
+      PRIMARY KEY(username, gachatype, card_no)
+    );
+    """)
+    # ガチャ種別レジストリ
+    await conn.execute("""
+    CREATE TABLE IF NOT EXISTS gacha_types (
+      gachatype    TEXT PRIMARY KEY,
+      display_name TEXT NOT NULL,
+      csv_path     TEXT,
+      sort_order   INTEGER NOT NULL DEFAULT 0,
+      active       BOOLEAN NOT NULL DEFAULT TRUE
+    );
+    """)
+    # ガチャアイテム（全種別共通）
+    await conn.execute("""
+    CREATE TABLE IF NOT EXISTS gacha_items (
+      gachatype TEXT,
+      no        TEXT,
+      url       TEXT,
+      chname    TEXT,
+      rarity    TEXT,
+      rate      REAL,
+      title     TEXT,
+      PRIMARY KEY(gachatype, no)
+    );
+    """)
+    await _migrate_legacy_item_tables(conn)
+    # CSV取り込み状況（内容ハッシュ）
+    await conn.execute("""
+    CREATE TABLE IF NOT EXISTS gacha_catalog_state (
+      gachatype    TEXT PRIMARY KEY,
+      content_hash TEXT NOT NULL,
+      loaded_at    TIMESTAMPTZ NOT NULL
+    );
+    """)
+    # 抽選履歴
+    await conn.execute("""
+    CREATE TABLE IF NOT EXISTS pull_events (
+      id        BIGSERIAL PRIMARY KEY,
+      username  TEXT NOT NULL,
+      gachatype TEXT NOT NULL,
+      card_no   TEXT NOT NULL,
+      rarity    TEXT,
+      is_new    BOOLEAN NOT NULL,
+      pulled_at TIMESTAMPTZ NOT NULL
+    );
+    """)
+    await conn.execute("""
+    CREATE INDEX IF NOT EXISTS pull_events_user_idx ON pull_events(username, pulled_at)
+    """)
+    await conn.execute("""
+    CREATE INDEX IF NOT EXISTS pull_events_type_idx ON pull_events(gachatype, pulled_at)
+    """)
+    # 内部状態（コマンド定義のハッシュなど）
+    await conn.execute("""
+    CREATE TABLE IF NOT EXISTS app_state (
+      key   TEXT PRIMARY KEY,
+      value TEXT
+    );
+    """)
+    # 設定テーブル
+    await conn.execute("""
+    CREATE TABLE IF NOT EXISTS settings (
+      key   TEXT PRIMARY KEY,
+      value INTEGER
+    );
+    """)
+    # ユーザーごとの設定
+    await conn.execute("""
+    CREATE TABLE IF NOT EXISTS user_settings (
+      username       TEXT PRIMARY KEY,
+      instant_reveal BOOLEAN NOT NULL DEFAULT FALSE
+    );
+    """)
+    # 全体の即時表示モード（初回は無効）
+    await conn.execute(
+        "INSERT INTO settings(key,value) VALUES('instant_reveal', 0) ON CONFLICT DO NOTHING"
+    )
+    # 初回だけdaily_auto_pointsを3にセット
+    await conn.execute(
+        "INSERT INTO settings(key,value) VALUES('daily_auto_points', 3) ON CONFLICT DO NOTHING"
+    )
+
+
+async def _migrate_legacy_item_tables(conn):
+    # 旧 gacha_items_{種別} テーブルを gacha_items に移し替えて削除する
+    tables = await conn.fetch("""
+    SELECT table_name FROM information_schema.tables
+    WHERE table_schema = current_schema() AND table_name LIKE 'gacha\\_items\\_%'
+    """)
+    for t in tables:
+        table = t["table_name"]
+        gt = table[len("gacha_items_"):]
+        await conn.execute(f"""
+        INSERT INTO gacha_items(gachatype,no,url,chname,rarity,rate,title)
+        SELECT $1,no,url,chname,rarity,rate,title FROM {table}
+        ON CONFLICT DO NOTHING
+        """, gt)
+        await conn.execute(f"DROP TABLE {table}")
+        # 旧コマンドは種別を大文字始まりで保存していたので揃える
+        await conn.execute("""
+        UPDATE user_cards SET gachatype = lower(gachatype)
+        WHERE lower(gachatype) = $1 AND gachatype <> $1
+        """, gt)
+        logger.info("Migrated legacy table %s", table)
+
+
+# ─── 2: 整数キー化 ─────────────────────────────────────
+# ユーザーは変更可能な username ではなく Discord の user_id で持つ
+# カード番号は INTEGER にして、番号順の並び替えを主キーのインデックスで行えるようにする
+# 既存のユーザー行は legacy_* に退避し、本人が次に操作した時に user_id へ引き継ぐ
+@migration(2, "integer keys")
+async def _integer_keys(conn):
+    for table in ("user_points", "user_cards", "user_settings"):
+        await conn.execute(f"ALTER TABLE {table} RENAME TO legacy_{table}")
+        await conn.execute(f"ALTER INDEX {table}_pkey RENAME TO legacy_{table}_pkey")
+
+    await conn.execute("""
+    CREATE TABLE user_points (
+      user_id  BIGINT PRIMARY KEY,
+      username TEXT,
+      points   INTEGER NOT NULL
+    );
+    """)
+    # 管理コマンドの名前指定用
+    await conn.execute("CREATE INDEX user_points_username_idx ON user_points(username)")
+    # 主キーが (user_id, gachatype) での検索をインデックスのみで返す
+    await conn.execute("""
+    CREATE TABLE user_cards (
+      user_id   BIGINT,
+      gachatype TEXT,
+      card_no   INTEGER,
+      PRIMARY KEY(user_id, gachatype, card_no)
+    );
+    """)
+    await conn.execute("""
+    CREATE TABLE user_settings (
+      user_id        BIGINT PRIMARY KEY,
+      instant_reveal BOOLEAN NOT NULL DEFAULT FALSE
+    );
+    """)
+
+    await conn.execute("ALTER TABLE gacha_items ALTER COLUMN no TYPE INTEGER USING no::integer")
+
+    await conn.execute("""
+    ALTER TABLE pull_events
+      ADD COLUMN user_id BIGINT,
+      ALTER COLUMN card_no TYPE INTEGER USING card_no::integer
+    """)
+    await conn.execute("DROP INDEX IF EXISTS pull_events_user_idx")
+    await conn.execute("CREATE INDEX pull_events_user_idx ON pull_events(user_id, pulled_at)")
+
+
+# ─── 3: ポイントの遅延付与 ────────────────────────────────
+# 毎日0時に全行を書き換える代わりに、最後に付与を反映した日付（JST）を持ち、
+# 読む時に経過日数分を足して求める。書き込むのはユーザーが次に操作した時だけ
+# 日次の付与量は適用開始日ごとに daily_points_history へ記録し、変更前後の日を正しく数える
+@migration(3, "lazy accrual")
+async def _lazy_accrual(conn):
+    await conn.execute("""
+    CREATE FUNCTION jst_today() RETURNS DATE
+    LANGUAGE sql STABLE AS $$ SELECT (now() AT TIME ZONE 'Asia/Tokyo')::date $$
+    """)
+    await conn.execute("""
+    CREATE TABLE daily_points_history (
+      effective_on DATE PRIMARY KEY,  -- この日の0時の付与から適用
+      points       INTEGER NOT NULL
+    );
+    """)
+    await conn.execute("""
+    INSERT INTO daily_points_history(effective_on, points)
+    VALUES('-infinity', COALESCE((SELECT value FROM settings WHERE key='daily_auto_points'), 3))
+    """)
+    await conn.execute("DELETE FROM settings WHERE key='daily_auto_points'")
+    # since の翌日から today までの各日の0時の付与を足し、上限で切る（経過0日ならそのまま）
+    await conn.execute("""
+    CREATE FUNCTION accrued_points(points INTEGER, since DATE, cap INTEGER)
+    RETURNS INTEGER LANGUAGE sql STABLE AS $$
+      SELECT CASE WHEN since >= jst_today() THEN points
+      ELSE LEAST(cap, points + COALESCE((
+        SELECT sum(h.points * GREATEST(0, LEAST(h.until, jst_today() + 1) - GREATEST(h.effective_on, since + 1)))
+        FROM (
+          SELECT effective_on, points,
+                 lead(effective_on, 1, 'infinity') OVER (ORDER BY effective_on) AS until
+          FROM daily_points_history
+        ) h
+      ), 0))::integer
+      END
+    $$
+    """)
+    # 既存の行は今日の分まで付与済み
+    for table in ("user_points", "legacy_user_points"):
+        await conn.execute(
+            f"ALTER TABLE {table} ADD COLUMN accrued_on DATE NOT NULL DEFAULT jst_today()"
+        )
+
+
+# ─── 4: カード画像 ─────────────────────────────────────
+# images.py が取得した画像ファイルとアップロード先（Discord の添付）の記録
+@migration(4, "card assets")
+async def _card_assets(conn):
+    await conn.execute("""
+    CREATE TABLE card_assets (
+      gachatype    TEXT NOT NULL,
+      card_no      INTEGER NOT NULL,
+      kind         TEXT NOT NULL,     -- full / thumb
+      source_url   TEXT NOT NULL,     -- 取得元（CSV の url）。変わったら取り直す
+      filename     TEXT NOT NULL,     -- IMAGE_CACHE_DIR からの相対パス
+      content_hash TEXT NOT NULL,
+      bytes        INTEGER NOT NULL,
+      fetched_at   TIMESTAMPTZ NOT NULL,
+      channel_id   BIGINT,
+      message_id   BIGINT,
+      url          TEXT,              -- 添付のURL（署名付き）
+      expires_at   TIMESTAMPTZ,
+      PRIMARY KEY(gachatype, card_no, kind)
+    );
+    """)
+
+
+# ─── 5: 収集状況の集計 ───────────────────────────────────
+# ユーザー×ガチャ種別ごとの所持枚数（合計とレア度別）を、カードを保存する文の中で一緒に加算する（db.py）
+# /progress・/leaderboard は user_cards を数えずにこれを読む。ランキングは user_progress_rank_idx を順に読むだけ
+# 既存の所持カードからここで一度だけ集計する（カタログにないカードは数えない）
+@migration(5, "user progress")
+async def _user_progress(conn):
+    await conn.execute("""
+    CREATE TABLE user_progress (
+      user_id    BIGINT,
+      gachatype  TEXT,
+      owned      INTEGER NOT NULL,
+      reached_at TIMESTAMPTZ NOT NULL,  -- 最後に枚数が増えた時刻。同数なら先に達した方を上位にする
+      PRIMARY KEY(user_id, gachatype)
+    );
+    """)
+    await conn.execute("""
+    CREATE INDEX user_progress_rank_idx ON user_progress(gachatype, owned DESC, reached_at, user_id)
+    """)
+    await conn.execute("""
+    CREATE TABLE user_progress_rarity (
+      user_id   BIGINT,
+      gachatype TEXT,
+      rarity    TEXT,
+      owned     INTEGER NOT NULL,
+      PRIMARY KEY(user_id, gachatype, rarity)
+    );
+    """)
+    await conn.execute("""
+    INSERT INTO user_progress_rarity(user_id, gachatype, rarity, owned)
+    SELECT uc.user_id, uc.gachatype, gi.rarity, count(*)
+    FROM user_cards uc
+    JOIN gacha_items gi ON gi.gachatype = uc.gachatype AND gi.no = uc.card_no
+    GROUP BY 1, 2, 3
+    """)
+    # 達した時刻は抽選履歴の最後の NEW から（履歴がなければ今）
+    await conn.execute("""
+    INSERT INTO user_progress(user_id, gachatype, owned, reached_at)
+    SELECT r.user_id, r.gachatype, sum(r.owned), COALESCE((
+      SELECT max(e.pulled_at) FROM pull_events e
+      WHERE e.user_id = r.user_id AND e.gachatype = r.gachatype AND e.is_new
+    ), now())
+    FROM user_progress_rarity r
+    GROUP BY 1, 2
+    """)
@@ -0,0 +1,60 @@
+import time
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+JST_OFFSET = 9 * 3600  # 日次の付与は JST の0時に効く（夏時間なし）
+
+
+def seconds_until_jst_midnight() -> float:
+    return 86400 - (time.time() + JST_OFFSET) % 86400
+
+
+# ─── ユーザーポイントのキャッシュ（LRU + TTL） ─────────────────
+# 値の正はあくまでDB。ポイント消費の可否はDB側の条件付き UPDATE で判定する
+# ポイントは JST の日付が変わると日次の付与分だけ増えるので、エントリはその日のうちだけ有効
+class PointsCache:
+    def __init__(self, maxsize: int = 10000, ttl: float = 60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, user_id: int):
+        entry = self._data.get(user_id)
+        if entry is None or entry[1] < time.monotonic():
+            if entry is not None:
+                del self._data[user_id]
+            self.misses += 1
+            return None
+        self._data.move_to_end(user_id)
+        self.hits += 1
+        return entry[0]
+
+    def set(self, user_id: int, points: int):
+        ttl = min(self.ttl, seconds_until_jst_midnight())
+        self._data[user_id] = (points, time.monotonic() + ttl)
+        self._data.move_to_end(user_id)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def invalidate(self, user_id: int):
+        if self._data.pop(user_id, None) is not None:
+            self.invalidations += 1
+
+    def clear(self):
+        self.invalidations += len(self._data)
+        self._data.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "invalidations": self.invalidations,
+        }
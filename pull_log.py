@@ -0,0 +1,99 @@
+import asyncio
+import logging
+from datetime import datetime, timezone
+
+import asyncpg
+
+import dbpool
+
+logger = logging.getLogger(__name__)
+
+COLUMNS = ["user_id", "username", "gachatype", "card_no", "rarity", "is_new", "pulled_at"]
+
+
+# ─── 抽選履歴の遅延書き込み ───────────────────────────────
+# 抽選処理はキューに積むだけにして、別タスクがまとめて COPY で書き込む
+class PullLogWriter:
+    def __init__(self, pool: asyncpg.Pool, batch_size: int = 500,
+                 interval: float = 2.0, maxsize: int = 10000):
+        self.pool = pool
+        self.batch_size = batch_size
+        self.interval = interval
+        self.queue = asyncio.Queue(maxsize=maxsize)
+        self.task = None
+        self._batch = []  # 溜めている途中のイベント
+        self._inflight = None  # 書き込み中のタスク
+        self.stats = {"written": 0, "flushes": 0, "backpressure": 0, "failed": 0}
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self._run())
+
+    async def record(self, user_id: int, username: str, gachatype: str, item: dict, is_new: bool):
+        event = (
+            user_id, username, gachatype, item["no"], item["rarity"], is_new,
+            datetime.now(timezone.utc),
+        )
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # 書き込みが追いついていない。空きが出るまで待つ
+            self.stats["backpressure"] += 1
+            logger.warning("Pull log queue full (%d events), waiting for flush", self.queue.qsize())
+            await self.queue.put(event)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            self._batch.append(await self.queue.get())
+            # 件数か時間のどちらかに達するまで溜める
+            deadline = loop.time() + self.interval
+            while len(self._batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    self._batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            batch, self._batch = self._batch, []
+            # 停止要求で書き込みが中断されないようにする
+            self._inflight = asyncio.ensure_future(self._flush(batch))
+            await asyncio.shield(self._inflight)
+            self._inflight = None
+
+    async def _flush(self, batch: list):
+        if not batch:
+            return
+        try:
+            async with dbpool.acquire(self.pool) as conn:
+                await conn.copy_records_to_table("pull_events", records=batch, columns=COLUMNS)
+            self.stats["written"] += len(batch)
+            self.stats["flushes"] += 1
+        except Exception:
+            self.stats["failed"] += len(batch)
+            logger.exception("Failed to write %d pull events", len(batch))
+
+    async def close(self):
+        # 停止時はキューに残っている分を全て書き出す
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        if self._inflight is not None:
+            await self._inflight
+            self._inflight = None
+        batch, self._batch = self._batch, []
+        while not self.queue.empty():
+            batch.append(self.queue.get_nowait())
+            if len(batch) >= self.batch_size:
+                await self._flush(batch)
+                batch = []
+        await self._flush(batch)
+        logger.info(
+            "Pull log closed (written: %d, backpressure: %d, failed: %d)",
+            self.stats['written'], self.stats['backpressure'], self.stats['failed']
+        )
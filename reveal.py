@@ -0,0 +1,110 @@
+import time
+import asyncio
+import logging
+from collections import defaultdict
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+FRAME_INTERVAL = 1.0  # 演出フレーム間の待ち時間（秒）
+
+# 1チャンネルあたりの編集上限の目安（Discord は 5回 / 5秒 程度）
+BUCKET_CAPACITY = 5
+BUCKET_PERIOD = 5.0
+
+# 累計の統計
+stats = defaultdict(float)
+
+
+# ─── チャンネル単位のトークンバケット ───────────────────────
+class ChannelBucket:
+    def __init__(self, capacity: int = BUCKET_CAPACITY, period: float = BUCKET_PERIOD):
+        self.capacity = capacity
+        self.rate = capacity / period
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def available(self) -> float:
+        self._refill()
+        return self.tokens
+
+    async def acquire(self) -> float:
+        # トークンを1つ消費する。待った秒数を返す
+        self._refill()
+        waited = 0.0
+        if self.tokens < 1.0:
+            waited = (1.0 - self.tokens) / self.rate
+            await asyncio.sleep(waited)
+            self._refill()
+        self.tokens -= 1.0
+        return waited
+
+
+_buckets = {}
+
+
+def get_bucket(channel_id) -> ChannelBucket:
+    bucket = _buckets.get(channel_id)
+    if bucket is None:
+        bucket = _buckets[channel_id] = ChannelBucket()
+    return bucket
+
+
+# ─── 演出フレーム ───────────────────────────────────────
+class Frame:
+    def __init__(self, embed, content=None, required: bool = False):
+        self.embed = embed
+        self.content = content
+        # required=False のフレームは混雑時に間引いてよい
+        self.required = required
+
+
+async def play(interaction, frames: list, instant: bool = False):
+    # 事前に組み立てたフレームを順に表示する
+    # 各フレームは前のフレームの内容を全て含むので、途中を飛ばしても最終表示は変わらない
+    bucket = get_bucket(interaction.channel_id)
+    pull = {"api_calls": 0, "bucket_waits": 0, "wait_seconds": 0.0, "dropped": 0}
+
+    async def call(coro_fn, *args, **kwargs):
+        waited = await bucket.acquire()
+        metrics.EDIT_BUCKET_WAIT_SECONDS.observe(waited)
+        if waited:
+            pull["bucket_waits"] += 1
+            pull["wait_seconds"] += waited
+        pull["api_calls"] += 1
+        with metrics.DISCORD_API_SECONDS.labels(coro_fn.__name__).time():
+            return await coro_fn(*args, **kwargs)
+
+    final = frames[-1]
+    if instant:
+        await call(interaction.followup.send, content=final.content, embed=final.embed, ephemeral=False)
+        pull["dropped"] = len(frames) - 1
+    else:
+        msg = await call(interaction.followup.send, "ガチャ中…", ephemeral=False)
+        pending = frames
+        while pending:
+            await asyncio.sleep(FRAME_INTERVAL)
+            frame, pending = pending[0], pending[1:]
+            # 残りの必須フレーム分のトークンが無ければ、必須でないフレームを落とす
+            needed = 1 + sum(1 for f in pending if f.required)
+            if pending and not frame.required and bucket.available() < needed:
+                pull["dropped"] += 1
+                continue
+            await call(msg.edit, content=frame.content, embed=frame.embed)
+
+    for k, v in pull.items():
+        stats[k] += v
+    stats["pulls"] += 1
+    logger.info(
+        "Reveal in channel %s: api_calls=%d, bucket_waits=%d (%.2fs), dropped=%d, instant=%s",
+        interaction.channel_id, pull['api_calls'], pull['bucket_waits'],
+        pull['wait_seconds'], pull['dropped'], instant,
+        extra={"channel_id": interaction.channel_id, "reveal": pull}
+    )
+    return pull
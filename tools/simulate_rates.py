@@ -0,0 +1,290 @@
+import os
+import sys
+import csv
+import json
+import glob
+import math
+import time
+import random
+import logging
+import argparse
+from collections import defaultdict
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import db  # noqa: E402
+import draw  # noqa: E402
+from catalog import RARITY_ORDER  # noqa: E402
+
+# 使い方: python tools/simulate_rates.py [CSV ...] [--draws 5000000] [--seed N] [--cards]
+# 新しいシーズンの CSV を出す前に、ユーザーが実際に見る排出率を確認する
+#  - CSV の検査: 読めない No.・空/不正な rate（取り込み時は 0 扱い）・0 や負の rate・No. の重複・未知のレア度
+#  - 本番と同じ手順で取り込んだ場合のカード一覧から draw.AliasSampler を作り、
+#    NumPy のまとめ抽選（10連の経路）と1回ずつの抽選（単発の経路）を回す
+#  - レア度ごと・カードごとの確率、コンプリートまでの期待回数、宣言値に対するカイ二乗検定を出す
+# CSV を省略すると data/gacha_data_*.csv を全部調べる。エラーか検定の不合格があれば終了コード 1
+DEFAULT_DRAWS = 5_000_000
+SINGLE_DRAWS = 200_000  # 単発の経路は Python のループなので少なめ
+CHUNK = 1_000_000
+RATE_SUM_TOLERANCE = 1e-3  # rate の合計が 1 からこれ以上ずれていたら知らせる
+REQUIRED_COLUMNS = ("No.", "url", "chname", "rarity", "rate", "title")
+
+
+# ─── CSV の検査 ────────────────────────────────────────
+def check_csv(csv_path: str):
+    errors, warnings = [], []
+    enc, _ = db._inspect_csv(csv_path)
+    first_line = {}
+    with open(csv_path, newline='', encoding=enc) as cf:
+        reader = csv.DictReader(cf)
+        missing = [c for c in REQUIRED_COLUMNS if c not in (reader.fieldnames or [])]
+        if missing:
+            errors.append(f"missing columns: {', '.join(missing)}")
+            return errors, warnings
+        for line, r in enumerate(reader, start=2):
+            try:
+                no = int(r["No."])
+            except (TypeError, ValueError):
+                errors.append(f"line {line}: invalid No. {r['No.']!r} (row is skipped when loading)")
+                continue
+            if no in first_line:
+                errors.append(
+                    f"line {line}: duplicate No.{no} (first on line {first_line[no]}; only that row is loaded)"
+                )
+                continue
+            first_line[no] = line
+
+            raw = (r["rate"] or "").strip()
+            try:
+                rate = float(raw)
+            except ValueError:
+                errors.append(f"line {line}: No.{no} rate {raw!r} is not a number (loaded as 0, never drawn)")
+                continue
+            if not math.isfinite(rate):
+                errors.append(f"line {line}: No.{no} rate {raw!r} is not finite")
+            elif rate < 0:
+                errors.append(f"line {line}: No.{no} negative rate {raw} (treated as 0, never drawn)")
+            elif rate == 0:
+                warnings.append(f"line {line}: No.{no} rate is 0 (never drawn)")
+            if r["rarity"] not in RARITY_ORDER:
+                warnings.append(f"line {line}: No.{no} unknown rarity {r['rarity']!r}")
+    return errors, warnings
+
+
+def load_items(csv_path: str) -> list:
+    # db.load_gacha_data と同じ結果になるように組み立てる
+    # （No. の重複は先の行だけが入り、rate は REAL 型で保存され、No. 順に読み出される）
+    enc, _ = db._inspect_csv(csv_path)
+    items = {}
+    for no, url, chname, rarity, rate, title in db._iter_catalog_rows(csv_path, enc):
+        if no not in items:
+            items[no] = {
+                "no": no, "url": url, "chname": chname, "rarity": rarity,
+                "rate": float(np.float32(rate)), "title": title,
+            }
+    return [items[no] for no in sorted(items)]
+
+
+# ─── 確率 ────────────────────────────────────────────
+def declared_probs(items: list) -> np.ndarray:
+    # AliasSampler と同じ正規化（負は 0、全部 0 なら等確率）
+    rates = np.array([max(0.0, float(it["rate"] or 0.0)) for it in items])
+    if rates.sum() <= 0:
+        return np.full(len(items), 1.0 / len(items))
+    return rates / rates.sum()
+
+
+def table_probs(sampler: draw.AliasSampler) -> np.ndarray:
+    # エイリアステーブルから逆算した、各カードが出る正確な確率
+    n = len(sampler)
+    prob = np.asarray(sampler.prob)
+    out = prob.copy()
+    np.add.at(out, np.asarray(sampler.alias), 1.0 - prob)
+    return out / n
+
+
+def simulate(sampler: draw.AliasSampler, draws: int) -> np.ndarray:
+    counts = np.zeros(len(sampler), dtype=np.int64)
+    left = draws
+    while left > 0:
+        n = min(CHUNK, left)
+        counts += np.bincount(sampler.draw_indices(n), minlength=len(sampler))
+        left -= n
+    return counts
+
+
+def simulate_single(sampler: draw.AliasSampler, draws: int) -> np.ndarray:
+    counts = np.zeros(len(sampler), dtype=np.int64)
+    for _ in range(draws):
+        counts[sampler.draw_index()] += 1
+    return counts
+
+
+def chi2_sf(x: float, df: int) -> float:
+    # カイ二乗分布の上側確率（Wilson–Hilferty 近似。df が数十あれば十分な精度）
+    if df <= 0:
+        return 1.0
+    c = 2.0 / (9.0 * df)
+    z = ((x / df) ** (1.0 / 3.0) - (1.0 - c)) / math.sqrt(c)
+    return 0.5 * math.erfc(z / math.sqrt(2.0))
+
+
+def chi_square(counts: np.ndarray, probs: np.ndarray):
+    mask = probs > 0
+    expected = counts.sum() * probs[mask]
+    stat = float(((counts[mask] - expected) ** 2 / expected).sum())
+    df = int(mask.sum()) - 1
+    return stat, df, chi2_sf(stat, df)
+
+
+def expected_completion(probs: np.ndarray, steps: int = 200_000) -> float:
+    # 指定したカードを全部引くまでの期待回数（等確率でないクーポン収集問題）
+    #   E = ∫_0^∞ (1 - Π_i (1 - e^{-p_i t})) dt
+    p = probs[probs > 0]
+    if len(p) < len(probs):
+        return math.inf
+    if not len(p):
+        return 0.0
+    upper = (math.log(len(p)) + 40.0) / p.min()  # ここから先の被積分関数は e^-40 未満
+    t = np.linspace(0.0, upper, steps + 1)
+    log_all = np.zeros_like(t)
+    with np.errstate(divide="ignore"):
+        for pi in p:
+            log_all += np.log1p(-np.exp(-pi * t))
+    f = -np.expm1(log_all)
+    return float((f.sum() - (f[0] + f[-1]) / 2) * (t[1] - t[0]))  # 台形則
+
+
+# ─── 出力 ────────────────────────────────────────────
+def pct(p: float) -> str:
+    return f"{p * 100:.4f}%"
+
+
+def report_file(args, name: str, csv_path: str) -> bool:
+    started = time.perf_counter()
+    print(f"== {name} ({csv_path}) ==")
+    errors, warnings = check_csv(csv_path)
+    items = load_items(csv_path) if not any(e.startswith("missing columns") for e in errors) else []
+    for e in errors:
+        print(f"ERROR {e}")
+    for w in warnings:
+        print(f"WARN  {w}")
+    if not items:
+        print("ERROR no cards would be loaded")
+        return False
+
+    rates = np.array([it["rate"] for it in items])
+    total = float(rates[rates > 0].sum())
+    print(f"cards: {len(items)}, rate sum {total:.6f}", end="")
+    if total > 0 and abs(total - 1.0) > RATE_SUM_TOLERANCE:
+        print(f" (normalized: every rate is scaled by {1.0 / total:.4f})")
+    else:
+        print()
+
+    sampler = draw.AliasSampler(items, random.Random(args.seed))
+    declared = declared_probs(items)
+    exact = table_probs(sampler)
+    drift = float(np.abs(exact - declared).max())
+    if drift > 1e-9:
+        errors.append("alias table")
+        print(f"ERROR alias table differs from the normalized rates by up to {drift:.3g}")
+
+    counts = simulate(sampler, args.draws)
+    observed = counts / counts.sum()
+    ok = not errors
+
+    # レア度ごと
+    by_rarity = defaultdict(list)
+    for i, it in enumerate(items):
+        by_rarity[it["rarity"]].append(i)
+    order = [r for r in RARITY_ORDER if r in by_rarity] + sorted(set(by_rarity) - set(RARITY_ORDER))
+    # complete = そのレア度のカードを全種揃えるまでの期待回数
+    print(f"{'rarity':<8}{'cards':>6}{'rate sum':>12}{'effective':>12}{'observed':>12}{'z':>8}{'complete':>12}")
+    for rarity in order:
+        idx = by_rarity[rarity]
+        p = float(declared[idx].sum())
+        o = float(observed[idx].sum())
+        sd = math.sqrt(p * (1 - p) / args.draws) if 0 < p < 1 else 0.0
+        z = (o - p) / sd if sd else 0.0
+        print(f"{rarity:<8}{len(idx):>6}{rates[idx].sum():>12.6f}{pct(p):>12}{pct(o):>12}{z:>+8.2f}"
+              f"{expected_completion(declared[idx]):>12.1f}")
+
+    # カードごと
+    sd = np.sqrt(declared * (1 - declared) / args.draws)
+    z = np.divide(observed - declared, sd, out=np.zeros_like(sd), where=sd > 0)
+    never = [items[i]["no"] for i in np.flatnonzero((declared == 0) & (counts > 0))]
+    if never:
+        ok = False
+        print(f"ERROR cards with rate 0 were drawn: {never}")
+    if args.cards:
+        print(f"{'No.':>5}  {'rarity':<6}{'effective':>12}{'observed':>12}{'z':>8}  chname / title")
+        for i, it in enumerate(items):
+            print(f"{it['no']:>5}  {it['rarity']:<6}{pct(declared[i]):>12}{pct(observed[i]):>12}{z[i]:>+8.2f}"
+                  f"  {it['chname']} / {it['title']}")
+    lo, hi = int(np.argmin(declared)), int(np.argmax(declared))
+    worst = int(np.argmax(np.abs(z)))
+    print(f"per card: min {pct(declared[lo])} (No.{items[lo]['no']}), max {pct(declared[hi])} "
+          f"(No.{items[hi]['no']}), largest |z| {abs(z[worst]):.2f} (No.{items[worst]['no']})")
+
+    # 検定（単発の経路も同じテーブルを使うので、件数を減らして確認する）
+    for label, n, c in (
+        ("multi-pull path", args.draws, counts),
+        ("single-pull path", args.single_draws, simulate_single(sampler, args.single_draws)),
+    ):
+        if not n:
+            continue
+        stat, df, p = chi_square(c, declared)
+        verdict = "OK" if p >= args.alpha else "FAIL"
+        if p < args.alpha:
+            ok = False
+        print(f"chi-square ({label}, {n:,} draws): {stat:.1f} on {df} df, p={p:.4f} {verdict}")
+
+    e_all = expected_completion(declared)
+    if math.isinf(e_all):
+        print("expected pulls to complete the set: never (some cards cannot be drawn)")
+    else:
+        print(f"expected pulls to complete the set: {e_all:.1f} (about {math.ceil(e_all / 10)} multi-pulls)")
+    print(f"({time.perf_counter() - started:.2f}s)")
+    print()
+    return ok and not errors
+
+
+def default_sources() -> list:
+    # gacha_types.json にある CSV は種別名で、それ以外はファイル名で表示する
+    names = {}
+    if os.path.exists("data/gacha_types.json"):
+        with open("data/gacha_types.json", encoding="utf-8") as f:
+            for gt in json.load(f):
+                names[os.path.normpath(gt["csv_path"])] = gt["gachatype"]
+    paths = sorted(glob.glob("data/gacha_data_*.csv"))
+    return [(names.get(os.path.normpath(p), os.path.basename(p)), p) for p in paths]
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("csv", nargs="*", help="調べる CSV（省略時は data/gacha_data_*.csv）")
+    ap.add_argument("--draws", type=int, default=DEFAULT_DRAWS, help="まとめ抽選の回数")
+    ap.add_argument("--single-draws", type=int, default=SINGLE_DRAWS, help="1回ずつ抽選する回数（0 で省略）")
+    ap.add_argument("--seed", type=int, default=None)
+    ap.add_argument("--alpha", type=float, default=0.001, help="カイ二乗検定の有意水準")
+    ap.add_argument("--cards", action="store_true", help="カードごとの表を出す")
+    args = ap.parse_args()
+    if args.seed is None:
+        args.seed = random.SystemRandom().randrange(2 ** 32)
+    print(f"seed: {args.seed}")
+
+    # 検査結果はこのツールで出すので、取り込み処理の警告ログは抑える
+    logging.getLogger(db.__name__).setLevel(logging.ERROR)
+    if args.csv:
+        sources = [(os.path.basename(p), p) for p in args.csv]
+    else:
+        os.chdir(os.path.join(os.path.dirname(__file__), ".."))
+        sources = default_sources()
+    results = [report_file(args, name, path) for name, path in sources]
+    if not all(results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()